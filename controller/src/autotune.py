@@ -0,0 +1,456 @@
+import argparse
+import itertools
+import math
+import os
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .control import MotorController
+from .control.cascade import CascadedFOCController
+from .control.foc import FOCController
+from .control.six_step import SixStepController
+from .control.trajectory import StepTrajectory
+from .detectors import Detector, DivergenceDetector, ErrorBudgetDetector, SteadyStateDetector
+from .headless import SimulationRecording, run_headless
+from .main import TIMESTEP
+from .metrics import compute_metrics
+from .motor_sim import SimIOInterface
+from .motor_sim.properties import MotorProperties, REV_NEO_PROPS, replace_properties
+from .sweep import MOTOR_PREFIX, parse_setting
+
+# Tunes controller gains with CMA-ES, a derivative-free optimizer that samples a population of candidates every
+# generation and adapts its search distribution towards the best of them. Every candidate is a simulated step
+# response, scored by an objective's cost (tracking error, overshoot and ripple), and each generation is
+# simulated across a process pool. Candidates whose tracking error already puts them well behind the best one
+# found so far are aborted mid-run, since the error integral only grows.
+#
+# Parameters are searched in a unit box, mapped to their ranges logarithmically for gains spanning decades.
+
+class TunedParameter(NamedTuple):
+    name: str
+    """A controller constructor argument."""
+    low: float
+    high: float
+    log: bool = True
+    """Search the range logarithmically."""
+
+    def from_unit(self, x: float) -> float:
+        x = min(max(x, 0.0), 1.0)
+        if self.log:
+            return self.low * (self.high / self.low) ** x
+        return self.low + (self.high - self.low) * x
+
+    def to_unit(self, value: float) -> float:
+        if self.log:
+            return math.log(value / self.low) / math.log(self.high / self.low)
+        return (value - self.low) / (self.high - self.low)
+
+@dataclass
+class CostWeights:
+    tracking: float = 1.0
+    """Weight of the integral of the absolute tracking error, relative to the step size and duration."""
+    overshoot: float = 1.0
+    """Weight of the peak overshoot past the setpoint, relative to the step size."""
+    ripple: float = 1.0
+    """Weight of the current ripple over the end of the run (see each objective)."""
+
+class CostBreakdown(NamedTuple):
+    cost: float
+    tracking: float
+    overshoot: float
+    ripple: float
+
+def get_step_response_cost(
+    times: np.ndarray,
+    response: np.ndarray,
+    setpoint: float,
+    ripple: float,
+    weights: CostWeights
+) -> CostBreakdown:
+    """The cost of a response to a step from 0 to `setpoint` at time 0, given its ripple relative to the step."""
+    duration = max(float(times[-1] - times[0]), 1e-12)
+    scale = abs(setpoint)
+    tracking = float(np.trapezoid(np.abs(response - setpoint), times)) / (duration * scale)
+    overshoot = max(0.0, float(np.max(response * math.copysign(1, setpoint))) - scale) / scale
+    cost = weights.tracking * tracking + weights.overshoot * overshoot + weights.ripple * ripple
+    return CostBreakdown(cost, tracking, overshoot, ripple)
+
+class TuningObjective(ABC):
+    """What to tune and how to score it: a controller, its tuned parameters and a cost for its step response."""
+
+    controller_type: type[MotorController]
+    duration: float
+    """The default simulated duration of a candidate in seconds."""
+    step: float
+    """The size of the setpoint step."""
+
+    @abstractmethod
+    def get_parameters(self, properties: MotorProperties) -> list[TunedParameter]:
+        pass
+
+    @abstractmethod
+    def get_defaults(self, properties: MotorProperties) -> dict[str, float]:
+        """The untuned values of the parameters, which the search starts from."""
+        pass
+
+    def get_controller_args(self, point: dict[str, float]) -> dict[str, Any]:
+        return dict(point)
+
+    def get_error(self, io: SimIOInterface, ctrl: MotorController) -> float | None:
+        """The tracking error while running, for aborting bad candidates, or None if it has none."""
+        return None
+
+    @abstractmethod
+    def get_cost(self, recording: SimulationRecording, properties: MotorProperties, weights: CostWeights) -> CostBreakdown:
+        pass
+
+def get_tail(values: np.ndarray, fraction: float = 0.2) -> np.ndarray:
+    return values[min(int(len(values) * (1 - fraction)), len(values) - 1):]
+
+class CurrentLoopObjective(TuningObjective):
+    """The FOC current loop's PI gains, from a q-axis current step. Ripple is the q-axis current's spread at the end."""
+
+    controller_type = FOCController
+    duration = 0.02
+    step = 1.0
+
+    def get_defaults(self, properties: MotorProperties) -> dict[str, float]:
+        # Whatever gains FOCController picks for its default bandwidth
+        ctrl = FOCController(SimIOInterface(properties))
+        return {"kp": ctrl.id_controller.kp, "ki": ctrl.id_controller.ki}
+
+    def get_parameters(self, properties: MotorProperties) -> list[TunedParameter]:
+        return [TunedParameter(name, value / 30, value * 30) for name, value in self.get_defaults(properties).items()]
+
+    def get_controller_args(self, point: dict[str, float]) -> dict[str, Any]:
+        # Negative q-axis current produces positive torque
+        return point | {"target_iq": -self.step}
+
+    def get_error(self, io: SimIOInterface, ctrl: MotorController) -> float | None:
+        assert isinstance(ctrl, FOCController)
+        return ctrl.current_dq[1] - ctrl.target_iq
+
+    def get_cost(self, recording: SimulationRecording, properties: MotorProperties, weights: CostWeights) -> CostBreakdown:
+        response = -np.asarray(recording.get("DQ Currents", "Q-axis"))
+        ripple = float(np.std(get_tail(response))) / self.step
+        return get_step_response_cost(np.asarray(recording.times), response, self.step, ripple, weights)
+
+class SpeedLoopObjective(TuningObjective):
+    """
+    The cascaded controller's speed loop PI gains, from a velocity step in mechanical rad/s.
+    Ripple is the spread of the torque current command at the end, relative to the controller's current limit.
+    """
+
+    controller_type = CascadedFOCController
+    duration = 0.3
+    step = 20.0
+    max_current = 5.0
+
+    def get_defaults(self, properties: MotorProperties) -> dict[str, float]:
+        # Whatever gains CascadedFOCController picks for its default speed bandwidth
+        ctrl = CascadedFOCController(SimIOInterface(properties))
+        return {"speed_kp": ctrl.speed_controller.kp, "speed_ki": ctrl.speed_controller.ki}
+
+    def get_parameters(self, properties: MotorProperties) -> list[TunedParameter]:
+        return [TunedParameter(name, value / 30, value * 30) for name, value in self.get_defaults(properties).items()]
+
+    def get_controller_args(self, point: dict[str, float]) -> dict[str, Any]:
+        return point | {
+            "mode": "speed",
+            "trajectory": StepTrajectory(0, self.step),
+            "max_current": self.max_current,
+            "max_velocity": self.step * 2
+        }
+
+    def get_error(self, io: SimIOInterface, ctrl: MotorController) -> float | None:
+        assert isinstance(ctrl, CascadedFOCController)
+        return ctrl.setpoint - ctrl.get_mechanical_velocity()
+
+    def get_cost(self, recording: SimulationRecording, properties: MotorProperties, weights: CostWeights) -> CostBreakdown:
+        response = np.asarray(recording.get("Outer Loop", "Velocity"))
+        ripple = float(np.std(get_tail(np.asarray(recording.get("Outer Loop", "Torque current"))))) / self.max_current
+        return get_step_response_cost(np.asarray(recording.times), response, self.step, ripple, weights)
+
+class SixStepObjective(TuningObjective):
+    """
+    The six-step controller's phase advance. Six-step has no setpoint to track, so the tracking term is the speed where the
+    line-to-line back EMF reaches the bus voltage divided by the steady-state speed, which phase advance lowers, and
+    ripple is the steady-state RMS current relative to the stall current, all of which is ripple without a load.
+    """
+
+    controller_type = SixStepController
+    duration = 0.5
+    step = 1.0
+
+    def get_defaults(self, properties: MotorProperties) -> dict[str, float]:
+        return {"phase_advance": 0.9}
+
+    def get_parameters(self, properties: MotorProperties) -> list[TunedParameter]:
+        return [TunedParameter("phase_advance", 0.0, 1.0, log=False)]
+
+    def get_cost(self, recording: SimulationRecording, properties: MotorProperties, weights: CostWeights) -> CostBreakdown:
+        metrics = compute_metrics(recording)
+        bemf_per_speed = math.sqrt(3) * properties.bemf_constant * properties.normed_bemf_coeffs[0] * properties.pole_pairs
+        speed = max(abs(metrics.steady_state_velocity) * 2 * math.pi / 60, 1e-9)
+        tracking = properties.vbus / bemf_per_speed / speed
+        ripple = metrics.rms_current * properties.phase_resistance / properties.vbus
+        cost = weights.tracking * tracking + weights.overshoot * metrics.overshoot + weights.ripple * ripple
+        return CostBreakdown(cost, tracking, metrics.overshoot, ripple)
+
+OBJECTIVES: dict[str, TuningObjective] = {
+    "current": CurrentLoopObjective(),
+    "speed": SpeedLoopObjective(),
+    "six-step": SixStepObjective()
+}
+
+@dataclass
+class TuneConfig:
+    objective: str = "current"
+    """A key of OBJECTIVES"""
+    properties: MotorProperties = field(default_factory=lambda: REV_NEO_PROPS)
+    duration: float | None = None
+    """Simulated seconds per candidate, or None for the objective's default."""
+    timestep: float = TIMESTEP
+    weights: CostWeights = field(default_factory=CostWeights)
+    abort_factor: float = 3.0
+    """Abort candidates once their tracking cost alone exceeds this many times the best cost so far."""
+
+class Evaluation(NamedTuple):
+    point: dict[str, float]
+    breakdown: CostBreakdown
+    stop_reason: str
+    """"duration", "settled", "diverged" or "aborted"."""
+    simulated_time: float
+
+def evaluate_candidate(config: TuneConfig, point: dict[str, float], best_cost: float) -> Evaluation:
+    """Simulate one candidate and score it. Runs in a worker process."""
+    objective = OBJECTIVES[config.objective]
+    duration = config.duration or objective.duration
+    detectors: list[Detector] = [DivergenceDetector()]
+    if math.isfinite(best_cost) and config.weights.tracking > 0 and type(objective).get_error is not TuningObjective.get_error:
+        # The tracking term is the error integral over duration * step, so this budget keeps the term under the bound
+        budget = config.abort_factor * best_cost / config.weights.tracking * duration * objective.step
+        detectors.append(ErrorBudgetDetector(objective.get_error, budget))
+    elif isinstance(objective, SixStepObjective):
+        detectors.append(SteadyStateDetector())
+
+    recording = run_headless(
+        objective.controller_type,
+        config.properties,
+        duration=duration,
+        timestep=config.timestep,
+        controller_args=objective.get_controller_args(point),
+        detectors=detectors
+    )
+    simulated_time = recording.steps * config.timestep
+    kind = recording.stop_reason.kind if recording.stop_reason is not None else "duration"
+    if kind == "diverged" or len(recording.times) < 2:
+        return Evaluation(point, CostBreakdown(math.inf, math.inf, math.inf, math.inf), kind, simulated_time)
+    if kind == "aborted":
+        # Never finished, so there is no cost to report (see get_ranking_costs)
+        return Evaluation(point, CostBreakdown(math.nan, math.nan, math.nan, math.nan), kind, simulated_time)
+    return Evaluation(point, objective.get_cost(recording, config.properties, config.weights), kind, simulated_time)
+
+def get_ranking_costs(evaluations: list[Evaluation], duration: float) -> np.ndarray:
+    """
+    Costs to rank a generation by: finished candidates by their cost, then aborted ones with those aborted
+    earlier ranked worse, then diverged ones. Only the order matters to CMA-ES.
+    """
+    finished = [evaluation.breakdown.cost for evaluation in evaluations if evaluation.stop_reason != "aborted"]
+    ceiling = max((cost for cost in finished if math.isfinite(cost)), default=0.0)
+    costs = []
+    for evaluation in evaluations:
+        if evaluation.stop_reason == "aborted":
+            costs.append(ceiling + 2 - evaluation.simulated_time / duration)
+        else:
+            costs.append(evaluation.breakdown.cost)
+    return np.array(costs)
+
+class CMAES:
+    """
+    The covariance matrix adaptation evolution strategy, with the standard parameter settings,
+    minimizing over the unit box. Samples outside the box are evaluated at the nearest point inside it
+    and penalized by their squared distance from it.
+    """
+
+    def __init__(self, mean: np.ndarray, sigma: float = 0.2, population: int | None = None, seed: int | None = None):
+        n = len(mean)
+        self.rng = np.random.default_rng(seed)
+        self.mean = np.array(mean, dtype=float)
+        self.sigma = sigma
+        self.population = population or 4 + int(3 * math.log(n))
+        self.parents = self.population // 2
+        weights = math.log(self.parents + 0.5) - np.log(np.arange(1, self.parents + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / float(np.sum(self.weights ** 2))
+
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))
+
+        self.pc = np.zeros(n)
+        self.ps = np.zeros(n)
+        self.covariance = np.eye(n)
+        self.generation = 0
+
+    def ask(self) -> np.ndarray:
+        """A population of candidates with shape (population, n)."""
+        (eigenvalues, eigenvectors) = np.linalg.eigh(self.covariance)
+        self._basis = eigenvectors * np.sqrt(np.maximum(eigenvalues, 1e-20))
+        self._inverse_sqrt = eigenvectors @ np.diag(1 / np.sqrt(np.maximum(eigenvalues, 1e-20))) @ eigenvectors.T
+        return self.mean + self.sigma * self.rng.standard_normal((self.population, len(self.mean))) @ self._basis.T
+
+    @staticmethod
+    def clip(candidates: np.ndarray) -> np.ndarray:
+        return np.clip(candidates, 0.0, 1.0)
+
+    @staticmethod
+    def get_penalty(candidates: np.ndarray) -> np.ndarray:
+        return np.sum((candidates - CMAES.clip(candidates)) ** 2, axis=1)
+
+    def tell(self, candidates: np.ndarray, costs: np.ndarray):
+        """Update the search distribution from the costs of the candidates from `ask`."""
+        n = len(self.mean)
+        order = np.argsort(costs + self.get_penalty(candidates), kind="stable")
+        selected = candidates[order[:self.parents]]
+        old_mean = self.mean
+        self.mean = self.weights @ selected
+        step = (self.mean - old_mean) / self.sigma
+
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * (self._inverse_sqrt @ step)
+        self.generation += 1
+        ps_norm = float(np.linalg.norm(self.ps))
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.generation)) / self.chi_n < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+
+        deviations = (selected - old_mean) / self.sigma
+        self.covariance = (
+            (1 - self.c1 - self.cmu) * self.covariance
+            + self.c1 * (np.outer(self.pc, self.pc) + (not hsig) * self.cc * (2 - self.cc) * self.covariance)
+            + self.cmu * (deviations.T * self.weights) @ deviations
+        )
+        self.sigma *= math.exp((self.cs / self.damps) * (ps_norm / self.chi_n - 1))
+
+@dataclass
+class TuneResult:
+    parameters: list[TunedParameter]
+    best: Evaluation
+    default: Evaluation
+    """The untuned parameters' evaluation, for comparison."""
+    history: list[tuple[int, float]] = field(default_factory=list)
+    """The evaluations so far and best cost after each generation."""
+    evaluations: int = 0
+    aborted: int = 0
+    simulated_time: float = 0.0
+    wall_time: float = 0.0
+
+    def format(self) -> str:
+        lines = [
+            f"Evaluated {self.evaluations} candidates ({self.aborted} aborted early), "
+            f"simulating {self.simulated_time:.2f} s in {self.wall_time:.2f} s",
+            f"Default cost: {self.default.breakdown.cost:.5g}",
+            f"Tuned cost: {self.best.breakdown.cost:.5g} (tracking {self.best.breakdown.tracking:.4g}, "
+            f"overshoot {self.best.breakdown.overshoot:.4g}, ripple {self.best.breakdown.ripple:.4g})",
+            "Tuned parameters:"
+        ]
+        for parameter in self.parameters:
+            lines.append(f"    controller.{parameter.name}={self.best.point[parameter.name]:.6g}")
+        return "\n".join(lines)
+
+def autotune(
+    config: TuneConfig,
+    max_evaluations: int = 200,
+    population: int | None = None,
+    workers: int | None = None,
+    seed: int | None = None,
+    tolerance: float = 1e-3,
+    verbose: bool = False
+) -> TuneResult:
+    """
+    Tune the objective's parameters for `config.properties`, starting from their defaults. Stops after
+    `max_evaluations` candidates or once the search distribution shrinks below `tolerance` of the unit box.
+    """
+    objective = OBJECTIVES[config.objective]
+    parameters = objective.get_parameters(config.properties)
+    defaults = objective.get_defaults(config.properties)
+    start_time = time.perf_counter()
+
+    def to_point(x: np.ndarray) -> dict[str, float]:
+        return {parameter.name: parameter.from_unit(float(value)) for parameter, value in zip(parameters, x)}
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        default = evaluate_candidate(config, defaults, math.inf)
+        result = TuneResult(parameters, default, default, evaluations=1, simulated_time=default.simulated_time)
+
+        optimizer = CMAES(
+            np.array([parameter.to_unit(defaults[parameter.name]) for parameter in parameters]),
+            population=population,
+            seed=seed
+        )
+        while result.evaluations < max_evaluations and optimizer.sigma > tolerance:
+            candidates = optimizer.ask()
+            points = [to_point(x) for x in CMAES.clip(candidates)]
+            best_cost = result.best.breakdown.cost
+            evaluations = list(executor.map(evaluate_candidate, itertools.repeat(config), points, itertools.repeat(best_cost)))
+            optimizer.tell(candidates, get_ranking_costs(evaluations, config.duration or objective.duration))
+
+            for evaluation in evaluations:
+                result.evaluations += 1
+                result.aborted += evaluation.stop_reason == "aborted"
+                result.simulated_time += evaluation.simulated_time
+                if evaluation.breakdown.cost < result.best.breakdown.cost and evaluation.stop_reason != "aborted":
+                    result.best = evaluation
+            result.history.append((result.evaluations, result.best.breakdown.cost))
+            if verbose:
+                print(f"Generation {optimizer.generation}: best cost {result.best.breakdown.cost:.5g} after {result.evaluations} candidates")
+
+    result.wall_time = time.perf_counter() - start_time
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune controller gains against simulated step responses.")
+    parser.add_argument("--objective", choices=list(OBJECTIVES), default="current")
+    parser.add_argument(
+        "--motor", action="append", default=[], metavar="FIELD=VALUE",
+        help="Override a MotorProperties field of the REV NEO, e.g. phase_inductance=0.002"
+    )
+    parser.add_argument("--duration", type=float, default=None, help="Simulated seconds per candidate")
+    parser.add_argument("--timestep", type=float, default=TIMESTEP)
+    parser.add_argument("--tracking-weight", type=float, default=1.0)
+    parser.add_argument("--overshoot-weight", type=float, default=1.0)
+    parser.add_argument("--ripple-weight", type=float, default=1.0)
+    parser.add_argument("--abort-factor", type=float, default=3.0, help="Abort candidates this many times worse than the best")
+    parser.add_argument("--max-evaluations", type=int, default=200)
+    parser.add_argument("--population", type=int, default=None, help="Candidates per generation")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of cores")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        properties = replace_properties(REV_NEO_PROPS, dict(parse_setting(spec, MOTOR_PREFIX) for spec in args.motor))
+    except (ValueError, TypeError) as e:
+        parser.error(str(e))
+
+    config = TuneConfig(
+        objective=args.objective,
+        properties=properties,
+        duration=args.duration,
+        timestep=args.timestep,
+        weights=CostWeights(args.tracking_weight, args.overshoot_weight, args.ripple_weight),
+        abort_factor=args.abort_factor
+    )
+    print(f"--- Tuning the {args.objective} objective ---")
+    result = autotune(config, args.max_evaluations, args.population, args.workers, args.seed, verbose=True)
+    print(result.format())
+
+if __name__ == "__main__":
+    main()
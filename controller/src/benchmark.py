@@ -0,0 +1,216 @@
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, NamedTuple
+
+from .control import transforms
+from .headless import CONTROLLER_TYPES, BATCHED_CONTROLLER_TYPES
+from .main import TIMESTEP
+from .motor_sim import SimIOInterface
+from .motor_sim.batched import BatchedSimIOInterface
+from .motor_sim.properties import REV_NEO_PROPS
+
+DEFAULT_HISTORY_PATH = "benchmark_history.json"
+
+class Benchmark(NamedTuple):
+    name: str
+    setup: Callable[[], Callable[[], None]]
+    """Builds the state for the benchmark and returns the function to time."""
+    ops_per_call: int = 1
+    """How many operations one call of the timed function performs, e.g. motors in a batch."""
+
+def make_step_loop(controller: str) -> Callable[[], None]:
+    io = SimIOInterface(REV_NEO_PROPS)
+    ctrl = CONTROLLER_TYPES[controller](io)
+    def step():
+        io.update(TIMESTEP, ctrl.get_phase_voltages(TIMESTEP))
+    return step
+
+BATCH_SIZE = 256
+
+def make_batched_step_loop(controller: str) -> Callable[[], None]:
+    io = BatchedSimIOInterface([REV_NEO_PROPS] * BATCH_SIZE)
+    ctrl = BATCHED_CONTROLLER_TYPES[controller](io)
+    def step():
+        io.update(TIMESTEP, ctrl.get_phase_voltages(TIMESTEP))
+    return step
+
+def make_transforms() -> Callable[[], None]:
+    def run():
+        clarke = transforms.clarke_transform(1.0, -0.4, -0.6)
+        dq = transforms.park_transform(clarke, 0.7)
+        transforms.inverse_clarke_transform(transforms.inverse_park_transform(dq, 0.7))
+    return run
+
+def make_backemfs() -> Callable[[], None]:
+    properties = REV_NEO_PROPS
+    def run():
+        properties.get_phase_backemfs(1.234, 300.0)
+    return run
+
+def make_plot_sampling() -> Callable[[], None]:
+    import dearpygui.dearpygui as dpg
+    from .plot import TimeSeriesPlot
+
+    dpg.create_context()
+    with dpg.window():
+        plot = TimeSeriesPlot("Benchmark", "Value", history_length=0.05, sample_interval=TIMESTEP)
+    elapsed = 0.0
+    def run():
+        nonlocal elapsed
+        elapsed += TIMESTEP
+        plot.add_data_point(elapsed, {"Phase U": 1.0, "Phase V": -0.5, "Phase W": -0.5})
+    return run
+
+BENCHMARKS: list[Benchmark] = [
+    Benchmark("step/FOC", lambda: make_step_loop("FOC")),
+    Benchmark("step/Six-step", lambda: make_step_loop("Six-step")),
+    Benchmark(f"batched_step/FOC x{BATCH_SIZE}", lambda: make_batched_step_loop("FOC"), BATCH_SIZE),
+    Benchmark(f"batched_step/Six-step x{BATCH_SIZE}", lambda: make_batched_step_loop("Six-step"), BATCH_SIZE),
+    Benchmark("transforms/round_trip", make_transforms),
+    Benchmark("properties/get_phase_backemfs", make_backemfs),
+    Benchmark("plot/add_data_point", make_plot_sampling)
+]
+
+def measure(function: Callable[[], None], min_time: float = 0.2, repeats: int = 5) -> float:
+    """Returns the best calls per second over `repeats` runs of at least `min_time` seconds each."""
+    # Find a call count that takes long enough to time accurately
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time / 4:
+            break
+        calls *= 4
+    calls = max(1, math.ceil(calls * min_time / max(elapsed, 1e-9)))
+
+    best = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(calls):
+            function()
+        best = min(best, time.perf_counter() - start)
+    return calls / best
+
+def run_benchmarks(selected: str | None = None, min_time: float = 0.2, repeats: int = 5) -> dict[str, float]:
+    """Run every benchmark whose name contains `selected`, returning operations per second by name."""
+    results: dict[str, float] = {}
+    for benchmark in BENCHMARKS:
+        if selected is not None and selected not in benchmark.name:
+            continue
+        try:
+            function = benchmark.setup()
+        except ImportError as error:
+            print(f"Skipping {benchmark.name}: {error}")
+            continue
+        results[benchmark.name] = measure(function, min_time, repeats) * benchmark.ops_per_call
+    return results
+
+def get_git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def load_history(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as file:
+        return json.load(file)
+
+def save_history(path: str, history: list[dict]):
+    with open(path, "w") as file:
+        json.dump(history, file, indent=2)
+
+def get_baseline(history: list[dict]) -> dict[str, float]:
+    """
+    The latest saved result of every benchmark, so runs that only saved some benchmarks don't hide the rest.
+    Results a run flagged as regressions are skipped, so a slowdown doesn't become the new baseline,
+    until a run saved with --accept takes an intended slowdown as the new baseline.
+    """
+    baseline: dict[str, float] = {}
+    for run in history:
+        regressed = run.get("regressions", {})
+        for name, ops in run["results"].items():
+            if name not in regressed:
+                baseline[name] = ops
+    return baseline
+
+def find_regressions(baseline: dict[str, float], results: dict[str, float], threshold: float) -> dict[str, float]:
+    """Returns the relative change of every benchmark that slowed down by more than `threshold` (e.g. 0.1 for 10%)."""
+    regressions: dict[str, float] = {}
+    for name, ops in results.items():
+        if name in baseline:
+            change = ops / baseline[name] - 1
+            if change < -threshold:
+                regressions[name] = change
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulation hot path and track regressions.")
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--history", default=DEFAULT_HISTORY_PATH, help="JSON file of previous results")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per timed repeat")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-save", action="store_true", help="Don't append this run to the history")
+    parser.add_argument("--save-filtered", action="store_true", help="Append this run to the history even with --filter")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 if anything regressed")
+    parser.add_argument(
+        "--accept", action="store_true",
+        help="Save this run as the new baseline even where it regressed, e.g. after an intended slowdown"
+    )
+    args = parser.parse_args()
+    if args.accept and args.no_save:
+        parser.error("--accept saves the run, so it can't be combined with --no-save")
+
+    print("--- FOC motor controller benchmarks ---")
+    history = load_history(args.history)
+    baseline = get_baseline(history)
+
+    results = run_benchmarks(args.filter, args.min_time, args.repeats)
+    regressions = find_regressions(baseline, results, args.threshold)
+
+    width = max(len(name) for name in results) if results else 0
+    for name, ops in results.items():
+        line = f"{name.ljust(width)}  {ops:14,.0f} ops/s"
+        if name in baseline:
+            line += f"  ({(ops / baseline[name] - 1) * 100:+.1f}% vs baseline)"
+        if name in regressions:
+            line += "  REGRESSION"
+        print(line)
+
+    # Filtered runs are usually quick checks while optimizing one thing, so only save them on request
+    if args.accept or (not args.no_save and (args.filter is None or args.save_filtered)):
+        history.append({
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "revision": get_git_revision(),
+            "python": sys.version.split()[0],
+            "machine": platform.machine(),
+            "filter": args.filter,
+            "results": results,
+            # Accepted regressions are saved as none, so they become the baseline
+            "regressions": {} if args.accept else regressions,
+            "accepted": args.accept
+        })
+        save_history(args.history, history)
+
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold * 100:.0f}%")
+        if args.accept:
+            print("Accepted this run as the new baseline")
+        elif args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
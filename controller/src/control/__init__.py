@@ -1,15 +1,35 @@
 from abc import ABC, abstractmethod
-from ..motor_sim import SimIOInterface
+from typing import Any
+from ..io_interface import IOInterface
+from .modulation import DutyCycles, Modulator, SpaceVectorModulator
 
 class MotorController(ABC):
+    io: IOInterface
+    modulator: Modulator = SpaceVectorModulator()
+    
     @abstractmethod
-    def __init__(self, io: SimIOInterface):
+    def __init__(self, io: IOInterface):
         pass
     
     @abstractmethod
     def get_phase_voltages(self, dt: float) -> tuple[float, float, float]:
         pass
     
+    def get_duty_cycles(self, dt: float) -> DutyCycles:
+        """The PWM duty cycles to drive an inverter with, modulated from `get_phase_voltages` by default."""
+        return self.modulator.modulate(self.get_phase_voltages(dt), self.io.properties.vbus)
+    
     @abstractmethod
     def reset(self):
-        pass
\ No newline at end of file
+        pass
+    
+    def get_state(self) -> dict[str, Any]:
+        """
+        The controller's dynamic state, like integrators and estimates, for continuing from a snapshot (see snapshot.py).
+        Gains and other configuration aren't included, so the state can be loaded into a differently tuned controller.
+        """
+        return {}
+    
+    def set_state(self, state: dict[str, Any]):
+        """Load a state from `get_state`, possibly of another controller of the same type."""
+        pass
@@ -0,0 +1,110 @@
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from ..motor_sim.batched import BatchedSimIOInterface, PHASE_OFFSETS
+from .estimators import BatchedEstimator, BATCHED_ESTIMATOR_TYPES
+from .foc_kernel import BatchedFOCKernel
+
+# Batched versions of the controllers that drive N motors in lockstep through a BatchedSimIOInterface.
+# Their per-motor behavior matches FOCController and SixStepController exactly.
+
+class BatchedMotorController(ABC):
+    @abstractmethod
+    def __init__(self, io: BatchedSimIOInterface):
+        pass
+
+    @abstractmethod
+    def get_phase_voltages(self, dt: float) -> np.ndarray:
+        """Returns the phase voltages for every motor with shape (N, 3)."""
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+class BatchedFOCController(BatchedMotorController):
+    io: BatchedSimIOInterface
+    angle: np.ndarray # Radians, q-axis electrical angle from the estimator
+    vel: np.ndarray # Electrical rad/s, estimated
+    estimator: BatchedEstimator
+
+    kp: np.ndarray
+    ki: np.ndarray
+
+    target_id: np.ndarray
+    target_iq: np.ndarray
+
+    kernel: BatchedFOCKernel
+
+    def __init__(self, io: BatchedSimIOInterface, bandwidth: np.ndarray | float = 10000, estimator: str = "encoder"):
+        self.io = io
+        n = len(io)
+        self.estimator = BATCHED_ESTIMATOR_TYPES[estimator](io)
+        (self.kp, self.ki) = self.make_motor_pi_params(np.broadcast_to(bandwidth, (n,)).astype(float))
+        self.kernel = BatchedFOCKernel(self.kp, self.ki, io.properties.vbus)
+        self.reset()
+
+    def make_motor_pi_params(self, bandwidth: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        p = self.io.properties.phase_inductance * bandwidth
+        i = self.io.properties.phase_resistance * bandwidth
+        return (p, i)
+
+    def reset(self):
+        n = len(self.io)
+        self.angle = np.zeros(n)
+        self.vel = np.zeros(n)
+        self.estimator.reset()
+        self.target_id = np.zeros(n)
+        self.target_iq = np.full(n, -1.0)
+        self.kernel.reset()
+
+    @property
+    def integral(self) -> np.ndarray:
+        """The d-axis and q-axis PI integral terms with shape (N, 2)"""
+        return self.kernel.integral
+
+    @property
+    def current_dq(self) -> np.ndarray:
+        return self.kernel.current_dq
+
+    @property
+    def output_dq(self) -> np.ndarray:
+        return self.kernel.output_dq
+
+    @property
+    def dq_integral_terms(self) -> np.ndarray:
+        return self.kernel.integral
+
+    def get_phase_voltages(self, dt: float) -> np.ndarray:
+        self.estimator.update(dt)
+        q_axis_angle = self.estimator.angle + math.pi / 4
+        self.vel = self.estimator.velocity
+        self.angle = q_axis_angle
+
+        return self.kernel.step(self.io.get_phase_currents(), q_axis_angle, self.target_id, self.target_iq, dt)
+
+class BatchedSixStepController(BatchedMotorController):
+    io: BatchedSimIOInterface
+    phase_advance: np.ndarray
+    """Proportion of a cycle (0 to 1) for each motor"""
+    estimator: BatchedEstimator
+
+    def __init__(self, io: BatchedSimIOInterface, phase_advance: np.ndarray | float = 0.9, estimator: str = "encoder"):
+        self.io = io
+        self.phase_advance = np.broadcast_to(phase_advance, (len(io),)).astype(float)
+        self.estimator = BATCHED_ESTIMATOR_TYPES[estimator](io)
+
+    def reset(self):
+        self.estimator.reset()
+
+    def get_phase_voltages(self, dt: float) -> np.ndarray:
+        self.estimator.update(dt)
+        progress = self.estimator.angle % (2 * math.pi) / (2 * math.pi)
+
+        # Phase offsets in cycles are 0, 1/3 and 2/3
+        phase_progress = (progress + self.phase_advance)[:, None] - PHASE_OFFSETS / (2 * math.pi)
+        # Wrap to (0, 1] like SixStepController.get_commutation_state
+        phase_progress = -((-phase_progress) % 1) + 1
+        return (phase_progress >= 0.5) * self.io.properties.vbus[:, None]
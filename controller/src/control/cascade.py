@@ -0,0 +1,217 @@
+import math
+from typing import Any
+
+from ..io_interface import IOInterface
+from .estimators import wrap_angle
+from .fixed_point import FixedPointMath
+from .foc import FOCController
+from .trajectory import ConstantTrajectory, Trajectory
+
+# Speed and position loops cascaded around FOCController's current loops, like FOC firmware:
+# position error -> velocity setpoint -> torque current setpoint -> d/q current loops.
+# The outer loops run every `outer_loop_divider` control ticks, since the mechanical dynamics
+# are orders of magnitude slower than the electrical ones.
+
+CONTROL_MODES = ("current", "speed", "position")
+
+class LimitedPIController:
+    """A PI controller with a symmetric output limit that stops integrating while saturated (anti-windup)."""
+
+    kp: float
+    ki: float
+    limit: float
+    int: float
+
+    def __init__(self, kp: float, ki: float, limit: float):
+        self.kp = kp
+        self.ki = ki
+        self.limit = limit
+        self.int = 0.0
+
+    def reset(self):
+        self.int = 0.0
+
+    def compute(self, error: float, dt: float) -> float:
+        integral = self.int + error * self.ki * dt
+        output = self.kp * error + integral
+        if abs(output) <= self.limit:
+            self.int = integral
+            return output
+        # Only keep integrating if that pulls the output back out of saturation
+        if (error > 0) != (output > 0):
+            self.int = integral
+        return math.copysign(self.limit, output)
+
+class CascadedFOCController(FOCController):
+    """
+    FOC with selectable outer loops. In "current" mode the trajectory sets the torque current directly,
+    in "speed" mode it sets the mechanical velocity in rad/s and in "position" mode the multi-turn
+    mechanical position in radians, measured from where the controller started.
+    """
+
+    mode: str
+    """One of CONTROL_MODES"""
+    trajectory: Trajectory | None
+    """The setpoint over time, or None to hold a setpoint of 0."""
+    outer_loop_divider: int
+    """The number of control ticks per outer loop update."""
+    speed_controller: LimitedPIController
+    """Mechanical velocity error in rad/s -> torque current in amps"""
+    position_gain: float
+    """Position error in radians -> velocity setpoint in rad/s"""
+    max_velocity: float
+
+    elapsed: float
+    position: float
+    """The estimated multi-turn mechanical position in radians."""
+    setpoint: float
+    velocity_setpoint: float
+    torque_current: float
+    """The torque current command in amps, positive for positive torque."""
+    _last_electrical_angle: float | None
+
+    def __init__(
+        self,
+        io: IOInterface,
+        bandwidth: float = 10000,
+        fused: bool = True,
+        estimator: str = "encoder",
+        mode: str = "speed",
+        trajectory: Trajectory | None = None,
+        outer_loop_divider: int = 10,
+        speed_bandwidth: float = 100,
+        max_current: float = 5,
+        max_velocity: float = 50,
+        fixed_point: FixedPointMath | None = None,
+        kp: float | None = None,
+        ki: float | None = None,
+        speed_kp: float | None = None,
+        speed_ki: float | None = None
+    ):
+        """`speed_kp` and `speed_ki` override the speed loop gains `make_speed_pi_params` picks for `speed_bandwidth`."""
+        super().__init__(io, bandwidth, fused, estimator, fixed_point, kp, ki)
+        if mode not in CONTROL_MODES:
+            raise ValueError(f"mode must be one of {CONTROL_MODES}, got {mode!r}")
+        if outer_loop_divider < 1:
+            raise ValueError(f"outer_loop_divider must be at least 1, got {outer_loop_divider}")
+        self.mode = mode
+        self.trajectory = trajectory
+        self.outer_loop_divider = round(outer_loop_divider)
+        self.max_velocity = max_velocity
+
+        (p, i) = self.make_speed_pi_params(speed_bandwidth)
+        p = p if speed_kp is None else speed_kp
+        i = i if speed_ki is None else speed_ki
+        self.speed_controller = LimitedPIController(p, i, max_current)
+        # Keep the position loop well inside the speed loop's bandwidth
+        self.position_gain = speed_bandwidth / 4
+        self._reset_outer_loops()
+
+    def get_torque_constant(self) -> float:
+        """The approximate torque per amp of torque current in Nm/A."""
+        props = self.io.properties
+        # FOCController's q-axis angle leads the back EMF by pi/4, so only cos(pi/4) of the current produces torque
+        return props.bemf_constant * props.normed_bemf_coeffs[0] * math.cos(math.pi / 4)
+
+    def make_speed_pi_params(self, bandwidth: float) -> tuple[float, float]:
+        """PI gains that place the speed loop's crossover at `bandwidth` in rad/s, with the integral zero a quarter of that."""
+        p = self.io.properties.rotor_inertia * bandwidth / self.get_torque_constant()
+        i = p * bandwidth / 4
+        return (p, i)
+
+    def _reset_outer_loops(self):
+        self.elapsed = 0.0
+        self.position = 0.0
+        self.setpoint = 0.0
+        self.velocity_setpoint = 0.0
+        self.torque_current = 0.0
+        self.target_iq = 0
+        self._ticks_until_outer_loop = 0
+        self._last_electrical_angle = None
+
+    def reset(self):
+        super().reset()
+        self.speed_controller.reset()
+        self._reset_outer_loops()
+
+    def get_state(self) -> dict[str, Any]:
+        return super().get_state() | {
+            "mode": self.mode,
+            "trajectory": self.trajectory,
+            "speed_integral": self.speed_controller.int,
+            "elapsed": self.elapsed,
+            "position": self.position,
+            "setpoint": self.setpoint,
+            "velocity_setpoint": self.velocity_setpoint,
+            "torque_current": self.torque_current,
+            "ticks_until_outer_loop": self._ticks_until_outer_loop,
+            "last_electrical_angle": self._last_electrical_angle
+        }
+
+    def set_state(self, state: dict[str, Any]):
+        super().set_state(state)
+        self.mode = state["mode"]
+        self.trajectory = state["trajectory"]
+        self.speed_controller.int = state["speed_integral"]
+        self.elapsed = state["elapsed"]
+        self.position = state["position"]
+        self.setpoint = state["setpoint"]
+        self.velocity_setpoint = state["velocity_setpoint"]
+        self.torque_current = state["torque_current"]
+        self._ticks_until_outer_loop = min(state["ticks_until_outer_loop"], self.outer_loop_divider - 1)
+        self._last_electrical_angle = state["last_electrical_angle"]
+
+    def get_mechanical_velocity(self) -> float:
+        return self.estimator.velocity / self.io.properties.pole_pairs
+
+    def get_measurement(self) -> float:
+        """The measured quantity the current mode controls."""
+        match self.mode:
+            case "current":
+                return self.torque_current
+            case "position":
+                return self.position
+        return self.get_mechanical_velocity()
+
+    def set_mode(self, mode: str):
+        """Switch the outer loop, keeping the current state as the setpoint so the motor doesn't jump."""
+        if mode not in CONTROL_MODES:
+            raise ValueError(f"mode must be one of {CONTROL_MODES}, got {mode!r}")
+        if mode != self.mode:
+            self.mode = mode
+            self.speed_controller.reset()
+            self.setpoint = self.get_measurement()
+            self.trajectory = ConstantTrajectory(self.setpoint)
+
+    def update_outer_loops(self, dt: float):
+        """Run the speed and position loops `dt` seconds after their last update and set the torque current."""
+        self.setpoint = self.trajectory.get_setpoint(self.elapsed) if self.trajectory is not None else 0.0
+
+        match self.mode:
+            case "current":
+                self.torque_current = self.setpoint
+                return
+            case "position":
+                error = self.setpoint - self.position
+                self.velocity_setpoint = max(-self.max_velocity, min(self.max_velocity, self.position_gain * error))
+            case _:
+                self.velocity_setpoint = self.setpoint
+
+        self.torque_current = self.speed_controller.compute(self.velocity_setpoint - self.get_mechanical_velocity(), dt)
+
+    def get_phase_voltages(self, dt: float) -> tuple[float, float, float]:
+        # Track the multi-turn position from the estimator's angle, as of the last tick
+        angle = self.estimator.angle
+        if self._last_electrical_angle is not None:
+            self.position += wrap_angle(angle - self._last_electrical_angle) / self.io.properties.pole_pairs
+        self._last_electrical_angle = angle
+
+        if self._ticks_until_outer_loop == 0:
+            self.update_outer_loops(dt * self.outer_loop_divider)
+            # Negative q-axis current produces positive torque in this controller's convention
+            self.target_iq = -self.torque_current
+            self._ticks_until_outer_loop = self.outer_loop_divider
+        self._ticks_until_outer_loop -= 1
+        self.elapsed += dt
+
+        return super().get_phase_voltages(dt)
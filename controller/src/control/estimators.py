@@ -0,0 +1,311 @@
+import copy
+import math
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from ..io_interface import IOInterface
+from ..motor_sim.batched import BatchedSimIOInterface
+from .transforms import SQRT3
+
+# Rotor angle and velocity estimators for the controllers. Every estimator tracks the electrical angle
+# (as used by the back EMF waveform) and the electrical angular velocity, and does a constant amount of
+# work per update so it can run in the control loop. Each has a batched equivalent for BatchedSimIOInterface.
+#
+# The sensorless observer works on stator flux in the amplitude-invariant alpha-beta frame. With the back EMF
+# of phase U being Ke * w * c1 * sin(angle) for fundamental coefficient c1, the rotor flux is
+# -Ke * c1 * (cos(angle), sin(angle)).
+
+def wrap_angle(angle: float) -> float:
+    """Wrap an angle difference to [-pi, pi)."""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+class Estimator(ABC):
+    io: IOInterface
+    angle: float
+    """The estimated electrical angle in radians, in [0, 2pi)."""
+    velocity: float
+    """The estimated electrical angular velocity in rad/s."""
+
+    @abstractmethod
+    def __init__(self, io: IOInterface):
+        pass
+
+    @abstractmethod
+    def update(self, dt: float):
+        """Update the estimate from the current IO readings, `dt` seconds after the last update."""
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+    def copy_to(self, io: IOInterface) -> "Estimator":
+        """A copy of this estimator and its state that reads from `io` instead."""
+        return copy.deepcopy(self, {id(self.io): io})
+
+class EncoderEstimator(Estimator):
+    """Reads the angle straight from the encoder and differentiates it for velocity, which is noisy."""
+
+    io: IOInterface
+
+    def __init__(self, io: IOInterface):
+        self.io = io
+        self.reset()
+
+    def reset(self):
+        self.angle = 0.0
+        self.velocity = 0.0
+
+    def update(self, dt: float):
+        angle = self.io.properties.mechanical_to_electrical_angle(self.io.get_encoder_position())
+        self.velocity = wrap_angle(angle - self.angle) / dt
+        self.angle = angle
+
+class AngleTracker:
+    """
+    A type 2 phase-locked loop that tracks a measured angle, estimating velocity from the integral
+    of the phase error instead of differentiating. Critically damped with the given bandwidth in rad/s.
+    """
+
+    kp: float
+    ki: float
+    angle: float
+    velocity: float
+
+    def __init__(self, bandwidth: float):
+        self.kp = 2 * bandwidth
+        self.ki = bandwidth * bandwidth
+        self.reset()
+
+    def reset(self, angle: float = 0.0):
+        self.angle = angle
+        self.velocity = 0.0
+
+    def track(self, measured_angle: float, dt: float):
+        error = wrap_angle(measured_angle - self.angle)
+        self.velocity += self.ki * error * dt
+        self.angle = (self.angle + (self.velocity + self.kp * error) * dt) % (2 * math.pi)
+
+class PLLEstimator(Estimator):
+    """Tracks the encoder angle with a PLL, giving a smooth velocity at the cost of some lag."""
+
+    io: IOInterface
+    tracker: AngleTracker
+
+    def __init__(self, io: IOInterface, bandwidth: float = 2000):
+        self.io = io
+        self.tracker = AngleTracker(bandwidth)
+        self.reset()
+
+    def reset(self):
+        self.tracker.reset()
+        self.angle = 0.0
+        self.velocity = 0.0
+
+    def update(self, dt: float):
+        measured = self.io.properties.mechanical_to_electrical_angle(self.io.get_encoder_position())
+        self.tracker.track(measured, dt)
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+
+class FluxObserver(Estimator):
+    """
+    Sensorless estimation from the phase voltages and currents alone, using the nonlinear flux observer
+    of Ortega et al. It integrates the stator flux from v - R * i, and pulls the rotor flux (stator flux minus L * i)
+    back onto a circle of the known flux magnitude, which removes integrator drift without a high-pass filter.
+    The angle comes from the rotor flux and the velocity from a PLL tracking it.
+    Like every back EMF method, it loses the angle near standstill, so it starts out assuming angle 0.
+    """
+
+    io: IOInterface
+    flux_gain: float
+    """How fast the flux estimate converges onto the known magnitude, in 1/s."""
+    tracker: AngleTracker
+    flux: tuple[float, float]
+    """The estimated alpha-beta stator flux in Wb."""
+    last_current: tuple[float, float]
+
+    def __init__(self, io: IOInterface, flux_gain: float = 2000, bandwidth: float = 2000):
+        self.io = io
+        self.flux_gain = flux_gain
+        self.tracker = AngleTracker(bandwidth)
+        self.reset()
+
+    def reset(self):
+        props = self.io.properties
+        self.tracker.reset()
+        self.angle = 0.0
+        self.velocity = 0.0
+        self.last_current = (0.0, 0.0)
+        self.flux = (-props.bemf_constant * props.normed_bemf_coeffs[0], 0.0)
+
+    def update(self, dt: float):
+        props = self.io.properties
+        r = props.phase_resistance
+        l = props.phase_inductance
+        flux_magnitude = props.bemf_constant * props.normed_bemf_coeffs[0]
+
+        # Amplitude-invariant Clarke transforms, which drop the common mode voltage from the modulator
+        (v_u, v_v, v_w) = self.io.last_phase_voltages
+        v_alpha = (2 * v_u - v_v - v_w) / 3
+        v_beta = (v_v - v_w) / SQRT3
+        (i_u, i_v, i_w) = self.io.get_phase_currents()
+        i_alpha = (2 * i_u - i_v - i_w) / 3
+        i_beta = (i_v - i_w) / SQRT3
+
+        # The voltages were applied since the last update, while the previous currents flowed
+        (flux_alpha, flux_beta) = self.flux
+        (last_alpha, last_beta) = self.last_current
+        rotor_alpha = flux_alpha - l * last_alpha
+        rotor_beta = flux_beta - l * last_beta
+        correction = self.flux_gain / 2 * (1 - (rotor_alpha ** 2 + rotor_beta ** 2) / flux_magnitude ** 2)
+        flux_alpha += (v_alpha - r * last_alpha + correction * rotor_alpha) * dt
+        flux_beta += (v_beta - r * last_beta + correction * rotor_beta) * dt
+        self.flux = (flux_alpha, flux_beta)
+        self.last_current = (i_alpha, i_beta)
+
+        measured = math.atan2(-(flux_beta - l * i_beta), -(flux_alpha - l * i_alpha)) % (2 * math.pi)
+        self.tracker.track(measured, dt)
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+
+ESTIMATOR_TYPES: dict[str, type[Estimator]] = {
+    "encoder": EncoderEstimator,
+    "pll": PLLEstimator,
+    "flux": FluxObserver
+}
+
+def wrap_angles(angle: np.ndarray) -> np.ndarray:
+    """Wrap angle differences to [-pi, pi)."""
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+class BatchedEstimator(ABC):
+    angle: np.ndarray
+    velocity: np.ndarray
+
+    @abstractmethod
+    def __init__(self, io: BatchedSimIOInterface):
+        pass
+
+    @abstractmethod
+    def update(self, dt: float):
+        pass
+
+    @abstractmethod
+    def reset(self):
+        pass
+
+class BatchedEncoderEstimator(BatchedEstimator):
+    io: BatchedSimIOInterface
+
+    def __init__(self, io: BatchedSimIOInterface):
+        self.io = io
+        self.reset()
+
+    def reset(self):
+        n = len(self.io)
+        self.angle = np.zeros(n)
+        self.velocity = np.zeros(n)
+
+    def update(self, dt: float):
+        angle = self.io.properties.mechanical_to_electrical_angle(self.io.get_encoder_position())
+        self.velocity = wrap_angles(angle - self.angle) / dt
+        self.angle = angle
+
+class BatchedAngleTracker:
+    kp: np.ndarray
+    ki: np.ndarray
+    angle: np.ndarray
+    velocity: np.ndarray
+
+    def __init__(self, bandwidth: np.ndarray):
+        self.kp = 2 * bandwidth
+        self.ki = bandwidth * bandwidth
+        self.reset()
+
+    def reset(self):
+        self.angle = np.zeros(len(self.kp))
+        self.velocity = np.zeros(len(self.kp))
+
+    def track(self, measured_angle: np.ndarray, dt: float):
+        error = wrap_angles(measured_angle - self.angle)
+        self.velocity = self.velocity + self.ki * error * dt
+        self.angle = (self.angle + (self.velocity + self.kp * error) * dt) % (2 * math.pi)
+
+class BatchedPLLEstimator(BatchedEstimator):
+    io: BatchedSimIOInterface
+    tracker: BatchedAngleTracker
+
+    def __init__(self, io: BatchedSimIOInterface, bandwidth: np.ndarray | float = 2000):
+        self.io = io
+        self.tracker = BatchedAngleTracker(np.broadcast_to(bandwidth, (len(io),)).astype(float))
+        self.reset()
+
+    def reset(self):
+        self.tracker.reset()
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+
+    def update(self, dt: float):
+        self.tracker.track(self.io.properties.mechanical_to_electrical_angle(self.io.get_encoder_position()), dt)
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+
+class BatchedFluxObserver(BatchedEstimator):
+    io: BatchedSimIOInterface
+    flux_gain: np.ndarray
+    tracker: BatchedAngleTracker
+    flux: np.ndarray
+    """The estimated alpha-beta stator flux with shape (N, 2)"""
+    last_current: np.ndarray
+
+    def __init__(self, io: BatchedSimIOInterface, flux_gain: np.ndarray | float = 2000, bandwidth: np.ndarray | float = 2000):
+        self.io = io
+        n = len(io)
+        self.flux_gain = np.broadcast_to(flux_gain, (n,)).astype(float)
+        self.tracker = BatchedAngleTracker(np.broadcast_to(bandwidth, (n,)).astype(float))
+        self.reset()
+
+    def get_flux_magnitude(self) -> np.ndarray:
+        props = self.io.properties
+        return props.bemf_constant * props.normed_bemf_coeffs[:, 0]
+
+    def reset(self):
+        n = len(self.io)
+        self.tracker.reset()
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+        self.last_current = np.zeros((n, 2))
+        self.flux = np.column_stack((-self.get_flux_magnitude(), np.zeros(n)))
+
+    @staticmethod
+    def clarke(phases: np.ndarray) -> np.ndarray:
+        return np.column_stack((
+            (2 * phases[:, 0] - phases[:, 1] - phases[:, 2]) / 3,
+            (phases[:, 1] - phases[:, 2]) / SQRT3
+        ))
+
+    def update(self, dt: float):
+        props = self.io.properties
+        r = props.phase_resistance[:, None]
+        l = props.phase_inductance[:, None]
+
+        voltage = self.clarke(self.io.last_phase_voltages)
+        current = self.clarke(self.io.get_phase_currents())
+
+        rotor_flux = self.flux - l * self.last_current
+        correction = self.flux_gain / 2 * (1 - (rotor_flux ** 2).sum(axis=1) / self.get_flux_magnitude() ** 2)
+        self.flux = self.flux + (voltage - r * self.last_current + correction[:, None] * rotor_flux) * dt
+        self.last_current = current
+
+        rotor_flux = self.flux - l * current
+        self.tracker.track(np.arctan2(-rotor_flux[:, 1], -rotor_flux[:, 0]) % (2 * math.pi), dt)
+        self.angle = self.tracker.angle
+        self.velocity = self.tracker.velocity
+
+BATCHED_ESTIMATOR_TYPES: dict[str, type[BatchedEstimator]] = {
+    "encoder": BatchedEncoderEstimator,
+    "pll": BatchedPLLEstimator,
+    "flux": BatchedFluxObserver
+}
@@ -0,0 +1,464 @@
+import math
+from collections import Counter
+from typing import NamedTuple
+
+from .foc_kernel import FOCKernel
+from .id import IDController
+from .transforms import SQRT3_2, VBUS_TO_DQ_LIMIT
+
+# Emulation of the FOC current loop in Q-format fixed point, to budget cycles and accuracy for the RP2040
+# (a Cortex-M0+ without an FPU) before flashing. Values are Python ints holding the raw fixed point words,
+# and every arithmetic operation goes through FixedPointMath, which rounds, saturates or wraps like the
+# firmware would and counts the operation. Angles are unsigned 16-bit fractions of a turn, so they wrap for free.
+#
+# The cycle costs are rough figures for code running from RAM at 133 MHz, meant for budgeting rather than
+# prediction. The soft float costs are for the RP2040 bootrom's single precision routines; the float64
+# Python path would be several times slower still.
+
+ANGLE_BITS = 16
+"""Angles are stored as fractions of a turn in this many bits."""
+
+RP2040_CLOCK_HZ = 133e6
+
+class QFormat(NamedTuple):
+    """A signed fixed point format with `integer_bits` integer bits and `fractional_bits` fractional bits, plus a sign bit."""
+
+    integer_bits: int = 15
+    fractional_bits: int = 16
+
+    @property
+    def word_bits(self) -> int:
+        return 1 + self.integer_bits + self.fractional_bits
+
+    @property
+    def max_raw(self) -> int:
+        return (1 << (self.word_bits - 1)) - 1
+
+    @property
+    def min_raw(self) -> int:
+        return -(1 << (self.word_bits - 1))
+
+    @property
+    def resolution(self) -> float:
+        return 2.0 ** -self.fractional_bits
+
+    def __str__(self) -> str:
+        return f"Q{self.integer_bits}.{self.fractional_bits}"
+
+    @staticmethod
+    def parse(spec: str) -> "QFormat":
+        """Parse a format like "Q15.16"."""
+        (integer_bits, _, fractional_bits) = spec.upper().removeprefix("Q").partition(".")
+        return QFormat(int(integer_bits), int(fractional_bits))
+
+class CycleCosts(NamedTuple):
+    """The approximate cycles each counted operation takes."""
+
+    add: float
+    """Addition, subtraction or negation, including the saturation check."""
+    mul: float
+    """A multiplication with the full-width product shifted back to the format."""
+    div: float
+    sqrt: float
+    compare: float
+    lut: float
+    """A sine table load."""
+    trig: float
+    """A sine or cosine without a table."""
+    convert: float
+    """Scaling a measurement or output at the boundary of the loop, e.g. from ADC counts."""
+
+RP2040_FIXED_COSTS = CycleCosts(
+    # The M0+ only has a 32x32 -> 32 bit multiplier, so a Q multiply takes four partial products
+    add=4, mul=14, div=40, sqrt=60, compare=2, lut=2, trig=400, convert=14
+)
+RP2040_SOFT_FLOAT_COSTS = CycleCosts(
+    add=50, mul=50, div=70, sqrt=90, compare=20, lut=2, trig=250, convert=25
+)
+
+class QuantizationError:
+    """Running statistics of the difference between the fixed point loop and the float loop."""
+
+    count: int
+    current_max: float
+    current_square_sum: float
+    voltage_max: float
+    voltage_square_sum: float
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.current_max = 0.0
+        self.current_square_sum = 0.0
+        self.voltage_max = 0.0
+        self.voltage_square_sum = 0.0
+
+    def add(self, current_error: float, voltage_error: float):
+        self.count += 1
+        self.current_max = max(self.current_max, abs(current_error))
+        self.current_square_sum += current_error * current_error
+        self.voltage_max = max(self.voltage_max, abs(voltage_error))
+        self.voltage_square_sum += voltage_error * voltage_error
+
+    @property
+    def current_rms(self) -> float:
+        return math.sqrt(self.current_square_sum / self.count) if self.count > 0 else 0.0
+
+    @property
+    def voltage_rms(self) -> float:
+        return math.sqrt(self.voltage_square_sum / self.count) if self.count > 0 else 0.0
+
+class FixedPointReport(NamedTuple):
+    q: QFormat
+    steps: int
+    ops_per_step: dict[str, float]
+    saturations_per_step: float
+    cycles_per_step: float
+    soft_float_cycles_per_step: float
+    """The cycles the same operations would take in soft float."""
+    clock_hz: float
+    error: QuantizationError
+
+    @property
+    def max_loop_rate(self) -> float:
+        """The fastest the current loop alone could run on the chip in Hz."""
+        return self.clock_hz / self.cycles_per_step if self.cycles_per_step > 0 else float("inf")
+
+    @property
+    def soft_float_max_loop_rate(self) -> float:
+        return self.clock_hz / self.soft_float_cycles_per_step if self.soft_float_cycles_per_step > 0 else float("inf")
+
+    def format(self, control_rate: float | None = None) -> str:
+        """A readable summary; with `control_rate` in Hz, also the fraction of the chip the loop would use."""
+        lines = [f"Fixed point {self.q} over {self.steps} steps:"]
+        lines.append("  Operations per step: " + ", ".join(
+            f"{count:.2f} {name}" for name, count in sorted(self.ops_per_step.items())
+        ))
+        lines.append(f"  Saturations per step: {self.saturations_per_step:.3f}")
+        lines.append(
+            f"  Cycles per step: {self.cycles_per_step:.0f} fixed, {self.soft_float_cycles_per_step:.0f} soft float"
+        )
+        lines.append(
+            f"  Max loop rate at {self.clock_hz / 1e6:.0f} MHz: {self.max_loop_rate / 1e3:.1f} kHz fixed, "
+            f"{self.soft_float_max_loop_rate / 1e3:.1f} kHz soft float"
+        )
+        if control_rate is not None:
+            lines.append(
+                f"  CPU use at {control_rate / 1e3:.1f} kHz: {self.cycles_per_step * control_rate / self.clock_hz * 100:.1f}% fixed, "
+                f"{self.soft_float_cycles_per_step * control_rate / self.clock_hz * 100:.1f}% soft float"
+            )
+        if self.error.count > 0:
+            lines.append(
+                f"  Error vs float: dq current {self.error.current_rms:.2e} A RMS ({self.error.current_max:.2e} max), "
+                f"phase voltage {self.error.voltage_rms:.2e} V RMS ({self.error.voltage_max:.2e} max)"
+            )
+        return "\n".join(lines)
+
+class FixedPointMath:
+    """
+    The arithmetic of the emulated chip. Counts every operation, and the saturations of every result
+    that didn't fit, along with the number of loop steps and the error against the float loop.
+    """
+
+    q: QFormat
+    rounding: str
+    """"nearest" rounds products and quotients, "truncate" shifts the extra bits off like a plain arithmetic shift."""
+    overflow: str
+    """"saturate" clamps results to the format's range, "wrap" wraps them around like unchecked two's complement."""
+    lut_size: int | None
+    """The number of entries in the sine table, or None to evaluate sine and cosine directly."""
+    ops: Counter[str]
+    saturations: int
+    steps: int
+    error: QuantizationError
+
+    def __init__(self, q: QFormat = QFormat(), rounding: str = "nearest", overflow: str = "saturate", lut_size: int | None = 256):
+        if rounding not in ("nearest", "truncate"):
+            raise ValueError(f"rounding must be nearest or truncate, got {rounding!r}")
+        if overflow not in ("saturate", "wrap"):
+            raise ValueError(f"overflow must be saturate or wrap, got {overflow!r}")
+        if lut_size is not None and (lut_size < 4 or lut_size & (lut_size - 1) != 0 or lut_size > 1 << ANGLE_BITS):
+            raise ValueError(f"lut_size must be a power of two between 4 and {1 << ANGLE_BITS}, got {lut_size}")
+        self.q = q
+        self.rounding = rounding
+        self.overflow = overflow
+        self.lut_size = lut_size
+        self.error = QuantizationError()
+        # One extra entry so interpolation never wraps the index
+        self._sine_table = (
+            [self.constant(math.sin(2 * math.pi * i / lut_size)) for i in range(lut_size + 1)]
+            if lut_size is not None else []
+        )
+        self._lut_shift = ANGLE_BITS - lut_size.bit_length() + 1 if lut_size is not None else 0
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.ops = Counter()
+        self.saturations = 0
+        self.steps = 0
+        self.error.reset()
+
+    def fit(self, raw: int) -> int:
+        """Bring a raw result into the format's range."""
+        q = self.q
+        if q.min_raw <= raw <= q.max_raw:
+            return raw
+        self.saturations += 1
+        if self.overflow == "wrap":
+            return (raw - q.min_raw) % (1 << q.word_bits) + q.min_raw
+        return q.max_raw if raw > 0 else q.min_raw
+
+    def shift_right(self, value: int, bits: int) -> int:
+        if self.rounding == "nearest":
+            return (value + (1 << (bits - 1))) >> bits
+        return value >> bits
+
+    def constant(self, value: float) -> int:
+        """Quantize a constant, which the firmware would compute at compile time, so it isn't counted."""
+        scaled = value * (1 << self.q.fractional_bits)
+        return self.fit(round(scaled) if self.rounding == "nearest" else math.floor(scaled))
+
+    def from_float(self, value: float) -> int:
+        self.ops["convert"] += 1
+        return self.constant(value)
+
+    def to_float(self, raw: int) -> float:
+        self.ops["convert"] += 1
+        return raw * self.q.resolution
+
+    def add(self, a: int, b: int) -> int:
+        self.ops["add"] += 1
+        return self.fit(a + b)
+
+    def sub(self, a: int, b: int) -> int:
+        self.ops["add"] += 1
+        return self.fit(a - b)
+
+    def mul(self, a: int, b: int) -> int:
+        self.ops["mul"] += 1
+        return self.fit(self.shift_right(a * b, self.q.fractional_bits))
+
+    def div(self, a: int, b: int) -> int:
+        self.ops["div"] += 1
+        numerator = a << self.q.fractional_bits
+        if b == 0:
+            return self.fit(numerator * (1 << self.q.word_bits))
+        # Hardware dividers truncate toward zero
+        quotient = (abs(numerator) + (abs(b) // 2 if self.rounding == "nearest" else 0)) // abs(b)
+        return self.fit(quotient if (numerator < 0) == (b < 0) else -quotient)
+
+    def square_sum(self, a: int, b: int) -> int:
+        """a^2 + b^2 in a double width word with twice the fractional bits, which can't overflow."""
+        self.ops["mul"] += 2
+        self.ops["add"] += 1
+        return a * a + b * b
+
+    def sqrt_wide(self, value: int) -> int:
+        """The square root of a double width value from `square_sum`."""
+        self.ops["sqrt"] += 1
+        return self.fit(math.isqrt(value))
+
+    def compare(self):
+        """Count a comparison and branch, which the caller evaluates on the raw values."""
+        self.ops["compare"] += 1
+
+    def angle_from_float(self, theta: float) -> int:
+        """Convert an angle in radians to a fraction of a turn."""
+        self.ops["convert"] += 1
+        return round(theta * ((1 << ANGLE_BITS) / (2 * math.pi))) & ((1 << ANGLE_BITS) - 1)
+
+    def sin_cos(self, angle: int) -> tuple[int, int]:
+        """The sine and cosine of an angle in turns, linearly interpolated from the sine table if there is one."""
+        if self.lut_size is None:
+            self.ops["trig"] += 2
+            theta = angle * (2 * math.pi / (1 << ANGLE_BITS))
+            return (self.constant(math.sin(theta)), self.constant(math.cos(theta)))
+        quarter = 1 << (ANGLE_BITS - 2)
+        cos_angle = (angle + quarter) & ((1 << ANGLE_BITS) - 1)
+        return (self._lookup_sine(angle), self._lookup_sine(cos_angle))
+
+    def _lookup_sine(self, angle: int) -> int:
+        self.ops["lut"] += 2
+        index = angle >> self._lut_shift
+        # The fraction between entries, in the format's fractional bits
+        fraction = (angle & ((1 << self._lut_shift) - 1)) << self.q.fractional_bits >> self._lut_shift
+        lower = self._sine_table[index]
+        return self.add(lower, self.mul(self.sub(self._sine_table[index + 1], lower), fraction))
+
+    def get_report(
+        self,
+        costs: CycleCosts = RP2040_FIXED_COSTS,
+        soft_float_costs: CycleCosts = RP2040_SOFT_FLOAT_COSTS,
+        clock_hz: float = RP2040_CLOCK_HZ
+    ) -> FixedPointReport:
+        steps = max(self.steps, 1)
+        ops_per_step = {name: count / steps for name, count in self.ops.items()}
+        return FixedPointReport(
+            q=self.q,
+            steps=self.steps,
+            ops_per_step=ops_per_step,
+            saturations_per_step=self.saturations / steps,
+            cycles_per_step=sum(getattr(costs, name) * count for name, count in ops_per_step.items()),
+            soft_float_cycles_per_step=sum(getattr(soft_float_costs, name) * count for name, count in ops_per_step.items()),
+            clock_hz=clock_hz,
+            error=self.error
+        )
+
+def fixed_clarke_transform(fx: FixedPointMath, iu: int, iv: int, iw: int) -> tuple[int, int]:
+    """transforms.clarke_transform in fixed point, returning (alpha, beta)."""
+    half = fx.constant(0.5)
+    sqrt3_2 = fx.constant(SQRT3_2)
+    alpha = fx.sub(fx.sub(iu, fx.mul(iv, half)), fx.mul(iw, half))
+    beta = fx.mul(sqrt3_2, fx.sub(iv, iw))
+    return (alpha, beta)
+
+def fixed_park_transform(fx: FixedPointMath, alpha: int, beta: int, sin: int, cos: int) -> tuple[int, int]:
+    """transforms.park_transform in fixed point, returning (d, q)."""
+    d = fx.add(fx.mul(alpha, cos), fx.mul(beta, sin))
+    q = fx.sub(fx.mul(beta, cos), fx.mul(alpha, sin))
+    return (d, q)
+
+def fixed_clamp_to_vbus(fx: FixedPointMath, d: int, q: int, limit: int) -> tuple[int, int]:
+    """ParkOutput.clamp_to_vbus in fixed point, comparing squared magnitudes so the square root is only taken when clamping."""
+    magnitude_squared = fx.square_sum(d, q)
+    fx.compare()
+    if magnitude_squared <= limit * limit:
+        return (d, q)
+    scale = fx.div(limit, fx.sqrt_wide(magnitude_squared))
+    return (fx.mul(d, scale), fx.mul(q, scale))
+
+def fixed_inverse_park_transform(fx: FixedPointMath, d: int, q: int, sin: int, cos: int) -> tuple[int, int]:
+    """transforms.inverse_park_transform in fixed point, returning (alpha, beta)."""
+    alpha = fx.sub(fx.mul(d, cos), fx.mul(q, sin))
+    beta = fx.add(fx.mul(d, sin), fx.mul(q, cos))
+    return (alpha, beta)
+
+def fixed_inverse_clarke_transform(fx: FixedPointMath, alpha: int, beta: int) -> tuple[int, int, int]:
+    """transforms.inverse_clarke_transform in fixed point."""
+    inv_sqrt3 = fx.constant(1 / math.sqrt(3))
+    half = fx.constant(0.5)
+    sqrt3_2 = fx.constant(SQRT3_2)
+    half_alpha = fx.mul(alpha, half)
+    scaled_beta = fx.mul(beta, sqrt3_2)
+    return (
+        fx.add(alpha, fx.mul(beta, inv_sqrt3)),
+        fx.sub(scaled_beta, half_alpha),
+        fx.sub(fx.sub(0, half_alpha), scaled_beta)
+    )
+
+class FixedIDController:
+    """IDController in fixed point. The gains are quantized once like firmware constants, and so is ki * dt."""
+
+    fx: FixedPointMath
+    kp: float
+    ki: float
+    int_raw: int
+
+    def __init__(self, fx: FixedPointMath, kp: float, ki: float):
+        self.fx = fx
+        self.kp = kp
+        self.ki = ki
+        self._kp_raw = fx.constant(kp)
+        self._dt: float | None = None
+        self._ki_dt_raw = 0
+        self.int_raw = 0
+
+    @property
+    def int(self) -> float:
+        return self.int_raw * self.fx.q.resolution
+
+    @int.setter
+    def int(self, value: float):
+        self.int_raw = self.fx.constant(value)
+
+    def reset(self):
+        self.int_raw = 0
+
+    def compute(self, error: int, dt: float) -> int:
+        fx = self.fx
+        if dt != self._dt:
+            self._dt = dt
+            self._ki_dt_raw = fx.constant(self.ki * dt)
+        self.int_raw = fx.add(self.int_raw, fx.mul(error, self._ki_dt_raw))
+        return fx.add(fx.mul(self._kp_raw, error), self.int_raw)
+
+class FixedFOCKernel:
+    """
+    FOCKernel in fixed point, with the same interface. The currents and angle are converted on the way in and
+    the voltages on the way out, as the firmware would scale its ADC readings and PWM compare values.
+    With `track_error`, a float FOCKernel runs alongside on the same inputs and the difference goes into `fx.error`.
+    """
+
+    fx: FixedPointMath
+    id_controller: FixedIDController
+    iq_controller: FixedIDController
+    vbus: float
+    reference: FOCKernel | None
+    i_d: float
+    i_q: float
+    u_d: float
+    u_q: float
+
+    def __init__(self, fx: FixedPointMath, kp: float, ki: float, vbus: float, track_error: bool = True):
+        self.fx = fx
+        self.id_controller = FixedIDController(fx, kp, ki)
+        self.iq_controller = FixedIDController(fx, kp, ki)
+        self.vbus = vbus
+        self._vbus_limit_raw = fx.constant(VBUS_TO_DQ_LIMIT * vbus)
+        self.reference = FOCKernel(IDController(kp, ki), IDController(kp, ki), vbus) if track_error else None
+        self.reset()
+
+    def reset(self):
+        self.id_controller.reset()
+        self.iq_controller.reset()
+        if self.reference is not None:
+            self.reference.id_controller.reset()
+            self.reference.iq_controller.reset()
+            self.reference.reset()
+        self.i_d = 0.0
+        self.i_q = 0.0
+        self.u_d = 0.0
+        self.u_q = 0.0
+
+    def step(
+        self,
+        i_u: float,
+        i_v: float,
+        i_w: float,
+        theta: float,
+        target_id: float,
+        target_iq: float,
+        dt: float
+    ) -> tuple[float, float, float]:
+        fx = self.fx
+        fx.steps += 1
+        resolution = fx.q.resolution
+
+        (sin, cos) = fx.sin_cos(fx.angle_from_float(theta))
+        (alpha, beta) = fixed_clarke_transform(fx, fx.from_float(i_u), fx.from_float(i_v), fx.from_float(i_w))
+        (i_d, i_q) = fixed_park_transform(fx, alpha, beta, sin, cos)
+
+        # The targets come from the outer loops, which already run in the chip's format
+        u_d = self.id_controller.compute(fx.sub(fx.constant(target_id), i_d), dt)
+        u_q = self.iq_controller.compute(fx.sub(fx.constant(target_iq), i_q), dt)
+        # Kept in float for telemetry only, so not counted
+        (self.i_d, self.i_q) = (i_d * resolution, i_q * resolution)
+        (self.u_d, self.u_q) = (u_d * resolution, u_q * resolution)
+
+        (u_d, u_q) = fixed_clamp_to_vbus(fx, u_d, u_q, self._vbus_limit_raw)
+        (v_alpha, v_beta) = fixed_inverse_park_transform(fx, u_d, u_q, sin, cos)
+        phase_voltages = tuple(fx.to_float(v) for v in fixed_inverse_clarke_transform(fx, v_alpha, v_beta))
+
+        if self.reference is not None:
+            expected = self.reference.step(i_u, i_v, i_w, theta, target_id, target_iq, dt)
+            fx.error.add(
+                max(abs(self.i_d - self.reference.i_d), abs(self.i_q - self.reference.i_q)),
+                max(abs(actual - reference) for actual, reference in zip(phase_voltages, expected))
+            )
+
+        return phase_voltages
+
+    # There's no separate stage-by-stage version, since the fixed point loop already runs stage by stage
+    step_reference = step
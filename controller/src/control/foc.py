@@ -1,69 +1,133 @@
-from ..control import MotorController, transforms
+from ..control import MotorController
+from ..control.estimators import Estimator, ESTIMATOR_TYPES
+from ..control.fixed_point import FixedFOCKernel, FixedIDController, FixedPointMath
+from ..control.foc_kernel import FOCKernel
 from ..control.id import IDController
-from ..motor_sim import SimIOInterface
+from ..io_interface import IOInterface
+from ..profiler import PROFILER
 import math
+import time
+from typing import Any
 
 class FOCController(MotorController):
-    io: SimIOInterface
-    angle: float # Radians, from encoder
-    vel: float # Rad/s, estimated
+    io: IOInterface
+    angle: float # Radians, q-axis electrical angle from the estimator
+    vel: float # Electrical rad/s, estimated
+    estimator: Estimator
 
     # D-axis and Q-axis current controllers
-    id_controller: IDController
-    iq_controller: IDController
+    id_controller: IDController | FixedIDController
+    iq_controller: IDController | FixedIDController
 
     target_id: float # Target d-axis voltage
     target_iq: float # Target q-axis voltage (torque command)
+    initial_target_iq: float # What target_iq starts at and resets to
 
-    current_dq: tuple[float, float]
-    output_dq: tuple[float, float]
-    dq_integral_terms: tuple[float, float]
+    kernel: FOCKernel | FixedFOCKernel
+    fused: bool # Use the fused current loop instead of the step-by-step reference, except while profiling (see get_phase_voltages)
 
-    def __init__(self, io: SimIOInterface):
+    def __init__(
+        self,
+        io: IOInterface,
+        bandwidth: float = 10000,
+        fused: bool = True,
+        estimator: str = "encoder",
+        fixed_point: FixedPointMath | None = None,
+        kp: float | None = None,
+        ki: float | None = None,
+        target_iq: float = -1
+    ):
+        """
+        With `fixed_point`, the current loop runs in its emulated fixed point arithmetic (see fixed_point.py).
+        `kp` and `ki` override the current loop gains `make_motor_pi_params` picks for `bandwidth`, e.g. from autotune.py.
+        """
         self.io = io
         self.angle = 0.0
         self.vel = 0.0
+        self.estimator = ESTIMATOR_TYPES[estimator](io)
+        self.initial_target_iq = target_iq
 
-        (p, i) = self.make_motor_pi_params(10000)
-        self.id_controller = IDController(kp=p, ki=i)
-        self.iq_controller = IDController(kp=p, ki=i)
+        (p, i) = self.make_motor_pi_params(bandwidth)
+        p = p if kp is None else kp
+        i = i if ki is None else ki
+        if fixed_point is not None:
+            self.kernel = FixedFOCKernel(fixed_point, p, i, io.properties.vbus)
+            self.id_controller = self.kernel.id_controller
+            self.iq_controller = self.kernel.iq_controller
+        else:
+            self.id_controller = IDController(kp=p, ki=i)
+            self.iq_controller = IDController(kp=p, ki=i)
+            self.kernel = FOCKernel(self.id_controller, self.iq_controller, io.properties.vbus)
+        self.fused = fused
 
         self.target_id = 0
-        self.target_iq = -1
+        self.target_iq = target_iq
     
     def make_motor_pi_params(self, bandwidth: float):
-        p = self.io.motor.properties.phase_inductance * bandwidth
-        i = self.io.motor.properties.phase_resistance * bandwidth
+        p = self.io.properties.phase_inductance * bandwidth
+        i = self.io.properties.phase_resistance * bandwidth
         return (p, i)
     
     def reset(self):
         self.angle = 0.0
         self.vel = 0.0
+        self.estimator.reset()
         self.id_controller.reset()
         self.iq_controller.reset()
+        self.kernel.reset()
         self.target_id = 0
-        self.target_iq = -1
+        self.target_iq = self.initial_target_iq
+
+    def get_state(self) -> dict[str, Any]:
+        kernel = self.kernel
+        return {
+            "angle": self.angle,
+            "vel": self.vel,
+            "estimator": self.estimator,
+            "target_id": self.target_id,
+            "target_iq": self.target_iq,
+            "integral_terms": self.dq_integral_terms,
+            "kernel": (kernel.i_d, kernel.i_q, kernel.u_d, kernel.u_q)
+        }
+
+    def set_state(self, state: dict[str, Any]):
+        self.angle = state["angle"]
+        self.vel = state["vel"]
+        # A different kind of estimator keeps its own fresh state
+        if type(state["estimator"]) is type(self.estimator):
+            self.estimator = state["estimator"].copy_to(self.io)
+        self.target_id = state["target_id"]
+        self.target_iq = state["target_iq"]
+        (self.id_controller.int, self.iq_controller.int) = state["integral_terms"]
+        (self.kernel.i_d, self.kernel.i_q, self.kernel.u_d, self.kernel.u_q) = state["kernel"]
 
     def get_phase_voltages(self, dt: float) -> tuple[float, float, float]:
-        theta = self.io.get_encoder_position()
-        q_axis_angle = self.io.motor.properties.mechanical_to_electrical_angle(theta) + math.pi / 4
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
 
-        delta = (q_axis_angle - self.angle + math.pi) % (2 * math.pi) - math.pi
-        self.vel = delta / dt
+        self.estimator.update(dt)
+        q_axis_angle = self.estimator.angle + math.pi / 4
+        self.vel = self.estimator.velocity
         self.angle = q_axis_angle
+        if profiling:
+            lap = PROFILER.lap("FOC: angle estimation", lap)
 
         i_a, i_b, i_c = self.io.get_phase_currents()
-        clarke = transforms.clarke_transform(i_a, i_b, i_c)
-        (i_d, i_q) = transforms.park_transform(clarke, q_axis_angle)
-        self.current_dq = (i_d, i_q)
+        # The fused kernel can't be timed per stage, so profiling runs the equivalent staged loop instead
+        if self.fused and not profiling:
+            return self.kernel.step(i_a, i_b, i_c, q_axis_angle, self.target_id, self.target_iq, dt)
+        return self.kernel.step_reference(i_a, i_b, i_c, q_axis_angle, self.target_id, self.target_iq, dt)
 
-        u_id = self.id_controller.compute(self.target_id - i_d, dt)
-        u_iq = self.iq_controller.compute(self.target_iq - i_q, dt)
-        self.output_dq = (u_id, u_iq)
-        self.dq_integral_terms = (self.id_controller.int, self.iq_controller.int)
+    @property
+    def current_dq(self) -> tuple[float, float]:
+        return (self.kernel.i_d, self.kernel.i_q)
 
-        dq_voltages = transforms.ParkOutput(u_id, u_iq).clamp_to_vbus(self.io.motor.properties.vbus)
-        park_voltages = transforms.inverse_park_transform(dq_voltages, q_axis_angle)
-        phase_voltages = transforms.inverse_clarke_transform(park_voltages)
+    @property
+    def output_dq(self) -> tuple[float, float]:
+        return (self.kernel.u_d, self.kernel.u_q)
 
-        return phase_voltages
\ No newline at end of file
+    @property
+    def dq_integral_terms(self) -> tuple[float, float]:
+        return (self.id_controller.int, self.iq_controller.int)
\ No newline at end of file
@@ -0,0 +1,239 @@
+import math
+import time
+
+import numpy as np
+
+from ..profiler import PROFILER
+from . import transforms
+from .id import IDController
+from .transforms import SQRT3, SQRT3_2, VBUS_TO_DQ_LIMIT
+
+# The FOC current loop fused into a single pass: Clarke -> Park -> PI -> clamp -> inverse Park -> inverse Clarke.
+# Compared to chaining the functions in transforms.py, the fused kernel evaluates cos and sin once,
+# uses precomputed constants and writes its intermediate results into preallocated state instead of
+# building a ClarkeOutput/ParkOutput at every stage. The step-by-step version is kept as the reference.
+
+class FOCKernel:
+    """The scalar current loop. The PI integral terms live in the given IDControllers."""
+
+    __slots__ = ("id_controller", "iq_controller", "vbus", "vbus_limit", "i_d", "i_q", "u_d", "u_q")
+
+    id_controller: IDController
+    iq_controller: IDController
+    vbus: float
+    vbus_limit: float
+    """The maximum dq voltage magnitude."""
+    i_d: float
+    i_q: float
+    u_d: float
+    """The d-axis PI output before clamping to the bus voltage."""
+    u_q: float
+
+    def __init__(self, id_controller: IDController, iq_controller: IDController, vbus: float):
+        self.id_controller = id_controller
+        self.iq_controller = iq_controller
+        self.vbus = vbus
+        self.vbus_limit = VBUS_TO_DQ_LIMIT * vbus
+        self.reset()
+
+    def reset(self):
+        self.i_d = 0.0
+        self.i_q = 0.0
+        self.u_d = 0.0
+        self.u_q = 0.0
+
+    def step(
+        self,
+        i_u: float,
+        i_v: float,
+        i_w: float,
+        theta: float,
+        target_id: float,
+        target_iq: float,
+        dt: float
+    ) -> tuple[float, float, float]:
+        """Run the current loop on the measured phase currents at electrical angle `theta`, returning the phase voltages."""
+        cos = math.cos(theta)
+        sin = math.sin(theta)
+
+        # Clarke and Park transforms
+        alpha = i_u - i_v / 2 - i_w / 2
+        beta = SQRT3_2 * i_v - SQRT3_2 * i_w
+        i_d = alpha * cos + beta * sin
+        i_q = -alpha * sin + beta * cos
+        self.i_d = i_d
+        self.i_q = i_q
+
+        # PI current controllers, with the same operation order as IDController.compute
+        d_controller = self.id_controller
+        error = target_id - i_d
+        d_controller.int += error * d_controller.ki * dt
+        u_d = d_controller.kp * error + d_controller.int
+
+        q_controller = self.iq_controller
+        error = target_iq - i_q
+        q_controller.int += error * q_controller.ki * dt
+        u_q = q_controller.kp * error + q_controller.int
+        self.u_d = u_d
+        self.u_q = u_q
+
+        # Clamp the dq voltage magnitude to the bus voltage
+        magnitude = math.sqrt(u_d * u_d + u_q * u_q)
+        if magnitude > self.vbus_limit:
+            scale = self.vbus_limit / magnitude
+            u_d *= scale
+            u_q *= scale
+
+        # Inverse Park and Clarke transforms
+        v_alpha = u_d * cos - u_q * sin
+        v_beta = u_d * sin + u_q * cos
+        return (
+            v_alpha + v_beta / SQRT3,
+            -v_alpha / 2 + v_beta * SQRT3 / 2,
+            -v_alpha / 2 - v_beta * SQRT3 / 2
+        )
+
+    def step_reference(
+        self,
+        i_u: float,
+        i_v: float,
+        i_w: float,
+        theta: float,
+        target_id: float,
+        target_iq: float,
+        dt: float
+    ) -> tuple[float, float, float]:
+        """The same loop as `step`, built from the individual transforms. Reports each stage to the profiler."""
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
+        clarke = transforms.clarke_transform(i_u, i_v, i_w)
+        (i_d, i_q) = transforms.park_transform(clarke, theta)
+        self.i_d = i_d
+        self.i_q = i_q
+        if profiling:
+            lap = PROFILER.lap("FOC: Clarke/Park", lap)
+
+        u_d = self.id_controller.compute(target_id - i_d, dt)
+        if profiling:
+            lap = PROFILER.lap("FOC: d-axis PI", lap)
+        u_q = self.iq_controller.compute(target_iq - i_q, dt)
+        if profiling:
+            lap = PROFILER.lap("FOC: q-axis PI", lap)
+        self.u_d = u_d
+        self.u_q = u_q
+
+        dq_voltages = transforms.ParkOutput(u_d, u_q).clamp_to_vbus(self.vbus)
+        park_voltages = transforms.inverse_park_transform(dq_voltages, theta)
+        phase_voltages = transforms.inverse_clarke_transform(park_voltages)
+        if profiling:
+            PROFILER.lap("FOC: inverse transforms", lap)
+
+        return phase_voltages
+
+class BatchedFOCKernel:
+    """
+    The current loop for N motors at once. Every intermediate array is allocated up front
+    and written in place, so a step allocates nothing proportional to N.
+    """
+
+    kp: np.ndarray
+    ki: np.ndarray
+    vbus_limit: np.ndarray
+    integral: np.ndarray
+    """The d-axis and q-axis PI integral terms with shape (N, 2)"""
+    current_dq: np.ndarray
+    """The measured d-axis and q-axis currents with shape (N, 2)"""
+    output_dq: np.ndarray
+    """The PI outputs before clamping to the bus voltage with shape (N, 2)"""
+    phase_voltages: np.ndarray
+    """The output phase voltages with shape (N, 3). Overwritten by every step."""
+
+    def __init__(self, kp: np.ndarray, ki: np.ndarray, vbus: np.ndarray | float):
+        n = len(kp)
+        self.kp = kp
+        self.ki = ki
+        self.vbus_limit = VBUS_TO_DQ_LIMIT * np.broadcast_to(vbus, (n,)).astype(float)
+
+        self.integral = np.zeros((n, 2))
+        self.current_dq = np.zeros((n, 2))
+        self.output_dq = np.zeros((n, 2))
+        self.phase_voltages = np.zeros((n, 3))
+        self._error = np.zeros((n, 2))
+        self._scratch_dq = np.zeros((n, 2))
+        self._cos = np.zeros(n)
+        self._sin = np.zeros(n)
+        self._alpha = np.zeros(n)
+        self._beta = np.zeros(n)
+        self._scratch = np.zeros(n)
+
+    def reset(self):
+        self.integral.fill(0)
+        self.current_dq.fill(0)
+        self.output_dq.fill(0)
+
+    def step(
+        self,
+        currents: np.ndarray,
+        theta: np.ndarray,
+        target_id: np.ndarray,
+        target_iq: np.ndarray,
+        dt: float
+    ) -> np.ndarray:
+        """Run the current loop on phase currents of shape (N, 3), returning the phase voltages with shape (N, 3)."""
+        cos = np.cos(theta, out=self._cos)
+        sin = np.sin(theta, out=self._sin)
+        alpha = self._alpha
+        beta = self._beta
+        scratch = self._scratch
+
+        # Clarke transform
+        np.subtract(currents[:, 0], np.multiply(currents[:, 1], 0.5, out=scratch), out=alpha)
+        alpha -= np.multiply(currents[:, 2], 0.5, out=scratch)
+        np.subtract(currents[:, 1], currents[:, 2], out=beta)
+        beta *= SQRT3_2
+
+        # Park transform
+        i_d = self.current_dq[:, 0]
+        i_q = self.current_dq[:, 1]
+        np.multiply(alpha, cos, out=i_d)
+        i_d += np.multiply(beta, sin, out=scratch)
+        np.multiply(beta, cos, out=i_q)
+        i_q -= np.multiply(alpha, sin, out=scratch)
+
+        # PI current controllers
+        error = self._error
+        np.subtract(target_id, i_d, out=error[:, 0])
+        np.subtract(target_iq, i_q, out=error[:, 1])
+        increment = np.multiply(error, self.ki[:, None], out=self._scratch_dq)
+        increment *= dt
+        self.integral += increment
+        output = np.multiply(error, self.kp[:, None], out=self.output_dq)
+        output += self.integral
+
+        # Clamp the dq voltage magnitude to the bus voltage; the scale is 1 within the limit
+        scale = np.hypot(output[:, 0], output[:, 1], out=scratch)
+        np.maximum(scale, 1e-12, out=scale)
+        np.divide(self.vbus_limit, scale, out=scale)
+        np.minimum(scale, 1.0, out=scale)
+        u_dq = np.multiply(output, scale[:, None], out=self._scratch_dq)
+        u_d = u_dq[:, 0]
+        u_q = u_dq[:, 1]
+
+        # Inverse Park transform, reusing the Clarke buffers for the stator frame voltages
+        v_alpha = np.multiply(u_d, cos, out=alpha)
+        v_alpha -= np.multiply(u_q, sin, out=scratch)
+        v_beta = np.multiply(u_d, sin, out=beta)
+        v_beta += np.multiply(u_q, cos, out=scratch)
+
+        # Inverse Clarke transform
+        voltages = self.phase_voltages
+        np.divide(v_beta, SQRT3, out=voltages[:, 0])
+        voltages[:, 0] += v_alpha
+        np.multiply(v_beta, SQRT3_2, out=scratch)
+        np.multiply(v_alpha, -0.5, out=voltages[:, 1])
+        np.subtract(voltages[:, 1], scratch, out=voltages[:, 2])
+        voltages[:, 1] += scratch
+        return voltages
@@ -0,0 +1,49 @@
+from abc import ABC, abstractmethod
+
+from ..util import clamp
+
+# Modulators turn the phase voltages a controller wants into PWM duty cycles for the three half-bridges.
+# A duty cycle of 0 holds a phase at the negative rail for the whole switching period and 1 at vbus.
+
+DutyCycles = tuple[float, float, float]
+
+class Modulator(ABC):
+    @abstractmethod
+    def modulate(self, phase_voltages: tuple[float, float, float], vbus: float) -> DutyCycles:
+        """Returns the duty cycles of each phase for the requested phase voltages, clamped to [0, 1]."""
+        pass
+
+class SinePWMModulator(Modulator):
+    """
+    Sinusoidal PWM: each phase voltage is centered on vbus/2 on its own.
+    The linear range ends at a phase voltage amplitude of vbus/2.
+    """
+
+    def modulate(self, phase_voltages: tuple[float, float, float], vbus: float) -> DutyCycles:
+        (v_u, v_v, v_w) = phase_voltages
+        return (
+            clamp(0.5 + v_u / vbus, 0, 1),
+            clamp(0.5 + v_v / vbus, 0, 1),
+            clamp(0.5 + v_w / vbus, 0, 1)
+        )
+
+class SpaceVectorModulator(Modulator):
+    """
+    Space vector PWM through min-max zero-sequence injection, which centers the phase voltages
+    between the rails. The motor only sees line-to-line voltages, so the shift doesn't change its currents,
+    but it extends the linear range to an amplitude of vbus/sqrt(3), 15% more than sine PWM.
+    """
+
+    def modulate(self, phase_voltages: tuple[float, float, float], vbus: float) -> DutyCycles:
+        (v_u, v_v, v_w) = phase_voltages
+        offset = 0.5 - (max(v_u, v_v, v_w) + min(v_u, v_v, v_w)) / (2 * vbus)
+        return (
+            clamp(offset + v_u / vbus, 0, 1),
+            clamp(offset + v_v / vbus, 0, 1),
+            clamp(offset + v_w / vbus, 0, 1)
+        )
+
+MODULATOR_TYPES: dict[str, type[Modulator]] = {
+    "svpwm": SpaceVectorModulator,
+    "spwm": SinePWMModulator
+}
@@ -1,15 +1,31 @@
 import math
-from ..motor_sim import SimIOInterface
+import time
+from typing import Any
+from ..io_interface import IOInterface
+from ..profiler import PROFILER
 from . import MotorController
+from .estimators import Estimator, ESTIMATOR_TYPES
 
 class SixStepController(MotorController):
-    io: SimIOInterface
+    io: IOInterface
+    phase_advance: float # Proportion of a cycle (0 to 1)
+    estimator: Estimator
     
-    def __init__(self, io: SimIOInterface):
+    def __init__(self, io: IOInterface, phase_advance: float = 0.9, estimator: str = "encoder"):
         self.io = io
+        self.phase_advance = phase_advance
+        self.estimator = ESTIMATOR_TYPES[estimator](io)
     
     def reset(self):
-        pass
+        self.estimator.reset()
+    
+    def get_state(self) -> dict[str, Any]:
+        return {"estimator": self.estimator}
+    
+    def set_state(self, state: dict[str, Any]):
+        # A different kind of estimator keeps its own fresh state
+        if type(state["estimator"]) is type(self.estimator):
+            self.estimator = state["estimator"].copy_to(self.io)
     
     @staticmethod
     def get_commutation_state(progress: float) -> bool:
@@ -20,14 +36,31 @@ class SixStepController(MotorController):
         return progress >= 0.5
 
     def get_phase_voltages(self, dt: float) -> tuple[float, float, float]:
-        theta = self.io.get_encoder_position()
-        electrical_angle = self.io.motor.properties.mechanical_to_electrical_angle(theta)
-        progress: float = electrical_angle % (2 * math.pi) / (2 * math.pi)
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
+        self.estimator.update(dt)
+        progress: float = self.estimator.angle % (2 * math.pi) / (2 * math.pi)
+        if profiling:
+            lap = PROFILER.lap("Six-step: angle estimation", lap)
 
-        phase_advance = 0.9 # Proportion of a cycle (0 to 1)
+        phase_advance = self.phase_advance
+        vbus = self.io.properties.vbus
 
-        return (
-            self.get_commutation_state(progress + phase_advance) * 12,
-            self.get_commutation_state(progress + phase_advance - 1/3) * 12,
-            self.get_commutation_state(progress + phase_advance - 2/3) * 12
-        )
\ No newline at end of file
+        phase_voltages = (
+            self.get_commutation_state(progress + phase_advance) * vbus,
+            self.get_commutation_state(progress + phase_advance - 1/3) * vbus,
+            self.get_commutation_state(progress + phase_advance - 2/3) * vbus
+        )
+        if profiling:
+            PROFILER.lap("Six-step: commutation", lap)
+
+        return phase_voltages
+    
+    def get_duty_cycles(self, dt: float) -> tuple[float, float, float]:
+        # Six-step switches each phase fully between the rails
+        (v_u, v_v, v_w) = self.get_phase_voltages(dt)
+        vbus = self.io.properties.vbus
+        return (v_u / vbus, v_v / vbus, v_w / vbus)
\ No newline at end of file
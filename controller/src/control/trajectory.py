@@ -0,0 +1,283 @@
+import bisect
+import csv
+import math
+from abc import ABC, abstractmethod
+from typing import Sequence
+
+import numpy as np
+
+# Time-varying setpoints for the outer control loops. A trajectory maps the time since the controller
+# started (or was last reset) to a setpoint in the units of the loop it drives: amps of torque current,
+# mechanical rad/s or mechanical radians.
+
+class Trajectory(ABC):
+    @abstractmethod
+    def get_setpoint(self, t: float) -> float:
+        pass
+
+class ConstantTrajectory(Trajectory):
+    value: float
+
+    def __init__(self, value: float):
+        self.value = value
+
+    def get_setpoint(self, t: float) -> float:
+        return self.value
+
+class StepTrajectory(Trajectory):
+    """Holds `initial` until `step_time`, then `final`."""
+
+    initial: float
+    final: float
+    step_time: float
+
+    def __init__(self, initial: float, final: float, step_time: float = 0.0):
+        self.initial = initial
+        self.final = final
+        self.step_time = step_time
+
+    def get_setpoint(self, t: float) -> float:
+        return self.final if t >= self.step_time else self.initial
+
+class RampTrajectory(Trajectory):
+    """Moves linearly from `start` to `end` over `duration` seconds beginning at `start_time`."""
+
+    start: float
+    end: float
+    start_time: float
+    duration: float
+
+    def __init__(self, start: float, end: float, start_time: float = 0.0, duration: float = 1.0):
+        self.start = start
+        self.end = end
+        self.start_time = start_time
+        self.duration = duration
+
+    def get_setpoint(self, t: float) -> float:
+        if t <= self.start_time:
+            return self.start
+        if t >= self.start_time + self.duration:
+            return self.end
+        return self.start + (self.end - self.start) * (t - self.start_time) / self.duration
+
+class TrapezoidalTrajectory(Trajectory):
+    """
+    A move from `start` to `end` that accelerates at `max_acceleration` up to `max_velocity`, cruises,
+    then decelerates to a stop. Short moves that never reach `max_velocity` become triangular.
+    """
+
+    start: float
+    end: float
+    max_velocity: float
+    max_acceleration: float
+    start_time: float
+
+    def __init__(self, start: float, end: float, max_velocity: float, max_acceleration: float, start_time: float = 0.0):
+        if max_velocity <= 0 or max_acceleration <= 0:
+            raise ValueError("max_velocity and max_acceleration must be positive")
+        self.start = start
+        self.end = end
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.start_time = start_time
+
+        distance = abs(end - start)
+        # Cap the peak velocity for moves too short to reach the maximum
+        self._peak_velocity = min(max_velocity, math.sqrt(distance * max_acceleration))
+        self._accel_time = self._peak_velocity / max_acceleration
+        accel_distance = self._peak_velocity * self._accel_time / 2
+        self._cruise_time = (distance - 2 * accel_distance) / self._peak_velocity if self._peak_velocity > 0 else 0.0
+        self._direction = math.copysign(1, end - start)
+
+    @property
+    def duration(self) -> float:
+        return 2 * self._accel_time + self._cruise_time
+
+    def get_setpoint(self, t: float) -> float:
+        t -= self.start_time
+        if t <= 0:
+            return self.start
+        if t >= self.duration:
+            return self.end
+
+        acceleration = self.max_acceleration
+        peak = self._peak_velocity
+        if t < self._accel_time:
+            distance = acceleration * t * t / 2
+        elif t < self._accel_time + self._cruise_time:
+            distance = peak * self._accel_time / 2 + peak * (t - self._accel_time)
+        else:
+            remaining = self.duration - t
+            distance = abs(self.end - self.start) - acceleration * remaining * remaining / 2
+        return self.start + self._direction * distance
+
+class RecordedTrajectory(Trajectory):
+    """
+    Replays a recorded trace, linearly interpolating between samples and holding the end values outside it.
+    Lookups remember their position, so playing the trace forward costs constant time per step.
+    """
+
+    times: list[float]
+    values: list[float]
+
+    def __init__(self, times: Sequence[float], values: Sequence[float]):
+        if len(times) == 0 or len(times) != len(values):
+            raise ValueError("A recorded trajectory needs the same nonzero number of times and values")
+        self.times = list(times)
+        self.values = list(values)
+        self._index = 0
+
+    @staticmethod
+    def from_csv(path: str) -> "RecordedTrajectory":
+        """Load a trace from a CSV file with time and setpoint columns, skipping a header row if there is one."""
+        times: list[float] = []
+        values: list[float] = []
+        with open(path, newline="") as file:
+            for row in csv.reader(file):
+                try:
+                    (t, value) = (float(row[0]), float(row[1]))
+                except ValueError:
+                    continue
+                times.append(t)
+                values.append(value)
+        return RecordedTrajectory(times, values)
+
+    def get_setpoint(self, t: float) -> float:
+        times = self.times
+        # Walk forward from the last lookup, and only search when jumping backwards
+        index = self._index
+        if t < times[index]:
+            index = max(bisect.bisect_right(times, t) - 1, 0)
+        while index + 1 < len(times) and times[index + 1] <= t:
+            index += 1
+        self._index = index
+
+        if t <= times[0]:
+            return self.values[0]
+        if index + 1 >= len(times):
+            return self.values[-1]
+        fraction = (t - times[index]) / (times[index + 1] - times[index])
+        return self.values[index] + (self.values[index + 1] - self.values[index]) * fraction
+
+class MultisineTrajectory(Trajectory):
+    """
+    `offset` plus a sum of equal-amplitude sines at whole multiples of 1 / `period`, repeating every `period`
+    seconds, for measuring frequency responses. Schroeder phases keep the peak deviation from `offset` low,
+    and the sines are scaled so it is `amplitude`.
+    """
+
+    offset: float
+    amplitude: float
+    period: float
+    harmonics: np.ndarray
+    """The multiples of 1 / `period` excited."""
+
+    def __init__(self, offset: float, amplitude: float, period: float, harmonics: Sequence[int]):
+        if period <= 0 or len(harmonics) == 0:
+            raise ValueError("A multisine needs a positive period and at least one harmonic")
+        self.offset = offset
+        self.amplitude = amplitude
+        self.period = period
+        self.harmonics = np.asarray(harmonics, dtype=int)
+        count = len(self.harmonics)
+        self._omegas = 2 * math.pi * self.harmonics / period
+        self._phases = -math.pi * np.arange(count) * np.arange(1, count + 1) / count
+        # Normalize the peak over a finely sampled period
+        t = np.linspace(0, period, 16 * int(self.harmonics.max()) + 1)
+        peak = np.abs(np.sin(np.outer(t, self._omegas) + self._phases).sum(axis=1)).max()
+        self._scale = amplitude / peak
+
+    @staticmethod
+    def log_spaced(offset: float, amplitude: float, period: float, low: float, high: float, lines: int = 40) -> "MultisineTrajectory":
+        """A multisine with about `lines` log-spaced frequencies from `low` to `high` Hz."""
+        first = max(1, math.ceil(low * period))
+        last = max(first, math.floor(high * period))
+        harmonics = np.unique(np.round(np.geomspace(first, last, lines)).astype(int))
+        return MultisineTrajectory(offset, amplitude, period, harmonics)
+
+    @property
+    def frequencies(self) -> np.ndarray:
+        return self.harmonics / self.period
+
+    def get_setpoint(self, t: float) -> float:
+        return self.offset + self._scale * float(np.sin(self._omegas * t + self._phases).sum())
+
+class ChirpTrajectory(Trajectory):
+    """`offset` plus a sine sweeping exponentially from `start_frequency` to `end_frequency` Hz, repeating every `period` seconds."""
+
+    offset: float
+    amplitude: float
+    start_frequency: float
+    end_frequency: float
+    period: float
+
+    def __init__(self, offset: float, amplitude: float, start_frequency: float, end_frequency: float, period: float):
+        if start_frequency <= 0 or end_frequency <= 0 or period <= 0:
+            raise ValueError("A chirp needs positive frequencies and period")
+        self.offset = offset
+        self.amplitude = amplitude
+        self.start_frequency = start_frequency
+        self.end_frequency = end_frequency
+        self.period = period
+        self._rate = math.log(end_frequency / start_frequency) / period
+
+    def get_setpoint(self, t: float) -> float:
+        t %= self.period
+        if abs(self._rate) < 1e-12:
+            phase = 2 * math.pi * self.start_frequency * t
+        else:
+            phase = 2 * math.pi * self.start_frequency * math.expm1(self._rate * t) / self._rate
+        return self.offset + self.amplitude * math.sin(phase)
+
+def make_transition(profile: str, start: float, end: float, start_time: float, rate: float) -> Trajectory:
+    """
+    A trajectory from `start` to `end` beginning at `start_time`, for changing setpoints at runtime.
+    "step" jumps immediately, "ramp" moves at `rate` per second and "trapezoid" cruises at `rate`
+    with an acceleration of 10 * `rate` per second squared.
+    """
+    match profile:
+        case "step":
+            return StepTrajectory(start, end, start_time)
+        case "ramp":
+            return RampTrajectory(start, end, start_time, abs(end - start) / rate)
+        case "trapezoid":
+            return TrapezoidalTrajectory(start, end, rate, 10 * rate, start_time)
+    raise ValueError(f"Unknown profile {profile!r}, expected step, ramp or trapezoid")
+
+# The form of every trajectory spec with its required and total number of values
+TRAJECTORY_FORMS: dict[str, tuple[str, int, int]] = {
+    "constant": ("constant:VALUE", 1, 1),
+    "step": ("step:INITIAL,FINAL,TIME", 3, 3),
+    "ramp": ("ramp:START,END,START_TIME,DURATION", 4, 4),
+    "trapezoid": ("trapezoid:START,END,MAX_VELOCITY,MAX_ACCELERATION[,START_TIME]", 4, 5),
+    "multisine": ("multisine:OFFSET,AMPLITUDE,PERIOD,LOW,HIGH[,LINES]", 5, 6),
+    "chirp": ("chirp:OFFSET,AMPLITUDE,START_FREQUENCY,END_FREQUENCY,PERIOD", 5, 5)
+}
+
+def parse_trajectory(spec: str) -> Trajectory:
+    """
+    Parse a trajectory from the command line. Accepts any of TRAJECTORY_FORMS or "trace:PATH.csv".
+    """
+    (kind, _, arguments) = spec.partition(":")
+    if kind == "trace":
+        return RecordedTrajectory.from_csv(arguments)
+    if kind not in TRAJECTORY_FORMS:
+        raise ValueError(f"Unknown trajectory {kind!r}, expected {', '.join(TRAJECTORY_FORMS)} or trace")
+    (form, required, total) = TRAJECTORY_FORMS[kind]
+    values = [float(value) for value in arguments.split(",")] if arguments else []
+    if not required <= len(values) <= total:
+        raise ValueError(f"{kind} needs {form.partition(':')[2]}, got {arguments!r}")
+    match kind:
+        case "constant":
+            return ConstantTrajectory(*values)
+        case "step":
+            return StepTrajectory(*values)
+        case "ramp":
+            return RampTrajectory(*values)
+        case "trapezoid":
+            return TrapezoidalTrajectory(*values)
+        case "multisine":
+            if len(values) == 6:
+                values[5] = round(values[5])
+            return MultisineTrajectory.log_spaced(*values)
+    return ChirpTrajectory(*values)
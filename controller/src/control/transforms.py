@@ -1,6 +1,11 @@
 from typing import NamedTuple
 import math
 
+SQRT3 = math.sqrt(3)
+SQRT3_2 = SQRT3 / 2
+# Multiply vbus by 2/sqrt(3) to get the dq voltage limit because we use a normalized clarke matrix
+VBUS_TO_DQ_LIMIT = 2 / SQRT3
+
 class ClarkeOutput(NamedTuple):
     """
     The output of the Clarke transform.
@@ -25,8 +30,7 @@ class ParkOutput(NamedTuple):
         """
         Clamp the magnitude of the D-axis and Q-axis voltages to the bus voltage.
         """
-        # Multiply vbus by 2/sqrt(3) because we used a normalized clarke matrix
-        reference = 2/math.sqrt(3) * vbus
+        reference = VBUS_TO_DQ_LIMIT * vbus
         
         magnitude = math.sqrt(self.d**2 + self.q**2)
         if magnitude > reference:
@@ -42,7 +46,7 @@ def clarke_transform(iu: float, iv: float, iw: float) -> ClarkeOutput:
     This typically operates on amps.
     """
     alpha = iu - iv/2 - iw/2
-    beta = math.sqrt(3)/2 * iv - math.sqrt(3)/2 * iw
+    beta = SQRT3_2 * iv - SQRT3_2 * iw
     return ClarkeOutput(alpha, beta)
 
 def park_transform(alpha_beta: ClarkeOutput, theta: float) -> ParkOutput:
@@ -78,7 +82,7 @@ def inverse_clarke_transform(clarke: ClarkeOutput) -> tuple[float, float, float]
     (lu, lv, and lw) relative to the stator reference frame.  
     This typically operates on volts.
     """
-    iu = clarke.alpha + clarke.beta / math.sqrt(3)
-    iv = -clarke.alpha / 2 + clarke.beta * math.sqrt(3) / 2
-    iw = -clarke.alpha / 2 - clarke.beta * math.sqrt(3) / 2
+    iu = clarke.alpha + clarke.beta / SQRT3
+    iv = -clarke.alpha / 2 + clarke.beta * SQRT3 / 2
+    iw = -clarke.alpha / 2 - clarke.beta * SQRT3 / 2
     return iu, iv, iw
\ No newline at end of file
@@ -0,0 +1,35 @@
+import math
+
+import numpy as np
+
+def minmax_decimate(times: np.ndarray, values: np.ndarray, buckets: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduce a series to at most one minimum and one maximum sample per bucket, in time order.
+    With one bucket per horizontal pixel, the rendered line looks the same as the full series,
+    including single-sample spikes, but costs at most 2 * buckets points to draw.  
+    NaN samples never win a bucket unless the whole bucket is NaN.
+    """
+    n = len(values)
+    if n <= 2 * buckets:
+        return times, values
+
+    bucket_size = math.ceil(n / buckets)
+    bucket_count = math.ceil(n / bucket_size)
+    padding = bucket_count * bucket_size - n
+
+    # Pad the last bucket with its final value so it doesn't change that bucket's extremes
+    padded = np.concatenate((values, np.repeat(values[-1:], padding))) if padding else values
+    nan = np.isnan(padded)
+    lows = np.where(nan, np.inf, padded).reshape(bucket_count, bucket_size)
+    highs = np.where(nan, -np.inf, padded).reshape(bucket_count, bucket_size)
+
+    offsets = np.arange(bucket_count) * bucket_size
+    min_indices = np.minimum(lows.argmin(axis=1) + offsets, n - 1)
+    max_indices = np.minimum(highs.argmax(axis=1) + offsets, n - 1)
+
+    # Emit each bucket's two extremes in the order they occurred
+    indices = np.empty(2 * bucket_count, dtype=np.intp)
+    indices[0::2] = np.minimum(min_indices, max_indices)
+    indices[1::2] = np.maximum(min_indices, max_indices)
+
+    return times[indices], values[indices]
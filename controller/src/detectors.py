@@ -0,0 +1,162 @@
+import math
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, NamedTuple
+
+from .control import MotorController
+from .control.foc import FOCController
+from .motor_sim import SimIOInterface
+
+# Online detectors that end headless runs early once they've settled, diverged or can no longer do well enough,
+# instead of simulating a fixed duration. They only look at the current state, so they cost a few operations per check and
+# run every few control ticks.
+
+class StopReason(NamedTuple):
+    kind: str
+    """"settled", "diverged" or "aborted"."""
+    time: float
+    """The simulated time the run stopped at in seconds."""
+    detail: str
+    settle_time: float | None = None
+    """When the run settled in seconds, for settled runs."""
+
+    def __str__(self) -> str:
+        return f"{self.kind} at {self.time:.4f} s ({self.detail})"
+
+class Detector(ABC):
+    @abstractmethod
+    def update(self, io: SimIOInterface, ctrl: MotorController, elapsed: float) -> StopReason | None:
+        """Check the current state, `elapsed` seconds into the run, returning why to stop or None to continue."""
+        pass
+
+    def reset(self):
+        pass
+
+class MonitoredSignal(NamedTuple):
+    name: str
+    get: Callable[[SimIOInterface, MotorController], float]
+    absolute_tolerance: float
+    """How much the signal may wander regardless of its magnitude, so signals near zero can settle."""
+
+def get_monitored_signals(ctrl: MotorController) -> list[MonitoredSignal]:
+    """The velocity and torque, plus the dq currents for FOC controllers."""
+    signals = [
+        MonitoredSignal("velocity", lambda io, ctrl: io.motor.kinematic.rotor_angular_velocity, 0.5),
+        MonitoredSignal("torque", lambda io, ctrl: io.motor.kinematic.electromagnetic_torque, 1e-3)
+    ]
+    if isinstance(ctrl, FOCController):
+        signals.append(MonitoredSignal("d-axis current", lambda io, ctrl: ctrl.current_dq[0], 0.05))
+        signals.append(MonitoredSignal("q-axis current", lambda io, ctrl: ctrl.current_dq[1], 0.05))
+    return signals
+
+class SteadyStateDetector(Detector):
+    """
+    Splits the recent `window` seconds into `blocks` blocks and averages every monitored signal over each one.
+    The run has settled once, for every signal, the block means agree within `relative_tolerance` of their
+    magnitude plus the signal's absolute tolerance. Averaging over blocks looks past the torque and current ripple
+    that never goes away, as long as a block spans a few electrical periods.
+    The settle time is the start of the first window that passed.
+    """
+
+    window: float
+    blocks: int
+    relative_tolerance: float
+    min_time: float
+    """Don't stop before this time, e.g. to wait for a setpoint change."""
+
+    def __init__(self, window: float = 0.1, blocks: int = 5, relative_tolerance: float = 0.005, min_time: float = 0.0):
+        if blocks < 2:
+            raise ValueError(f"blocks must be at least 2, got {blocks}")
+        self.window = window
+        self.blocks = blocks
+        self.relative_tolerance = relative_tolerance
+        self.min_time = min_time
+        self.reset()
+
+    def reset(self):
+        self._signals: list[MonitoredSignal] | None = None
+        self._sums: list[float] = []
+        self._count = 0
+        self._block_start = 0.0
+        # Each entry holds a block's start time and the mean of every signal over it
+        self._block_means: deque[tuple[float, list[float]]] = deque(maxlen=self.blocks)
+
+    def update(self, io: SimIOInterface, ctrl: MotorController, elapsed: float) -> StopReason | None:
+        if self._signals is None:
+            self._signals = get_monitored_signals(ctrl)
+            self._sums = [0.0] * len(self._signals)
+            self._block_start = elapsed
+
+        for i, signal in enumerate(self._signals):
+            self._sums[i] += signal.get(io, ctrl)
+        self._count += 1
+
+        if elapsed - self._block_start < self.window / self.blocks:
+            return None
+        self._block_means.append((self._block_start, [total / self._count for total in self._sums]))
+        self._sums = [0.0] * len(self._signals)
+        self._count = 0
+        self._block_start = elapsed
+
+        if len(self._block_means) < self.blocks or elapsed < self.min_time:
+            return None
+        for i, signal in enumerate(self._signals):
+            means = [block[i] for (_, block) in self._block_means]
+            average = sum(means) / len(means)
+            if max(means) - min(means) > self.relative_tolerance * abs(average) + signal.absolute_tolerance:
+                return None
+
+        settle_time = self._block_means[0][0]
+        return StopReason("settled", elapsed, f"steady since {settle_time:.4f} s", settle_time)
+
+class DivergenceDetector(Detector):
+    """Stops runs whose phase currents or velocity become non-finite or exceed a limit."""
+
+    max_current: float
+    """The largest allowed phase current magnitude in amps."""
+    max_velocity: float
+    """The largest allowed rotor velocity magnitude in rad/s."""
+
+    def __init__(self, max_current: float = 200.0, max_velocity: float = 2000.0):
+        self.max_current = max_current
+        self.max_velocity = max_velocity
+
+    def update(self, io: SimIOInterface, ctrl: MotorController, elapsed: float) -> StopReason | None:
+        velocity = io.motor.kinematic.rotor_angular_velocity
+        if not math.isfinite(velocity) or abs(velocity) > self.max_velocity:
+            return StopReason("diverged", elapsed, f"velocity {velocity:.4g} rad/s")
+        for phase, current in zip("UVW", io.get_phase_currents()):
+            # Also catches NaN, which fails every comparison
+            if not abs(current) <= self.max_current:
+                return StopReason("diverged", elapsed, f"phase {phase} current {current:.4g} A")
+        return None
+
+class ErrorBudgetDetector(Detector):
+    """
+    Integrates the magnitude of a tracking error and aborts the run once it exceeds `budget`, since the
+    integral only grows. Optimizers like autotune.py use this to stop simulating candidates that are
+    already worse than good ones.
+    """
+
+    get_error: Callable[[SimIOInterface, MotorController], float]
+    budget: float
+    """The largest allowed integral of the absolute error, in the error's units times seconds."""
+    integral: float
+
+    def __init__(self, get_error: Callable[[SimIOInterface, MotorController], float], budget: float):
+        self.get_error = get_error
+        self.budget = budget
+        self.reset()
+
+    def reset(self):
+        self.integral = 0.0
+        self._last_time: float | None = None
+
+    def update(self, io: SimIOInterface, ctrl: MotorController, elapsed: float) -> StopReason | None:
+        if self._last_time is not None:
+            # Only sampled every few ticks, so hold each sample over the time since the last one
+            self.integral += abs(self.get_error(io, ctrl)) * (elapsed - self._last_time)
+        self._last_time = elapsed
+        if self.integral > self.budget:
+            return StopReason("aborted", elapsed, f"error integral {self.integral:.4g} over budget {self.budget:.4g}")
+        return None
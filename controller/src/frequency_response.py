@@ -0,0 +1,423 @@
+import argparse
+import csv
+import math
+import sys
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from .control import MotorController
+from .control.cascade import CascadedFOCController
+from .control.foc import FOCController
+from .control.trajectory import ChirpTrajectory, MultisineTrajectory, Trajectory
+from .main import TIMESTEP
+from .motor_sim import SimIOInterface
+from .motor_sim.properties import MotorProperties, REV_NEO_PROPS, replace_properties
+from .scheduler import MultiRateScheduler
+from .sweep import CONTROLLER_PREFIX, MOTOR_PREFIX, parse_setting
+
+# Measures the frequency response of a control loop by perturbing its setpoint and comparing the
+# measurement with it. The closed-loop response T is the cross spectrum of setpoint and measurement over
+# the setpoint's auto spectrum, which ignores anything uncorrelated with the perturbation (PWM and cogging
+# ripple, estimator noise). These loops subtract the measurement from the setpoint, so the open-loop
+# response is T / (1 - T), from which the crossover frequency and the phase and gain margins follow.
+#
+# Spectra are averaged over segments as the simulation runs (Welch's method), so only one segment is held.
+
+EXCITATION_TYPES = ("multisine", "chirp")
+
+class WelchEstimator:
+    """
+    Streaming Welch averaging of the auto spectrum of a reference channel and its cross spectra with the
+    other channels. Samples are buffered until they fill a segment, which is windowed, transformed and
+    accumulated, keeping the overlap for the next one.
+    """
+
+    segment_length: int
+    hop: int
+    """The number of new samples per segment."""
+    segments: int
+    """The number of segments averaged so far."""
+
+    def __init__(self, segment_length: int, channels: int, window: str = "hann", overlap: float = 0.5):
+        if window not in ("hann", "boxcar"):
+            raise ValueError(f"window must be hann or boxcar, got {window!r}")
+        self.segment_length = segment_length
+        self.hop = max(1, round(segment_length * (1 - overlap)))
+        self.window = np.hanning(segment_length + 1)[:-1] if window == "hann" else np.ones(segment_length)
+        self.buffer = np.zeros((segment_length, channels))
+        self.filled = 0
+        self.segments = 0
+        bins = segment_length // 2 + 1
+        self.reference_power = np.zeros(bins)
+        self.cross = np.zeros((bins, channels - 1), dtype=complex)
+        self.power = np.zeros((bins, channels - 1))
+
+    def push(self, values: tuple[float, ...]):
+        """Add one sample of every channel, the reference first."""
+        self.buffer[self.filled] = values
+        self.filled += 1
+        if self.filled == self.segment_length:
+            self._process()
+
+    def add(self, block: np.ndarray):
+        """Add samples with shape (n, channels)."""
+        start = 0
+        while start < len(block):
+            count = min(len(block) - start, self.segment_length - self.filled)
+            self.buffer[self.filled:self.filled + count] = block[start:start + count]
+            self.filled += count
+            start += count
+            if self.filled == self.segment_length:
+                self._process()
+
+    def _process(self):
+        segment = self.buffer - self.buffer.mean(axis=0)
+        spectra = np.fft.rfft(segment * self.window[:, None], axis=0)
+        reference = spectra[:, 0]
+        self.reference_power += np.abs(reference) ** 2
+        self.cross += np.conj(reference)[:, None] * spectra[:, 1:]
+        self.power += np.abs(spectra[:, 1:]) ** 2
+        self.segments += 1
+
+        keep = self.segment_length - self.hop
+        self.buffer[:keep] = self.buffer[self.hop:]
+        self.filled = keep
+
+    def get_frequencies(self, timestep: float) -> np.ndarray:
+        return np.fft.rfftfreq(self.segment_length, timestep)
+
+    def get_transfer(self) -> np.ndarray:
+        """The response of every other channel to the reference with shape (bins, channels - 1)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.cross / self.reference_power[:, None]
+
+    def get_coherence(self) -> np.ndarray:
+        """How much of every other channel's power the reference explains, from 0 to 1, with shape (bins, channels - 1)."""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.abs(self.cross) ** 2 / (self.reference_power[:, None] * self.power)
+
+def interpolate_crossing(frequencies: np.ndarray, values: np.ndarray, level: float) -> float:
+    """
+    The first frequency where `values` falls through `level`, interpolated on a log frequency axis.
+    Infinite if they stay above it and NaN if they start below it.
+    """
+    below = values < level
+    crossings = np.flatnonzero(~below[:-1] & below[1:])
+    if len(crossings) == 0:
+        return math.inf if not below.any() else math.nan
+    i = crossings[0]
+    fraction = (values[i] - level) / (values[i] - values[i + 1])
+    return float(np.exp(np.log(frequencies[i]) + fraction * (np.log(frequencies[i + 1]) - np.log(frequencies[i]))))
+
+@dataclass
+class FrequencyResponse:
+    frequencies: np.ndarray
+    """The measured frequencies in Hz."""
+    closed_loop: np.ndarray
+    """The complex response of the measurement to the setpoint, T."""
+    coherence: np.ndarray
+    segments: int
+    """The number of segments averaged."""
+    simulated_time: float = 0.0
+    wall_time: float = 0.0
+
+    @property
+    def open_loop(self) -> np.ndarray:
+        """The complex loop gain L = T / (1 - T)."""
+        return self.closed_loop / (1 - self.closed_loop)
+
+    @staticmethod
+    def get_phase(response: np.ndarray) -> np.ndarray:
+        """The unwrapped phase in degrees."""
+        return np.degrees(np.unwrap(np.angle(response)))
+
+    def get_bandwidth(self) -> float:
+        """The -3 dB frequency of the closed loop in Hz, or infinite if it's above the measured range."""
+        return interpolate_crossing(self.frequencies, np.abs(self.closed_loop), 1 / math.sqrt(2))
+
+    def get_crossover_frequency(self) -> float:
+        """Where the loop gain first falls through unity in Hz, or infinite if it's above the measured range."""
+        return interpolate_crossing(self.frequencies, np.abs(self.open_loop), 1.0)
+
+    def get_critical_phase(self) -> float:
+        """The -180 degrees (plus whole turns) the loop's unwrapped phase starts above, which instability is measured against."""
+        phase = self.get_phase(self.open_loop)[0]
+        return float(phase - (phase + 180) % 360)
+
+    def get_phase_margin(self) -> float:
+        """How far the loop's phase is above -180 degrees at the crossover frequency, or NaN without a crossover."""
+        crossover = self.get_crossover_frequency()
+        if not math.isfinite(crossover):
+            return math.nan
+        phase = np.interp(np.log(crossover), np.log(self.frequencies), self.get_phase(self.open_loop))
+        return float(phase - self.get_critical_phase())
+
+    def get_gain_margin(self) -> float:
+        """How far the loop gain is below unity where its phase first reaches -180 degrees in dB, or NaN if it doesn't."""
+        frequency = interpolate_crossing(self.frequencies, self.get_phase(self.open_loop), self.get_critical_phase())
+        if not math.isfinite(frequency):
+            return math.nan
+        gain = np.interp(np.log(frequency), np.log(self.frequencies), np.abs(self.open_loop))
+        return float(-20 * np.log10(gain))
+
+    def write_csv(self, path: str):
+        open_loop = self.open_loop
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow([
+                "Frequency (Hz)", "Closed-loop gain (dB)", "Closed-loop phase (deg)",
+                "Open-loop gain (dB)", "Open-loop phase (deg)", "Coherence"
+            ])
+            rows = zip(
+                self.frequencies,
+                20 * np.log10(np.abs(self.closed_loop)), self.get_phase(self.closed_loop),
+                20 * np.log10(np.abs(open_loop)), self.get_phase(open_loop),
+                self.coherence
+            )
+            writer.writerows(rows)
+
+    def format(self, rows: int = 20) -> str:
+        """A Bode table of about `rows` of the measured frequencies, followed by the loop's margins."""
+        open_loop = self.open_loop
+        closed_phase = self.get_phase(self.closed_loop)
+        open_phase = self.get_phase(open_loop)
+        lines = [f"{'Hz':>9} {'|T| dB':>8} {'<T deg':>8} {'|L| dB':>8} {'<L deg':>8} {'coh':>6}"]
+        for i in np.unique(np.linspace(0, len(self.frequencies) - 1, min(rows, len(self.frequencies))).round().astype(int)):
+            lines.append(
+                f"{self.frequencies[i]:9.1f} {20 * math.log10(abs(self.closed_loop[i])):8.2f} {closed_phase[i]:8.1f} "
+                f"{20 * math.log10(abs(open_loop[i])):8.2f} {open_phase[i]:8.1f} {self.coherence[i]:6.3f}"
+            )
+        def describe(value: float, unit: str) -> str:
+            if math.isinf(value):
+                return "above the measured range"
+            return f"{value:.1f} {unit}" if not math.isnan(value) else "not reached in the measured range"
+
+        lines += [
+            f"Bandwidth (-3 dB): {describe(self.get_bandwidth(), 'Hz')}",
+            f"Crossover: {describe(self.get_crossover_frequency(), 'Hz')}",
+            f"Phase margin: {describe(self.get_phase_margin(), 'deg')}",
+            f"Gain margin: {describe(self.get_gain_margin(), 'dB')}",
+            f"Averaged {self.segments} segments, simulating {self.simulated_time:.2f} s in {self.wall_time:.2f} s"
+        ]
+        return "\n".join(lines)
+
+class LoopProbe(ABC):
+    """How to perturb one control loop's setpoint and read it back with the loop's measurement."""
+
+    controller_type: type[MotorController]
+    band: tuple[float, float]
+    """The default frequency range in Hz."""
+    resolution: float
+    """The default frequency resolution in Hz."""
+    offset: float = 0.0
+    """The setpoint the perturbation is centered on."""
+    amplitude: float
+    """The default peak perturbation."""
+
+    def get_amplitude(self, properties: MotorProperties, high: float) -> float:
+        """The default peak perturbation for measuring up to `high` Hz."""
+        return self.amplitude
+
+    def get_controller_args(self, excitation: Trajectory) -> dict[str, Any]:
+        return {}
+
+    def excite(self, ctrl: MotorController, setpoint: float):
+        """Apply the perturbed setpoint before a control tick."""
+        pass
+
+    @abstractmethod
+    def measure(self, ctrl: MotorController) -> tuple[float, float]:
+        """The setpoint and measurement the controller used in its last tick."""
+        pass
+
+class CurrentLoopProbe(LoopProbe):
+    """One of FOCController's d/q current loops. The d-axis produces no torque, so the rotor stays put."""
+
+    controller_type = FOCController
+    band = (20.0, 4000.0)
+    resolution = 20.0
+    amplitude = 1.0
+
+    def __init__(self, axis: int):
+        self.axis = axis
+
+    def get_amplitude(self, properties: MotorProperties, high: float) -> float:
+        # Keep the inductive voltage at the highest frequency to a quarter of the bus voltage, since the
+        # loop stops being linear once its output saturates
+        inductive_limit = 0.25 * properties.vbus / (2 * math.pi * high * properties.phase_inductance)
+        return min(self.amplitude, inductive_limit)
+
+    def get_controller_args(self, excitation: Trajectory) -> dict[str, Any]:
+        # Hold the other axis at zero rather than FOCController's default torque current, which spins the rotor up
+        return {"target_iq": 0}
+
+    def excite(self, ctrl: MotorController, setpoint: float):
+        assert isinstance(ctrl, FOCController)
+        if self.axis == 0:
+            ctrl.target_id = setpoint
+        else:
+            ctrl.target_iq = setpoint
+
+    def measure(self, ctrl: MotorController) -> tuple[float, float]:
+        assert isinstance(ctrl, FOCController)
+        target = ctrl.target_id if self.axis == 0 else ctrl.target_iq
+        return (target, ctrl.current_dq[self.axis])
+
+class SpeedLoopProbe(LoopProbe):
+    """CascadedFOCController's speed loop in mechanical rad/s, perturbed around a constant speed to stay clear of friction."""
+
+    controller_type = CascadedFOCController
+    band = (2.0, 400.0)
+    resolution = 2.0
+    offset = 30.0
+    amplitude = 5.0
+
+    def get_controller_args(self, excitation: Trajectory) -> dict[str, Any]:
+        return {"mode": "speed", "trajectory": excitation, "max_velocity": 1000}
+
+    def measure(self, ctrl: MotorController) -> tuple[float, float]:
+        assert isinstance(ctrl, CascadedFOCController)
+        return (ctrl.velocity_setpoint, ctrl.get_mechanical_velocity())
+
+LOOP_PROBES: dict[str, LoopProbe] = {
+    "current-d": CurrentLoopProbe(0),
+    "current-q": CurrentLoopProbe(1),
+    "speed": SpeedLoopProbe()
+}
+
+def analyze_loop(
+    loop: str = "current-d",
+    properties: MotorProperties | None = None,
+    controller_args: dict | None = None,
+    excitation: str = "multisine",
+    band: tuple[float, float] | None = None,
+    resolution: float | None = None,
+    amplitude: float | None = None,
+    averages: int = 8,
+    lines: int = 40,
+    timestep: float = TIMESTEP,
+    substeps: int = 1
+) -> FrequencyResponse:
+    """
+    Measure the frequency response of one of LOOP_PROBES over `band` in Hz, with segments `1 / resolution`
+    seconds long. A multisine excites about `lines` frequencies and repeats every segment, so the response is
+    exact at those frequencies with no window. A chirp sweeps the band every segment and is analyzed at every
+    frequency bin in the band with a Hann window and half-overlapping segments.
+    The first segment is discarded while the loop settles into the periodic excitation, then `averages` are taken.
+    """
+    if excitation not in EXCITATION_TYPES:
+        raise ValueError(f"excitation must be one of {EXCITATION_TYPES}, got {excitation!r}")
+    probe = LOOP_PROBES[loop]
+    (low, high) = band or probe.band
+    resolution = resolution or probe.resolution
+    properties = properties or REV_NEO_PROPS
+    segment_length = round(1 / (resolution * timestep))
+    period = segment_length * timestep
+    high = min(high, 0.5 / timestep)
+    amplitude = amplitude or probe.get_amplitude(properties, high)
+
+    trajectory: MultisineTrajectory | ChirpTrajectory
+    if excitation == "multisine":
+        trajectory = MultisineTrajectory.log_spaced(probe.offset, amplitude, period, low, high, lines)
+        estimator = WelchEstimator(segment_length, 2, "boxcar", overlap=0)
+    else:
+        trajectory = ChirpTrajectory(probe.offset, amplitude, low, high, period)
+        estimator = WelchEstimator(segment_length, 2, "hann", overlap=0.5)
+
+    io = SimIOInterface(properties)
+    ctrl = probe.controller_type(io, **(probe.get_controller_args(trajectory) | (controller_args or {})))
+    scheduler = MultiRateScheduler(io, ctrl, timestep, substeps)
+
+    settle_ticks = segment_length
+    ticks = settle_ticks + segment_length + (averages - 1) * estimator.hop
+    start_time = time.perf_counter()
+    for tick in range(ticks):
+        probe.excite(ctrl, trajectory.get_setpoint(tick * timestep))
+        scheduler.tick()
+        if tick >= settle_ticks:
+            estimator.push(probe.measure(ctrl))
+    wall_time = time.perf_counter() - start_time
+
+    frequencies = estimator.get_frequencies(timestep)
+    if isinstance(trajectory, MultisineTrajectory):
+        bins = trajectory.harmonics
+    else:
+        bins = np.flatnonzero((frequencies >= low) & (frequencies <= high))
+    return FrequencyResponse(
+        frequencies[bins],
+        estimator.get_transfer()[bins, 0],
+        estimator.get_coherence()[bins, 0],
+        estimator.segments,
+        ticks * timestep,
+        wall_time
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the frequency response and stability margins of a control loop.")
+    parser.add_argument("--loop", choices=list(LOOP_PROBES), default="current-d")
+    parser.add_argument("--excitation", choices=EXCITATION_TYPES, default="multisine")
+    parser.add_argument(
+        "--controller", action="append", default=[], metavar="NAME=VALUE",
+        help="A controller argument, e.g. bandwidth=5000 or kp=20"
+    )
+    parser.add_argument(
+        "--motor", action="append", default=[], metavar="FIELD=VALUE",
+        help="Override a MotorProperties field of the REV NEO, e.g. phase_inductance=0.002"
+    )
+    parser.add_argument("--low", type=float, default=None, help="The lowest frequency in Hz")
+    parser.add_argument("--high", type=float, default=None, help="The highest frequency in Hz")
+    parser.add_argument("--resolution", type=float, default=None, help="The frequency resolution in Hz")
+    parser.add_argument("--amplitude", type=float, default=None, help="The peak perturbation in the loop's units")
+    parser.add_argument("--averages", type=int, default=8, help="Segments to average")
+    parser.add_argument("--lines", type=int, default=40, help="Frequencies in a multisine")
+    parser.add_argument("--timestep", type=float, default=TIMESTEP)
+    parser.add_argument("--rows", type=int, default=20, help="Rows of the printed Bode table")
+    parser.add_argument("--csv", default=None, help="Write the full Bode data to this CSV file")
+    parser.add_argument("--min-bandwidth", type=float, default=None, help="Fail unless the bandwidth is at least this in Hz")
+    parser.add_argument("--min-phase-margin", type=float, default=None, help="Fail unless the phase margin is at least this in degrees")
+    args = parser.parse_args()
+
+    try:
+        properties = replace_properties(REV_NEO_PROPS, dict(parse_setting(spec, MOTOR_PREFIX) for spec in args.motor))
+        controller_args = dict(parse_setting(spec, CONTROLLER_PREFIX) for spec in args.controller)
+    except (ValueError, TypeError) as e:
+        parser.error(str(e))
+    probe = LOOP_PROBES[args.loop]
+    band = (args.low or probe.band[0], args.high or probe.band[1])
+
+    print("--- FOC motor controller frequency response ---")
+    response = analyze_loop(
+        args.loop,
+        properties,
+        controller_args,
+        args.excitation,
+        band,
+        args.resolution,
+        args.amplitude,
+        args.averages,
+        args.lines,
+        args.timestep
+    )
+    print(response.format(args.rows))
+    if args.csv is not None:
+        response.write_csv(args.csv)
+        print(f"Wrote the Bode data to {args.csv}")
+
+    failures = []
+    bandwidth = response.get_bandwidth()
+    if args.min_bandwidth is not None and not bandwidth >= args.min_bandwidth:
+        failures.append(f"bandwidth {bandwidth:.1f} Hz is below {args.min_bandwidth:g} Hz")
+    phase_margin = response.get_phase_margin()
+    if args.min_phase_margin is not None and not phase_margin >= args.min_phase_margin:
+        failures.append(f"phase margin {phase_margin:.1f} deg is below {args.min_phase_margin:g} deg")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
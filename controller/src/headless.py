@@ -0,0 +1,409 @@
+import argparse
+import csv
+import time
+from dataclasses import dataclass, field, replace
+from typing import Sequence
+
+import numpy as np
+
+from .control import MotorController
+from .control.batched import BatchedMotorController, BatchedFOCController, BatchedSixStepController
+from .control.cascade import CascadedFOCController, CONTROL_MODES
+from .control.estimators import ESTIMATOR_TYPES
+from .control.fixed_point import FixedPointMath, QFormat
+from .control.foc import FOCController
+from .control.modulation import Modulator, MODULATOR_TYPES
+from .control.six_step import SixStepController
+from .control.trajectory import parse_trajectory
+from .detectors import Detector, DivergenceDetector, SteadyStateDetector, StopReason
+from .main import TIMESTEP
+from .motor_sim import SimIOInterface
+from .motor_sim.batched import BatchedSimIOInterface
+from .motor_sim.cogging import parse_cogging
+from .motor_sim.integrators import Integrator, INTEGRATOR_TYPES
+from .motor_sim.inverter import Inverter, INVERTER_TYPES
+from .motor_sim.loads import LoadModel, parse_load
+from .motor_sim.properties import MotorProperties, REV_NEO_PROPS
+from .profiler import PROFILER
+from .scheduler import CostSplit, MultiRateScheduler
+from .signals import sample_signals, sample_batched_signals
+from .snapshot import SimulationState
+from .telemetry import TelemetryRecorder
+
+CONTROLLER_TYPES: dict[str, type[MotorController]] = {
+    "FOC": FOCController,
+    "Six-step": SixStepController,
+    "Cascaded FOC": CascadedFOCController
+}
+
+BATCHED_CONTROLLER_TYPES: dict[str, type[BatchedMotorController]] = {
+    "FOC": BatchedFOCController,
+    "Six-step": BatchedSixStepController
+}
+
+@dataclass
+class SimulationRecording:
+    """The signals recorded from a headless simulation run."""
+
+    timestep: float
+    """The control period used for the run in seconds."""
+
+    start_time: float = 0.0
+    """The simulation time the run started at in seconds, which is nonzero when it continued from a snapshot."""
+
+    times: list[float] = field(default_factory=list)
+    """The simulation time of every recorded sample in seconds."""
+
+    signals: dict[str, dict[str, list[float]]] = field(default_factory=dict)
+    """Maps signal group -> series name -> values, aligned with `times`."""
+
+    steps: int = 0
+    """The number of control ticks taken."""
+
+    wall_time: float = 0
+    """The wall-clock time the run took in seconds."""
+
+    cost_split: CostSplit | None = None
+    """How the wall-clock time divided between the controller and the physics."""
+
+    final_state: SimulationState | None = None
+    """A snapshot of the end of the run, if it was requested."""
+
+    stop_reason: StopReason | None = None
+    """Why a detector ended the run early, or None if it ran for the full duration."""
+
+    def get(self, group: str, series: str) -> list[float]:
+        return self.signals[group][series]
+
+    @property
+    def steps_per_second(self) -> float:
+        return self.steps / self.wall_time if self.wall_time > 0 else float("inf")
+
+    @property
+    def realtime_ratio(self) -> float:
+        return self.steps_per_second * self.timestep
+
+    def write_csv(self, path: str):
+        """Write the recording as a CSV file with one column per series."""
+        columns = [(group, name) for group, series in self.signals.items() for name in series]
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["Time"] + [f"{group}/{name}" for group, name in columns])
+            for i, t in enumerate(self.times):
+                writer.writerow([t] + [self.signals[group][name][i] for group, name in columns])
+
+def run_headless(
+    controller_type: type[MotorController],
+    properties: MotorProperties | None = None,
+    duration: float = 1.0,
+    timestep: float = TIMESTEP,
+    sample_separation: int = 1,
+    integrator: Integrator | None = None,
+    substeps: int = 1,
+    record_path: str | None = None,
+    keep_samples: bool = True,
+    controller_args: dict | None = None,
+    inverter: Inverter | None = None,
+    modulator: Modulator | None = None,
+    load: LoadModel | None = None,
+    initial_state: SimulationState | None = None,
+    capture_state: bool = False,
+    detectors: Sequence[Detector] = (),
+    check_interval: int = 10
+) -> SimulationRecording:
+    """
+    Run the simulation without the GUI as fast as possible, recording the same signals
+    the GUI plots every `sample_separation` steps.  
+    The controller runs every `timestep` seconds, and the plant takes `substeps` physics steps per control tick.  
+    If `record_path` is given, every sample is also streamed to a telemetry recording there; pass
+    `keep_samples=False` to only stream them so long runs don't have to fit in memory.  
+    `controller_args` are passed to the controller's constructor (e.g. `bandwidth` or `phase_advance`).  
+    With an `inverter`, the controller emits duty cycles through its modulator (or `modulator`, if given).  
+    `load` is the mechanical load on the rotor (see motor_sim/loads.py).  
+    With an `initial_state`, the run continues from that snapshot instead of standstill, using its motor properties,
+    integrator, inverter and load unless others are given. Pass `capture_state` to snapshot the end of the run.  
+    `detectors` are checked every `check_interval` control ticks, and the run stops as soon as one of them fires.
+    """
+    if initial_state is not None:
+        (io, ctrl) = initial_state.branch_with(controller_type, properties, controller_args)
+        if integrator is not None:
+            io.motor.integrator = integrator
+        if inverter is not None:
+            io.inverter = inverter
+        if load is not None:
+            io.set_load(load)
+    else:
+        io = SimIOInterface(properties or REV_NEO_PROPS, integrator, inverter, load)
+        ctrl = controller_type(io, **(controller_args or {}))
+    if modulator is not None:
+        ctrl.modulator = modulator
+    scheduler = MultiRateScheduler(io, ctrl, timestep, substeps)
+    steps = round(duration / timestep)
+    elapsed = initial_state.elapsed if initial_state is not None else 0.0
+    recording = SimulationRecording(timestep, elapsed)
+    updates_since_sample = 0
+    recorder: TelemetryRecorder | None = None
+    for detector in detectors:
+        detector.reset()
+    ticks_until_check = check_interval
+
+    start_time = time.perf_counter()
+    steps_taken = 0
+    for _ in range(steps):
+        scheduler.tick()
+
+        elapsed += timestep
+        steps_taken += 1
+
+        updates_since_sample += 1
+        if updates_since_sample >= sample_separation:
+            updates_since_sample = 0
+            profiling = PROFILER.enabled
+            lap = 0.0
+            if profiling:
+                lap = time.perf_counter()
+            sample = sample_signals(io, ctrl)
+            if profiling:
+                lap = PROFILER.lap("Signal sampling", lap)
+
+            if record_path is not None:
+                if recorder is None:
+                    recorder = TelemetryRecorder.for_sample(record_path, sample, timestep * sample_separation, elapsed)
+                recorder.record(sample)
+                if profiling:
+                    lap = PROFILER.lap("Telemetry recording", lap)
+
+            if keep_samples:
+                recording.times.append(elapsed)
+                for group, values in sample.items():
+                    group_data = recording.signals.setdefault(group, {})
+                    for name, value in values.items():
+                        group_data.setdefault(name, []).append(value)
+                if profiling:
+                    PROFILER.lap("Sample storage", lap)
+
+        if detectors:
+            ticks_until_check -= 1
+            if ticks_until_check == 0:
+                ticks_until_check = check_interval
+                for detector in detectors:
+                    recording.stop_reason = detector.update(io, ctrl, elapsed)
+                    if recording.stop_reason is not None:
+                        break
+                if recording.stop_reason is not None:
+                    break
+
+    if recorder is not None:
+        recorder.close()
+    recording.wall_time = time.perf_counter() - start_time
+    recording.steps = steps_taken
+    recording.cost_split = scheduler.get_cost_split()
+    if capture_state:
+        recording.final_state = SimulationState.capture(io, ctrl, elapsed)
+    return recording
+
+def compare_inverter_models(
+    controller_type: type[MotorController],
+    duration: float = 0.2,
+    timestep: float = TIMESTEP,
+    substeps: int = 1,
+    dead_time: float = 0.0
+) -> dict[str, float]:
+    """
+    Run the same simulation through AveragedInverter and SwitchingInverter and return the RMS difference
+    of their rotor velocities (RPM) and phase currents (A), to check the averaged model against the detailed one.
+    """
+    (averaged, switching) = (
+        run_headless(
+            controller_type,
+            duration=duration,
+            timestep=timestep,
+            substeps=substeps,
+            inverter=INVERTER_TYPES[name](dead_time)
+        )
+        for name in ("averaged", "switching")
+    )
+    def rms_difference(group: str, series: str) -> float:
+        return float(np.sqrt(np.mean((np.array(averaged.get(group, series)) - np.array(switching.get(group, series))) ** 2)))
+    return {
+        "velocity": rms_difference("Rotor Velocity", "Velocity"),
+        "current": float(np.mean([rms_difference("Phase Currents", phase) for phase in ("Phase U", "Phase V", "Phase W")]))
+    }
+
+@dataclass
+class BatchedRecording:
+    """The signals recorded from a batched headless run of N motors."""
+
+    timestep: float
+    times: np.ndarray
+    signals: dict[str, np.ndarray]
+    """Maps signal group -> array of shape (samples, N, ...), see `sample_batched_signals`."""
+    motors: int
+    steps: int
+    wall_time: float
+
+    @property
+    def steps_per_second(self) -> float:
+        """The number of single-motor steps simulated per second."""
+        return self.steps * self.motors / self.wall_time if self.wall_time > 0 else float("inf")
+
+def run_batched(
+    controller_type: type[BatchedMotorController],
+    properties: Sequence[MotorProperties],
+    duration: float = 1.0,
+    timestep: float = TIMESTEP,
+    sample_separation: int = 1,
+    load_torque: np.ndarray | float = 0,
+    load: LoadModel | None = None,
+    **controller_args
+) -> BatchedRecording:
+    """
+    Run one simulation per entry of `properties` in lockstep. Extra keyword arguments are passed to
+    the controller, and may be arrays with one value per motor (e.g. `bandwidth` or `phase_advance`).
+    `load` is evaluated for every motor at once, so its parameters may be per-motor arrays too.
+    """
+    io = BatchedSimIOInterface(properties, load_torque, load)
+    ctrl = controller_type(io, **controller_args)
+
+    steps = round(duration / timestep)
+    samples = steps // sample_separation
+    times = np.arange(1, samples + 1) * sample_separation * timestep
+    signals: dict[str, np.ndarray] = {}
+
+    start_time = time.perf_counter()
+    for step in range(1, steps + 1):
+        io.update(timestep, ctrl.get_phase_voltages(timestep))
+
+        if step % sample_separation == 0:
+            sample_index = step // sample_separation - 1
+            for group, values in sample_batched_signals(io, ctrl).items():
+                if group not in signals:
+                    signals[group] = np.empty((samples,) + values.shape)
+                signals[group][sample_index] = values
+
+    return BatchedRecording(
+        timestep=timestep,
+        times=times,
+        signals=signals,
+        motors=len(io),
+        steps=steps,
+        wall_time=time.perf_counter() - start_time
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the motor simulation without the GUI.")
+    parser.add_argument("--controller", choices=list(CONTROLLER_TYPES), default="FOC")
+    parser.add_argument("--duration", type=float, default=1.0, help="Simulated duration in seconds")
+    parser.add_argument("--timestep", type=float, default=TIMESTEP, help="Control period in seconds")
+    parser.add_argument("--substeps", type=int, default=1, help="Physics steps per control tick")
+    parser.add_argument("--integrator", choices=list(INTEGRATOR_TYPES), default="euler")
+    parser.add_argument(
+        "--inverter", choices=["ideal"] + list(INVERTER_TYPES), default="ideal",
+        help="Drive the motor through a PWM inverter model, with one switching period per physics step. "
+        "Off (ideal) by default to match the batched engine, see motor_sim/inverter.py"
+    )
+    parser.add_argument("--mode", choices=CONTROL_MODES, default="speed", help="The outer loop of the cascaded FOC controller")
+    parser.add_argument(
+        "--trajectory",
+        help="Setpoint trajectory for the cascaded FOC controller, e.g. step:0,300,0.05, ramp:0,300,0,0.5, "
+             "trapezoid:0,20,300,3000 or trace:setpoints.csv (amps, mechanical rad/s or radians depending on --mode)"
+    )
+    parser.add_argument("--estimator", choices=list(ESTIMATOR_TYPES), default="encoder", help="How the controller estimates the rotor angle")
+    parser.add_argument("--modulation", choices=list(MODULATOR_TYPES), default="svpwm")
+    parser.add_argument("--dead-time", type=float, default=0.0, help="Inverter dead time in seconds")
+    parser.add_argument(
+        "--load",
+        help="The load on the rotor, e.g. constant:-0.01, gearbox:0.01,10, fan:2e-6, spring:0.005,0,1e-5 or trace:torque.csv, summed with +"
+    )
+    parser.add_argument(
+        "--cogging",
+        help="The motor's cogging torque, e.g. slots:12,14,0.002 for 12 slots and 14 poles, harmonic:84,0.002+168,0.0005 "
+             "or csv:cogging.csv,84 for a map measured over 1/84 of a revolution"
+    )
+    parser.add_argument("--fixed-point", help="Run the FOC current loop in a fixed point format like Q15.16 and report its cost")
+    parser.add_argument("--sin-lut", type=int, default=256, help="Sine table size for --fixed-point, or 0 for no table")
+    parser.add_argument("--rounding", choices=("nearest", "truncate"), default="nearest", help="Rounding for --fixed-point")
+    parser.add_argument("--overflow", choices=("saturate", "wrap"), default="saturate", help="Overflow handling for --fixed-point")
+    parser.add_argument("--load-state", help="Continue from a simulation state saved with --save-state instead of standstill")
+    parser.add_argument("--save-state", help="Save the state at the end of the run to this file")
+    parser.add_argument("--early-stop", action="store_true", help="Stop once the run settles or diverges")
+    parser.add_argument("--settle-window", type=float, default=0.1, help="The window the run must be steady over in seconds")
+    parser.add_argument("--settle-tolerance", type=float, default=0.005, help="Relative tolerance of the steady state check")
+    parser.add_argument("--min-time", type=float, default=0.0, help="Don't stop as settled before this time in seconds")
+    parser.add_argument("--max-current", type=float, default=200.0, help="Phase current that counts as diverged in amps")
+    parser.add_argument("--sample-separation", type=int, default=1, help="Steps between recorded samples")
+    parser.add_argument("--output", help="Optional CSV file to write the recorded signals to")
+    parser.add_argument("--record", help="Optional directory to stream a binary telemetry recording to")
+    parser.add_argument("--profile", action="store_true", help="Time each stage of the step and print the breakdown")
+    args = parser.parse_args()
+
+    if args.trajectory and args.controller != "Cascaded FOC":
+        parser.error("--trajectory requires --controller 'Cascaded FOC'")
+    try:
+        trajectory = parse_trajectory(args.trajectory) if args.trajectory else None
+        load = parse_load(args.load) if args.load else None
+        cogging = parse_cogging(args.cogging) if args.cogging else None
+    except (ValueError, TypeError, OSError) as e:
+        parser.error(str(e))
+
+    controller_args: dict = {"estimator": args.estimator}
+    if args.controller == "Cascaded FOC":
+        controller_args["mode"] = args.mode
+        controller_args["trajectory"] = trajectory
+    fixed_point: FixedPointMath | None = None
+    if args.fixed_point:
+        if not issubclass(CONTROLLER_TYPES[args.controller], FOCController):
+            parser.error("--fixed-point requires an FOC controller")
+        fixed_point = FixedPointMath(QFormat.parse(args.fixed_point), args.rounding, args.overflow, args.sin_lut or None)
+        controller_args["fixed_point"] = fixed_point
+
+    print("--- FOC motor controller headless simulation ---")
+    PROFILER.enabled = args.profile
+
+    recording = run_headless(
+        CONTROLLER_TYPES[args.controller],
+        duration=args.duration,
+        timestep=args.timestep,
+        sample_separation=args.sample_separation,
+        integrator=INTEGRATOR_TYPES[args.integrator](),
+        substeps=args.substeps,
+        record_path=args.record,
+        inverter=INVERTER_TYPES[args.inverter](args.dead_time) if args.inverter != "ideal" else None,
+        modulator=MODULATOR_TYPES[args.modulation](),
+        load=load,
+        properties=replace(REV_NEO_PROPS, cogging=cogging) if cogging is not None else None,
+        controller_args=controller_args,
+        initial_state=SimulationState.load(args.load_state) if args.load_state else None,
+        capture_state=args.save_state is not None,
+        detectors=[
+            DivergenceDetector(args.max_current),
+            SteadyStateDetector(args.settle_window, relative_tolerance=args.settle_tolerance, min_time=args.min_time)
+        ] if args.early_stop else (),
+        # Streamed recordings can be much longer than what fits in memory
+        keep_samples=args.record is None or args.output is not None
+    )
+
+    print(f"Simulated {recording.steps * args.timestep:.3f} s ({recording.steps} control ticks) in {recording.wall_time:.3f} s")
+    if recording.stop_reason is not None:
+        print(f"Stopped early: {recording.stop_reason}")
+    print(f"Update rate: {recording.steps_per_second:.2f} Hz")
+    print(f"Realtime ratio: {recording.realtime_ratio * 100:.1f}%")
+    print(recording.cost_split)
+    if args.profile:
+        print(PROFILER.format_report())
+    if fixed_point is not None:
+        print(fixed_point.get_report().format(control_rate=1 / args.timestep))
+    if args.record:
+        print(f"Streamed telemetry to {args.record}")
+    if recording.final_state is not None:
+        recording.final_state.save(args.save_state)
+        print(f"Saved the final state to {args.save_state}")
+    if recording.times:
+        print(f"Final velocity: {recording.get('Rotor Velocity', 'Velocity')[-1]:.2f} RPM")
+
+    if args.output:
+        recording.write_csv(args.output)
+        print(f"Wrote {len(recording.times)} samples to {args.output}")
+
+if __name__ == "__main__":
+    main()
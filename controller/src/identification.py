@@ -0,0 +1,305 @@
+import argparse
+import math
+from dataclasses import dataclass
+from typing import Iterable, NamedTuple
+
+import numpy as np
+
+from .motor_sim.properties import BackEMFCoeffs, MotorProperties
+from .telemetry import TelemetryReader
+
+# Identifies motor properties from recorded phase voltages, phase currents and encoder angles by least squares,
+# reading the recording a chunk at a time so captures of any length fit in memory. Two passes over the recording
+# fit the two halves of the motor model:
+#
+#   Electrical, per line-to-line pair ab of the star-connected phases:
+#     v_ab = L di_ab/dt + R i_ab + pole_pairs * omega * sum_n Ke_n (f_n(theta_a) - f_n(theta_b))
+#   Mechanical, with the electromagnetic torque from the fitted back EMF, integrated over short windows:
+#     sum_x i_x Ke f(theta_x) = J domega/dt + b omega + c sign(omega)
+#
+# Line-to-line voltages cancel the unknown neutral voltage, which also cancels the triplen (3rd and 9th) back EMF
+# harmonics. With an isolated neutral those don't drive any current or torque either, so they can't be identified
+# and come out as zero. Ke and the normalized coefficients are only known up to their product, so the fundamental
+# coefficient is normalized to 1.
+#
+# Voltages are taken to be the ones applied over the interval leading up to their sample, like the simulation records,
+# and samples are related the way the simulation's Euler integrator steps. Board captures sampled well above the
+# electrical frequency fit the same equations to within a fraction of a sample of phase.
+
+OBSERVABLE_HARMONICS = (1, 5, 7)
+"""The back EMF harmonics of `BackEMFCoeffs` that aren't multiples of 3."""
+OVERLAP = 2
+"""Samples each chunk shares with the previous one, since the regressors difference the angle twice."""
+
+class TraceChannels(NamedTuple):
+    """The channel names of a recording to identify from."""
+
+    voltages: tuple[str, str, str] = ("Phase Voltages/Phase U", "Phase Voltages/Phase V", "Phase Voltages/Phase W")
+    currents: tuple[str, str, str] = ("Phase Currents/Phase U", "Phase Currents/Phase V", "Phase Currents/Phase W")
+    angle: str = "Rotor Angle/Angle"
+    """The mechanical rotor angle in radians, wrapped or not."""
+
+    def all(self) -> list[str]:
+        return [*self.voltages, *self.currents, self.angle]
+
+class ChunkedLeastSquares:
+    """
+    Solves min |A x - y| for rows added a chunk at a time. Only the triangular factor of the QR decomposition
+    of [A y] is kept, so memory doesn't grow with the number of rows and the solution is as accurate as solving
+    with every row at once.
+    """
+
+    columns: int
+    rows: int
+
+    def __init__(self, columns: int):
+        self.columns = columns
+        self.rows = 0
+        self._r = np.zeros((0, columns + 1))
+
+    def add(self, regressors: np.ndarray, targets: np.ndarray):
+        """Add rows of shape (rows, columns) and their targets."""
+        finite = np.isfinite(regressors).all(axis=1) & np.isfinite(targets)
+        stacked = np.vstack((self._r, np.column_stack((regressors[finite], targets[finite]))))
+        self._r = np.linalg.qr(stacked, mode="r")
+        self.rows += int(finite.sum())
+
+    def solve(self) -> np.ndarray:
+        if self.rows < self.columns:
+            raise ValueError(f"Need at least {self.columns} usable samples to fit {self.columns} parameters, got {self.rows}")
+        r = self._r[:self.columns, :self.columns]
+        # Scale the columns so parameters of very different magnitudes are judged equally for rank deficiency
+        scale = np.linalg.norm(r, axis=0)
+        scale[scale == 0] = 1
+        solution = np.linalg.lstsq(r / scale, self._r[:self.columns, self.columns], rcond=None)[0]
+        return solution / scale
+
+    @property
+    def residual_rms(self) -> float:
+        """The RMS of the fit's residuals."""
+        if self.rows <= self.columns:
+            return 0.0
+        return abs(float(self._r[self.columns, self.columns])) / math.sqrt(self.rows)
+
+def _iter_overlapping_chunks(
+    reader: TelemetryReader,
+    channels: TraceChannels,
+    chunk_size: int
+) -> Iterable[dict[str, np.ndarray]]:
+    """Chunks of every channel as float64, each starting with the last `OVERLAP` samples of the previous one."""
+    tail: dict[str, np.ndarray] | None = None
+    for (_, views) in reader.iter_chunks(channels.all(), chunk_size):
+        chunk = {name: np.asarray(view, dtype=float) for name, view in views.items()}
+        if tail is not None:
+            chunk = {name: np.concatenate((tail[name], values)) for name, values in chunk.items()}
+        tail = {name: values[-OVERLAP:] for name, values in chunk.items()}
+        if len(chunk[channels.angle]) > OVERLAP:
+            yield chunk
+
+def _get_velocities(angles: np.ndarray, dt: float) -> np.ndarray:
+    """The mechanical velocity over each interval between samples, which has one entry fewer than `angles`."""
+    return np.angle(np.exp(1j * np.diff(angles))) / dt
+
+def _get_harmonic_basis(electrical_angles: np.ndarray) -> np.ndarray:
+    """sin(n theta) and cos(n theta) for every observable harmonic n, stacked along the last axis."""
+    return np.stack([
+        function(n * electrical_angles)
+        for n in OBSERVABLE_HARMONICS for function in (np.sin, np.cos)
+    ], axis=-1)
+
+def _get_phase_angles(electrical_angles: np.ndarray) -> np.ndarray:
+    """The electrical angle of each phase with shape (samples, 3)."""
+    return electrical_angles[:, None] - np.array([0, 2 * math.pi / 3, 4 * math.pi / 3])
+
+@dataclass
+class IdentificationResult:
+    properties: MotorProperties
+    encoder_offset: float
+    """The electrical angle of the rotor at encoder angle 0 in radians, which `MotorProperties` assumes is 0."""
+    bemf_harmonics: np.ndarray
+    """The raw back EMF fit as Ke * (sin, cos) coefficient pairs of each of OBSERVABLE_HARMONICS, in V/(rad/s)."""
+    samples: int
+    electrical_residual_rms: float
+    """Volts"""
+    mechanical_residual_rms: float
+    """Nm"""
+
+    def format(self) -> str:
+        p = self.properties
+        return "\n".join([
+            f"Identified from {self.samples} samples",
+            f"Electrical fit residual: {self.electrical_residual_rms:.4g} V RMS",
+            f"Mechanical fit residual: {self.mechanical_residual_rms:.4g} Nm RMS",
+            f"Encoder offset: {math.degrees(self.encoder_offset):.2f} electrical degrees",
+            "MotorProperties(",
+            f"    pole_pairs={p.pole_pairs},",
+            f"    rotor_inertia={p.rotor_inertia:.6g},",
+            f"    phase_inductance={p.phase_inductance:.6g},",
+            f"    phase_resistance={p.phase_resistance:.6g},",
+            f"    bemf_constant={p.bemf_constant:.6g},",
+            f"    normed_bemf_coeffs=({', '.join(f'{c:.4g}' for c in p.normed_bemf_coeffs)}),",
+            f"    viscous_friction={p.viscous_friction:.6g},",
+            f"    coulomb_frinction={p.coulomb_frinction:.6g},",
+            f"    vbus={p.vbus:g}",
+            ")"
+        ])
+
+def fit_electrical(
+    reader: TelemetryReader,
+    pole_pairs: int,
+    channels: TraceChannels = TraceChannels(),
+    chunk_size: int = 1 << 20,
+    max_voltage: float = math.inf
+) -> tuple[float, float, np.ndarray, ChunkedLeastSquares]:
+    """
+    The phase resistance, inductance and back EMF harmonics (see `IdentificationResult.bemf_harmonics`).
+    Samples commanding a phase voltage beyond `max_voltage` are skipped, since the inverter clips what it applies.
+    """
+    dt = reader.sample_interval
+    harmonics = len(OBSERVABLE_HARMONICS)
+    fit = ChunkedLeastSquares(2 + 2 * harmonics)
+    for chunk in _iter_overlapping_chunks(reader, channels, chunk_size):
+        angles = chunk[channels.angle]
+        # Row k explains the voltage applied from sample k - 1 to k with the state at sample k - 1,
+        # whose velocity comes from samples k - 2 and k - 1
+        velocities = _get_velocities(angles, dt)[:-1]
+        electrical_angles = pole_pairs * angles[1:-1]
+        basis = _get_harmonic_basis(_get_phase_angles(electrical_angles)) * (pole_pairs * velocities)[:, None, None]
+        voltages = np.stack([chunk[name] for name in channels.voltages], axis=1)
+        currents = np.stack([chunk[name] for name in channels.currents], axis=1)
+        unsaturated = (np.abs(voltages[2:]) <= max_voltage).all(axis=1)
+
+        # The U-V and V-W line pairs; W-U is their negated sum, so it adds nothing
+        for (a, b) in ((0, 1), (1, 2)):
+            line_currents = currents[:, a] - currents[:, b]
+            fit.add(
+                np.column_stack((
+                    np.diff(line_currents)[1:] / dt,
+                    line_currents[1:-1],
+                    basis[:, a] - basis[:, b]
+                ))[unsaturated],
+                (voltages[2:, a] - voltages[2:, b])[unsaturated]
+            )
+
+    solution = fit.solve()
+    return (float(solution[1]), float(solution[0]), solution[2:], fit)
+
+def get_electromagnetic_torque(currents: np.ndarray, electrical_angles: np.ndarray, bemf_harmonics: np.ndarray) -> np.ndarray:
+    """The torque of phase currents with shape (samples, 3) from the fitted back EMF harmonics."""
+    basis = _get_harmonic_basis(_get_phase_angles(electrical_angles))
+    return ((basis @ bemf_harmonics) * currents).sum(axis=1)
+
+def fit_mechanical(
+    reader: TelemetryReader,
+    pole_pairs: int,
+    bemf_harmonics: np.ndarray,
+    channels: TraceChannels = TraceChannels(),
+    chunk_size: int = 1 << 20,
+    window: float = 0.01
+) -> tuple[float, float, float, ChunkedLeastSquares]:
+    """
+    The total inertia on the rotor, viscous friction and coulomb friction. Differencing the angle twice amplifies
+    encoder quantization (and float32 rounding) into acceleration noise that biases the inertia towards zero,
+    so the torque balance is integrated over windows of `window` seconds instead:
+        J (omega_end - omega_start) + b (theta_end - theta_start) + c integral sign(omega) dt = integral torque dt
+    """
+    dt = reader.sample_interval
+    window_samples = max(1, round(window / dt))
+    fit = ChunkedLeastSquares(3)
+    # Per-sample terms of the window that was still open at the end of the last chunk
+    pending = np.zeros((0, 4))
+    for chunk in _iter_overlapping_chunks(reader, channels, chunk_size):
+        angles = chunk[channels.angle]
+        currents = np.stack([chunk[name] for name in channels.currents], axis=1)
+        # Term j covers the change in velocity from the interval ending at sample j + 1 to the one after it.
+        # Like the simulation's semi-implicit Euler step, that's driven by the currents at the end of the
+        # second interval in the back EMF field at its start
+        torques = get_electromagnetic_torque(currents[2:], pole_pairs * angles[1:-1], bemf_harmonics)
+        velocities = _get_velocities(angles, dt)
+        terms = np.vstack((pending, np.column_stack((
+            np.diff(velocities),
+            velocities[:-1] * dt,
+            np.sign(velocities[:-1]) * dt,
+            torques * dt
+        ))))
+        complete = len(terms) // window_samples * window_samples
+        (windows, pending) = (terms[:complete], terms[complete:])
+        if complete:
+            sums = windows.reshape(-1, window_samples, 4).sum(axis=1)
+            fit.add(sums[:, :3], sums[:, 3])
+
+    (inertia, viscous_friction, coulomb_friction) = fit.solve()
+    return (float(inertia), float(viscous_friction), float(coulomb_friction), fit)
+
+def identify_motor(
+    recording: TelemetryReader | str,
+    pole_pairs: int,
+    channels: TraceChannels = TraceChannels(),
+    chunk_size: int = 1 << 20,
+    vbus: float = 12,
+    mechanical_window: float = 0.01
+) -> IdentificationResult:
+    """
+    Identify a motor from a telemetry recording (see telemetry.py) of a run with enough excitation: changing
+    currents for the inductance and changing velocity, ideally in both directions, for the inertia and friction.
+    Samples where the phase voltages saturate at `vbus` are left out of the electrical fit.
+    The inertia is the total on the rotor, so it includes any load's. Cogging and load torques aren't modelled,
+    so they show up in the mechanical residual.
+    """
+    reader = TelemetryReader(recording) if isinstance(recording, str) else recording
+    (resistance, inductance, bemf_harmonics, electrical_fit) = fit_electrical(
+        reader, pole_pairs, channels, chunk_size, vbus
+    )
+    (inertia, viscous_friction, coulomb_friction, mechanical_fit) = fit_mechanical(
+        reader, pole_pairs, bemf_harmonics, channels, chunk_size, mechanical_window
+    )
+
+    # Ke_n (sin(n theta), cos(n theta)) pairs as complex amplitudes, which rotate by n times the encoder offset
+    amplitudes = bemf_harmonics[0::2] + 1j * bemf_harmonics[1::2]
+    encoder_offset = float(np.angle(amplitudes[0]))
+    bemf_constant = float(abs(amplitudes[0]))
+    if bemf_constant == 0:
+        raise ValueError("The recording has no back EMF to identify; the rotor needs to turn")
+    normed = {
+        n: float((amplitude * np.exp(-1j * n * encoder_offset)).real) / bemf_constant
+        for n, amplitude in zip(OBSERVABLE_HARMONICS, amplitudes)
+    }
+    coeffs: BackEMFCoeffs = (normed[1], 0.0, normed[5], normed[7], 0.0)
+
+    properties = MotorProperties(
+        pole_pairs=pole_pairs,
+        rotor_inertia=inertia,
+        phase_inductance=inductance,
+        phase_resistance=resistance,
+        bemf_constant=bemf_constant,
+        normed_bemf_coeffs=coeffs,
+        viscous_friction=viscous_friction,
+        coulomb_frinction=coulomb_friction,
+        vbus=vbus
+    )
+    return IdentificationResult(
+        properties=properties,
+        encoder_offset=encoder_offset,
+        bemf_harmonics=bemf_harmonics,
+        samples=electrical_fit.rows // 2,
+        electrical_residual_rms=electrical_fit.residual_rms,
+        mechanical_residual_rms=mechanical_fit.residual_rms
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Identify motor properties from a telemetry recording.")
+    parser.add_argument("recording", help="A telemetry recording directory, e.g. from headless --record")
+    parser.add_argument("--pole-pairs", type=int, default=7)
+    parser.add_argument("--vbus", type=float, default=12, help="The bus voltage to put in the properties")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20, help="Samples read into memory at a time")
+    parser.add_argument("--window", type=float, default=0.01, help="Seconds to integrate the torque balance over")
+    args = parser.parse_args()
+
+    print("--- FOC motor controller parameter identification ---")
+    result = identify_motor(
+        args.recording, args.pole_pairs, chunk_size=args.chunk_size, vbus=args.vbus, mechanical_window=args.window
+    )
+    print(result.format())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .motor_sim.properties import MotorProperties
+
+# The boundary between the control code and whatever it drives: the in-process simulator (SimIOInterface),
+# a board or simulator on the other end of a serial port or socket (remote_io.py), or anything else that can
+# read an encoder and phase currents and apply phase voltages. Controllers and estimators only use this.
+
+class IOInterface(ABC):
+    properties: "MotorProperties"
+    """The controller's model of the motor, e.g. nominal or identified properties for a real one."""
+    last_phase_voltages: tuple[float, float, float] = (0, 0, 0)
+    """The phase voltages applied by the last `update` in volts."""
+    debug_led_state: tuple[bool, bool, bool] = (False, False, False)
+
+    @abstractmethod
+    def get_encoder_position(self) -> float:
+        """The mechanical rotor angle in radians, in [0, 2pi)."""
+        pass
+
+    @abstractmethod
+    def get_phase_currents(self) -> tuple[float, float, float]:
+        """The phase currents U, V and W in amps."""
+        pass
+
+    @abstractmethod
+    def update(self, dt: float, phase_voltages: tuple[float, float, float]):
+        """Apply the phase voltages for `dt` seconds, after which the readings reflect the new state."""
+        pass
+
+    def set_debug_leds(self, led1: bool, led2: bool, led3: bool):
+        self.debug_led_state = (led1, led2, led3)
+
+    def reset(self):
+        pass
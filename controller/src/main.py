@@ -1,18 +1,24 @@
 import math
+import os
 import time
+from datetime import datetime
 
-from .control.six_step import SixStepController
 from .control.foc import FOCController
 from .control import MotorController
 
 from .motor_sim import SimIOInterface
 
-TIMESTEP = 0.0001 # 0.1 ms timestep
-# Dependent on 60fps, but whatever
-REALTIME_UPDATES_PER_FRAME = int(1 / TIMESTEP / 60)
+TIMESTEP = 0.0001 # 0.1 ms timestep
 
 def main():
     from .plot import TimeSeriesPlot
+    from .headless import CONTROLLER_TYPES
+    from .profiler import PROFILER
+    from .sim_worker import (
+        SimulationWorker, SetPaused, Restart, SwitchController, SetSubsteps, SetSampleSeparation, SetSpeed,
+        SetSetpoint, SetLoad, SaveState, RestoreState, StartRecording, StopRecording
+    )
+    from .motor_sim.loads import parse_load
     import dearpygui.dearpygui as dpg
 
     print("--- FOC motor controller simulation ---")
@@ -30,11 +36,15 @@ def main():
     dpg.setup_dearpygui()
 
     paused = True
-    updates_per_frame = REALTIME_UPDATES_PER_FRAME
+    speed = 1.0
+    unlimited_speed = False
     history_length = 0.05
     sample_separation = 2
     
-    plots: list[TimeSeriesPlot] = []
+    # The simulation runs on its own thread; everything below only talks to it through commands and snapshots
+    worker = SimulationWorker(io, ctrl, TIMESTEP, sample_separation, paused=paused)
+    
+    plots: dict[str, TimeSeriesPlot] = {}
     
     with dpg.window(label="Simulation", width=600, height=1000):
         info_text = dpg.add_text(default_value="")
@@ -44,45 +54,129 @@ def main():
             def toggle_pause():
                 nonlocal paused
                 paused = not paused
+                worker.send(SetPaused(paused))
                 dpg.set_item_label(pause_button, "Resume" if paused else "Pause")
             pause_button = dpg.add_button(label="Resume" if paused else "Pause", callback=toggle_pause)
             
             # Restart button
             def restart_simulation():
-                io.reset()
-                ctrl.reset()
+                worker.send(Restart())
             dpg.add_button(label="Restart", callback=restart_simulation)
+        
+        # Stream every sample to a telemetry recording on disk
+        def toggle_recording(sender, app_data):
+            if app_data:
+                worker.send(StartRecording(os.path.join("recordings", datetime.now().strftime("%Y%m%d-%H%M%S"))))
+            else:
+                worker.send(StopRecording())
+        dpg.add_checkbox(label="Record telemetry", callback=toggle_recording)
+        
+        # Snapshots to branch experiments from, including the plot contents
+        def save_state(path: str | None):
+            worker.send(SaveState(path, {label: plot.export_history() for label, plot in plots.items()}))
+        with dpg.group(horizontal=True):
+            dpg.add_button(label="Branch from here", callback=lambda: save_state(None))
+            dpg.add_button(label="Return to branch point", callback=lambda: worker.send(RestoreState()))
+        with dpg.group(horizontal=True):
+            state_path = dpg.add_input_text(label="State file", default_value=os.path.join("states", "state.pkl"), width=300)
+            dpg.add_button(label="Save", callback=lambda: save_state(dpg.get_value(state_path)))
+            dpg.add_button(label="Load", callback=lambda: worker.send(RestoreState(dpg.get_value(state_path))))
+        state_text = dpg.add_text(default_value="")
             
         dpg.add_separator()
         
         # Controller type
         def change_controller(_id, controller):
-            nonlocal ctrl
-            if controller == "FOC":
-                ctrl = FOCController(io)
-            elif controller == "Six-step":
-                ctrl = SixStepController(io)
+            worker.send(SwitchController(controller))
         dpg.add_text("Controller type")
-        dpg.add_radio_button(["FOC", "Six-step"], callback=change_controller, horizontal=True)
+        dpg.add_radio_button(list(CONTROLLER_TYPES), callback=change_controller, horizontal=True)
+        
+        # Setpoints for the cascaded FOC controller's outer loops, shown in friendlier units than the controller's SI ones
+        setpoint_units = {"current": ("A", 1.0), "speed": ("RPM", 2 * math.pi / 60), "position": ("rev", 2 * math.pi)}
+        with dpg.collapsing_header(label="Cascaded FOC setpoint", default_open=False):
+            setpoint_mode = dpg.add_radio_button(list(setpoint_units), default_value="speed", horizontal=True)
+            setpoint_profile = dpg.add_radio_button(["step", "ramp", "trapezoid"], default_value="ramp", horizontal=True)
+            setpoint_target = dpg.add_input_float(label="Target", default_value=300.0)
+            setpoint_rate = dpg.add_input_float(label="Rate (units/s)", default_value=1000.0, min_value=1e-3, min_clamped=True)
+            def apply_setpoint():
+                mode = dpg.get_value(setpoint_mode)
+                scale = setpoint_units[mode][1]
+                worker.send(SetSetpoint(
+                    mode,
+                    dpg.get_value(setpoint_target) * scale,
+                    dpg.get_value(setpoint_profile),
+                    dpg.get_value(setpoint_rate) * scale
+                ))
+            dpg.add_button(label="Apply setpoint", callback=apply_setpoint)
+            dpg.add_text("Units: A of torque current, RPM or revolutions")
+        
+        # Mechanical load on the rotor, as a spec for parse_load prefilled with a typical one of each kind
+        load_examples = {
+            "none": "",
+            "constant": "constant:-0.02",
+            "gearbox": "gearbox:0.01,10,-0.1",
+            "fan": "fan:2e-6",
+            "spring": "spring:0.01,0,1e-5",
+            "trace": "trace:torque.csv"
+        }
+        with dpg.collapsing_header(label="Load", default_open=False):
+            def change_load_type(sender, app_data):
+                dpg.set_value(load_spec, load_examples[app_data])
+            dpg.add_radio_button(list(load_examples), default_value="none", horizontal=True, callback=change_load_type)
+            load_spec = dpg.add_input_text(label="Spec", hint="e.g. gearbox:0.01,10+fan:2e-6")
+            def apply_load():
+                spec = dpg.get_value(load_spec).strip()
+                try:
+                    load = parse_load(spec) if spec else None
+                except (ValueError, TypeError, OSError) as e:
+                    dpg.set_value(load_status, f"Invalid load: {e}")
+                    return
+                worker.send(SetLoad(load))
+                dpg.set_value(load_status, f"Load: {spec or 'none'}")
+            dpg.add_button(label="Apply load", callback=apply_load)
+            load_status = dpg.add_text("Load: none")
         
         dpg.add_separator()
         
-        # Target updates per frame
-        def change_updates_per_frame(sender, app_data):
-            nonlocal updates_per_frame
-            updates_per_frame = app_data
+        # Target simulation speed
+        def send_speed():
+            worker.send(SetSpeed(None if unlimited_speed else speed))
+        def change_speed(sender, app_data):
+            nonlocal speed
+            speed = app_data
+            send_speed()
+        dpg.add_slider_float(
+            label="Speed (x realtime)",
+            default_value=speed,
+            min_value=0.01,
+            max_value=5.0,
+            callback=change_speed
+        )
+        def change_unlimited_speed(sender, app_data):
+            nonlocal unlimited_speed
+            unlimited_speed = app_data
+            send_speed()
+        dpg.add_checkbox(label="Run as fast as possible", default_value=unlimited_speed, callback=change_unlimited_speed)
+        
+        # Physics substeps per control tick
+        def change_substeps(sender, app_data):
+            worker.send(SetSubsteps(app_data))
         dpg.add_slider_int(
-            label="Updates per frame",
-            default_value=updates_per_frame,
+            label="Physics substeps",
+            default_value=1,
             min_value=1,
-            max_value=REALTIME_UPDATES_PER_FRAME,
-            callback=change_updates_per_frame
+            max_value=20,
+            callback=change_substeps
         )
         
         # Sample separation
         def change_sample_separation(sender, app_data):
             nonlocal sample_separation
             sample_separation = app_data
+            worker.send(SetSampleSeparation(sample_separation))
+            
+            for plot in plots.values():
+                plot.set_history(history_length, TIMESTEP * sample_separation)
         dpg.add_slider_int(
             label="Sample separation",
             default_value=sample_separation,
@@ -96,8 +190,8 @@ def main():
             nonlocal history_length
             history_length = app_data
             
-            for plot in plots:
-                plot.history_length = history_length
+            for plot in plots.values():
+                plot.set_history(history_length, TIMESTEP * sample_separation)
         
         dpg.add_slider_float(
             label="History length (s)",
@@ -107,111 +201,95 @@ def main():
             callback=change_history_length
         )
 
+        dpg.add_separator()
+
+        # Per-stage timing of the step, which costs a little speed while enabled
+        def toggle_profiling(sender, app_data):
+            PROFILER.reset()
+            PROFILER.enabled = app_data
+            if not app_data:
+                dpg.set_value(profile_text, "")
+        with dpg.group(horizontal=True):
+            dpg.add_checkbox(label="Profile step stages", callback=toggle_profiling)
+            dpg.add_button(label="Reset profile", callback=lambda: PROFILER.reset())
+        profile_text = dpg.add_text(default_value="")
+
     with dpg.window(label="Graphs", pos=(600, 0), height=1400, width=1200):
         dpg.bind_font(default_font)
 
         with dpg.group(horizontal=False):
-            def p(plot: TimeSeriesPlot) -> TimeSeriesPlot:
-                plots.append(plot)
-                return plot
+            def p(label: str, y_label: str, default_visible: bool) -> TimeSeriesPlot:
+                # Plots are keyed by the signal group they show
+                plots[label] = TimeSeriesPlot(
+                    label, y_label, history_length, TIMESTEP * sample_separation, default_visible=default_visible
+                )
+                return plots[label]
             
             # Create plots for different data types
-            angle_plot = p(TimeSeriesPlot("Rotor Angle", "Angle (rad)", history_length, default_visible=False))
+            angle_plot = p("Rotor Angle", "Angle (rad)", default_visible=False)
             angle_plot.set_y_range(0, 2*math.pi)
-            velocity_plot = p(TimeSeriesPlot("Rotor Velocity", "Velocity (RPM)", history_length, default_visible=True))
-            voltage_plot = p(TimeSeriesPlot("Phase Voltages", "Voltage (V)", history_length, default_visible=True))
-            phase_current_plot = p(TimeSeriesPlot("Phase Currents", "Current (A)", history_length, default_visible=False))
-            dq_current_plot = p(TimeSeriesPlot("DQ Currents", "Current (A)",  history_length, default_visible=False))
-            dq_output_plot = p(TimeSeriesPlot("DQ Voltage Output", "Voltage (V)", history_length, default_visible=False))
-            dq_integral_plot = p(TimeSeriesPlot("DQ Integral Terms", "Integral (V)", history_length, default_visible=False))
-            torque_plot = p(TimeSeriesPlot("Torque", "Torque (Nm)", history_length, default_visible=False))
-
-    elapsed = 0
-    updates_since_sample = 0
-    def update_gui(delta: float):
-        nonlocal elapsed, updates_since_sample
-        
-        for i in range(updates_per_frame):
-            phase_voltages = ctrl.get_phase_voltages(TIMESTEP)
-            io.update(TIMESTEP, phase_voltages)
-        
-            elapsed += TIMESTEP
-            
-            updates_since_sample += 1
-            if updates_since_sample >= sample_separation:
-                updates_since_sample = 0
-                # Add data to plots
-                angle_plot.add_data_point(elapsed, {"Angle": io.get_encoder_position()})
-                
-                velocity_plot.add_data_point(elapsed, {
-                    "Velocity": io.motor.kinematic.rotor_angular_velocity * 60 / (2 * math.pi)
-                })
-                
-                voltage_plot.add_data_point(elapsed, {
-                    "Phase U": io.last_phase_voltages[0],
-                    "Phase V": io.last_phase_voltages[1],
-                    "Phase W": io.last_phase_voltages[2]
-                })
-                
-                phase_currents = io.get_phase_currents()
-                phase_current_plot.add_data_point(elapsed, {
-                    "Phase U": phase_currents[0],
-                    "Phase V": phase_currents[1],
-                    "Phase W": phase_currents[2]
-                })
-                
-                if isinstance(ctrl, FOCController):
-                    dq_current_plot.add_data_point(elapsed, {
-                        "D-axis": ctrl.current_dq[0],
-                        "Q-axis": ctrl.current_dq[1]
-                    })
-                    
-                    dq_output_plot.add_data_point(elapsed, {
-                        "D-axis": ctrl.output_dq[0],
-                        "Q-axis": ctrl.output_dq[1]
-                    })
-                    
-                    dq_integral_plot.add_data_point(elapsed, {
-                        "D-axis": ctrl.dq_integral_terms[0],
-                        "Q-axis": ctrl.dq_integral_terms[1]
-                    })
-                
-                torque_plot.add_data_point(elapsed, {
-                    "Total torque": io.motor.kinematic.torque,
-                    "Electromagnetic torque": io.motor.kinematic.electromagnetic_torque,
-                    "bEMF U torque": io.motor.electrical.bemf_torques[0] * phase_currents[0],
-                    "bEMF V torque": io.motor.electrical.bemf_torques[1] * phase_currents[1],
-                    "bEMF W torque": io.motor.electrical.bemf_torques[2] * phase_currents[2]
-                })
+            p("Rotor Velocity", "Velocity (RPM)", default_visible=True)
+            p("Phase Voltages", "Voltage (V)", default_visible=True)
+            p("Phase Currents", "Current (A)", default_visible=False)
+            p("DQ Currents", "Current (A)", default_visible=False)
+            p("DQ Voltage Output", "Voltage (V)", default_visible=False)
+            p("DQ Integral Terms", "Integral (V)", default_visible=False)
+            p("Torque", "Torque (Nm)", default_visible=False)
+            p("Outer Loop", "Setpoint (A, rad/s, rad)", default_visible=False)
+
+    def update_gui():
+        snapshot = worker.take_snapshot()
+        if snapshot is None:
+            return
+        
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
+        if snapshot.message is not None:
+            dpg.set_value(state_text, snapshot.message)
+        if snapshot.restored_history is not None:
+            for label, plot in plots.items():
+                if label in snapshot.restored_history:
+                    plot.import_history(snapshot.restored_history[label])
+                else:
+                    plot.clear()
+
+        # Add data to plots
+        for group, plot in plots.items():
+            plot.add_data_points([(t, sample[group]) for (t, sample) in snapshot.samples if group in sample])
+        if profiling:
+            lap = PROFILER.lap("GUI: plot sampling", lap)
         
         # Update all plots
-        for plot in plots:
+        for plot in plots.values():
             plot.update_plot()
+        if profiling:
+            PROFILER.lap("GUI: plot update", lap)
+            dpg.set_value(profile_text, PROFILER.format_report())
         
-        update_rate = updates_per_frame / delta
-        velocity = io.motor.kinematic.rotor_angular_velocity
+        velocity = snapshot.velocity
         velocity_rpm = velocity * 60 / (2 * math.pi)
         
         dpg.set_value(info_text, f"Velocity: {velocity:.2f} rad/s\n\
 Velocity: {velocity_rpm:.2f} RPM\n\
-Angle: {io.motor.kinematic.rotor_angle:.4f}\n\
+Angle: {snapshot.angle:.4f}\n\
+Simulated time: {snapshot.elapsed:.3f} s\n\
 \n\
-Current update rate: {update_rate:.2f} Hz\n\
-Realtime ratio: {(update_rate / (1 / TIMESTEP)) * 100:.1f}%\n\
-Total output torque: {io.motor.kinematic.torque:.2f} Nm")
+Current update rate: {snapshot.update_rate:.2f} Hz\n\
+Realtime ratio: {(snapshot.update_rate / (1 / TIMESTEP)) * 100:.1f}%\n\
+{snapshot.cost_split}\n\
+Total output torque: {snapshot.torque:.2f} Nm")
     
     dpg.show_viewport()
+    worker.start()
 
-    last_time = time.time()
     while dpg.is_dearpygui_running():
-        delta = time.time() - last_time
-        last_time += delta
-        
-        if not paused:
-            update_gui(delta)
-        
+        update_gui()
         dpg.render_dearpygui_frame()
 
+    worker.stop()
     dpg.destroy_context()
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import math
+from dataclasses import dataclass, asdict
+
+import numpy as np
+
+from .headless import SimulationRecording
+
+@dataclass
+class RunMetrics:
+    """Summary metrics for one simulation run, computed from its recording."""
+
+    steady_state_velocity: float
+    """The mean rotor velocity over the steady-state window in RPM."""
+    settling_time: float
+    """
+    The time from the start of the run after which the velocity stays within the settling band of its
+    steady-state value in seconds, or NaN if it never does.
+    """
+    overshoot: float
+    """How far the velocity peaked past its steady-state value, as a fraction of the steady-state value."""
+    torque_ripple: float
+    """The peak-to-peak electromagnetic torque over the steady-state window, as a fraction of its mean magnitude."""
+    rms_current: float
+    """The per-phase RMS current over the steady-state window in amps."""
+
+    def as_dict(self) -> dict[str, float]:
+        return asdict(self)
+
+def compute_metrics(
+    recording: SimulationRecording,
+    steady_state_fraction: float = 0.1,
+    settling_band: float = 0.02
+) -> RunMetrics:
+    """
+    Compute summary metrics from a headless recording. The steady-state window is the final
+    `steady_state_fraction` of the run, and the velocity has settled once it stays within
+    `settling_band` (relative) of the steady-state velocity.
+    """
+    times = np.asarray(recording.times)
+    if len(times) == 0:
+        raise ValueError("Can't compute metrics for a recording without samples")
+    velocity = np.asarray(recording.get("Rotor Velocity", "Velocity"))
+    torque = np.asarray(recording.get("Torque", "Electromagnetic torque"))
+    currents = np.array([recording.get("Phase Currents", phase) for phase in ("Phase U", "Phase V", "Phase W")])
+
+    window_start = min(int(len(times) * (1 - steady_state_fraction)), len(times) - 1)
+    steady_state_velocity = float(velocity[window_start:].mean())
+
+    # Settled from the sample after the last one outside the band
+    band = max(abs(steady_state_velocity) * settling_band, 1e-9)
+    outside = np.flatnonzero(np.abs(velocity - steady_state_velocity) > band)
+    # Runs continued from a snapshot start partway through, so measure from the start of the run
+    if len(outside) == 0:
+        settling_time = float(times[0]) - recording.start_time
+    elif outside[-1] >= window_start:
+        settling_time = math.nan
+    else:
+        settling_time = float(times[outside[-1] + 1]) - recording.start_time
+
+    direction = math.copysign(1, steady_state_velocity)
+    peak = float(np.max(velocity * direction))
+    overshoot = max(0.0, (peak - abs(steady_state_velocity)) / abs(steady_state_velocity)) if steady_state_velocity != 0 else 0.0
+
+    steady_torque = torque[window_start:]
+    mean_torque = abs(float(steady_torque.mean()))
+    torque_ripple = float(np.ptp(steady_torque)) / mean_torque if mean_torque > 0 else math.inf
+
+    rms_current = float(np.sqrt(np.mean(currents[:, window_start:] ** 2)))
+
+    return RunMetrics(
+        steady_state_velocity=steady_state_velocity,
+        settling_time=settling_time,
+        overshoot=overshoot,
+        torque_ripple=torque_ripple,
+        rms_current=rms_current
+    )
@@ -1,35 +1,119 @@
 import math
-from typing import cast
+import time
+from typing import NamedTuple, cast
 
+from ..io_interface import IOInterface
+from ..profiler import PROFILER
 from ..util import clamp
 
-from .properties import MotorProperties, REV_NEO_PROPS
+from .properties import MotorProperties, PhaseBackEMFs, REV_NEO_PROPS
 from .electrical_state import MotorElectricalState
 from .kinematic_state import MotorKinematicState
+from .integrators import Integrator, EulerIntegrator
+from .inverter import Inverter
+from .loads import LoadModel, wrap_angle_delta
 
 # Primarily derived from [this great project](https://github.com/markisus/motor_sim), with some of my own tweaks
 
+MotorState = tuple[float, float, float, float, float]
+"""The integrable motor state: phase currents U, V and W in amps, rotor angular velocity in rad/s and rotor angle in radians."""
+
+class MotorDerivatives(NamedTuple):
+    derivative: MotorState
+    """The time derivative of each component of the MotorState."""
+    bemfs: PhaseBackEMFs
+    electromagnetic_torque: float
+    torque: float
+
 class MotorSimulation:
     properties: MotorProperties
     electrical: MotorElectricalState
     kinematic: MotorKinematicState
+    integrator: Integrator
+    load_inertia: float
+    """Inertia coupled to the rotor by the load in kg*m^2 (see LoadModel.reflected_inertia)."""
 
-    def __init__(self, properties: MotorProperties):
+    def __init__(self, properties: MotorProperties, integrator: Integrator | None = None, load_inertia: float = 0.0):
         self.properties = properties
         self.electrical = MotorElectricalState()
         self.kinematic = MotorKinematicState()
+        self.integrator = integrator or EulerIntegrator()
+        self.load_inertia = load_inertia
     
     def step(self, dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
-        # Clamp phase voltages because SVM would normally do this but we don't simulate it
+        # Clamp phase voltages for controllers that drive them directly instead of through an inverter (see inverter.py)
         # This technically should never fall outside the vbus range, though
-        vbus = 12
+        vbus = self.properties.vbus
         phase_voltages = cast(tuple[float, float, float], tuple(clamp(v, -vbus, vbus) for v in phase_voltages))
         
-        electrical_angle: float = self.properties.mechanical_to_electrical_angle(self.kinematic.rotor_angle)
-        electrical_angular_velocity = self.properties.pole_pairs * self.kinematic.rotor_angular_velocity
+        self.integrator.step(self, dt, load_torque, phase_voltages)
+    
+    def get_state(self) -> MotorState:
+        currents = self.electrical.phase_currents
+        return (currents[0], currents[1], currents[2], self.kinematic.rotor_angular_velocity, self.kinematic.rotor_angle)
+    
+    def set_state(self, state: MotorState):
+        self.electrical.phase_currents = (state[0], state[1], state[2])
+        self.kinematic.rotor_angular_velocity = state[3]
+        # Wrap angle to [0, 2pi)
+        self.kinematic.rotor_angle = state[4] % (2 * math.pi)
+    
+    def get_derivatives(
+        self,
+        state: MotorState,
+        phase_voltages: tuple[float, float, float],
+        load_torque: float
+    ) -> MotorDerivatives:
+        """
+        Evaluate the continuous-time motor model at an arbitrary state, for use by higher-order integrators.
+        This is the same model step_electrical and step_kinematic discretize with Euler.
+        """
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
+        (i_u, i_v, i_w, velocity, angle) = state
+        props = self.properties
         
-        self.step_electrical(dt, phase_voltages, electrical_angle, electrical_angular_velocity)
-        self.step_kinematic(dt, load_torque)
+        electrical_angle = props.mechanical_to_electrical_angle(angle)
+        bemfs = props.get_phase_backemfs(electrical_angle, props.pole_pairs * velocity)
+        (e_u, e_v, e_w) = bemfs.phase_bemf
+        if profiling:
+            lap = PROFILER.lap("Physics: bEMF evaluation", lap)
+        
+        neutral_voltage = (sum(phase_voltages) - (e_u + e_v + e_w)) / 3
+        r = props.phase_resistance
+        inv_l = 1 / props.phase_inductance
+        di_u = (phase_voltages[0] - neutral_voltage - e_u - i_u * r) * inv_l
+        di_v = (phase_voltages[1] - neutral_voltage - e_v - i_v * r) * inv_l
+        di_w = (phase_voltages[2] - neutral_voltage - e_w - i_w * r) * inv_l
+        
+        (k_u, k_v, k_w) = bemfs.bemf_torques
+        electromagnetic_torque = i_u * k_u + i_v * k_v + i_w * k_w
+        torque = (
+            electromagnetic_torque
+            + props.get_cogging_torque_at_rotor_angle(angle % (2 * math.pi))
+            + props.get_friction_torque(velocity)
+            + load_torque
+        )
+        if profiling:
+            PROFILER.lap("Physics: derivative evaluation", lap)
+        
+        return MotorDerivatives(
+            derivative=(di_u, di_v, di_w, torque / (props.rotor_inertia + self.load_inertia), velocity),
+            bemfs=bemfs,
+            electromagnetic_torque=electromagnetic_torque,
+            torque=torque
+        )
+    
+    def apply_derivatives(self, derivatives: MotorDerivatives):
+        """Store the intermediate quantities of a derivative evaluation in the electrical and kinematic state."""
+        self.electrical.bemf_torques = derivatives.bemfs.bemf_torques
+        self.electrical.bemf_voltages = derivatives.bemfs.phase_bemf
+        self.kinematic.electromagnetic_torque = derivatives.electromagnetic_torque
+        self.kinematic.torque = derivatives.torque
+        self.kinematic.rotor_angular_acceleration = derivatives.derivative[3]
 
     def step_electrical(
         self,
@@ -38,9 +122,16 @@ class MotorSimulation:
         electrical_angle: float,
         electrical_angular_velocity: float
     ):    
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
         bemfs = self.properties.get_phase_backemfs(electrical_angle, electrical_angular_velocity)
         self.electrical.bemf_torques = bemfs.bemf_torques
         self.electrical.bemf_voltages = bemfs.phase_bemf
+        if profiling:
+            lap = PROFILER.lap("Physics: bEMF evaluation", lap)
 
         # Calculate current derivative
         
@@ -62,12 +153,19 @@ class MotorSimulation:
             tuple[float, float, float],
             tuple(self.electrical.phase_currents[i] + di_dt[i] * dt for i in range(3))
         )
+        if profiling:
+            PROFILER.lap("Physics: electrical integration", lap)
     
     def step_kinematic(
         self,
         dt: float,
         load_torque: float
     ):  
+        profiling = PROFILER.enabled
+        lap = 0.0
+        if profiling:
+            lap = time.perf_counter()
+
         # Calculate applied torque
         cogging_torque: float = self.properties.get_cogging_torque_at_rotor_angle(self.kinematic.rotor_angle)
         friction_torque: float = self.properties.get_friction_torque(self.kinematic.rotor_angular_velocity)
@@ -79,12 +177,14 @@ class MotorSimulation:
         
         # The equivalent of F=m*a for rotational tynamics is tau = I*a.
         # Radians are unitless, so this matches 1/s^2
-        self.kinematic.rotor_angular_acceleration = self.kinematic.torque / self.properties.rotor_inertia
+        self.kinematic.rotor_angular_acceleration = self.kinematic.torque / (self.properties.rotor_inertia + self.load_inertia)
         # Simple Euler integration for velocity and position
         self.kinematic.rotor_angular_velocity += self.kinematic.rotor_angular_acceleration * dt
         self.kinematic.rotor_angle += self.kinematic.rotor_angular_velocity * dt
         # Wrap angle to [0, 2pi)
         self.kinematic.rotor_angle = self.kinematic.rotor_angle % (2 * math.pi)
+        if profiling:
+            PROFILER.lap("Physics: kinematic integration", lap)
         
     def get_encoder_position(self):
         return self.kinematic.rotor_angle
@@ -95,23 +195,78 @@ class MotorSimulation:
 
 
 # Simulates the IO for the actual motor controller using a mocked interface and simulated motor.
-class SimIOInterface:
+class SimIOInterface(IOInterface):
     motor: MotorSimulation
+    inverter: Inverter | None
+    """Turns duty cycles into phase voltages. Without one, controllers drive the phase voltages directly."""
+    load: LoadModel | None
+    """The mechanical load on the rotor, or None for no load."""
+    elapsed: float
+    """The simulated time since the last reset in seconds."""
+    position: float
+    """The multi-turn rotor position in radians since the last reset, which loads like springs need."""
     debug_led_state: tuple[bool, bool, bool] = (False, False, False)
     last_phase_voltages: tuple[float, float, float] = (0, 0, 0)
     
-    def __init__(self):
-        self.motor = MotorSimulation(REV_NEO_PROPS)
+    def __init__(
+        self,
+        properties: MotorProperties = REV_NEO_PROPS,
+        integrator: Integrator | None = None,
+        inverter: Inverter | None = None,
+        load: LoadModel | None = None
+    ):
+        self.motor = MotorSimulation(properties, integrator)
+        self.inverter = inverter
+        self.elapsed = 0.0
+        self.position = 0.0
+        self.set_load(load)
+    
+    @property
+    def properties(self) -> MotorProperties:
+        return self.motor.properties
+    
+    def set_load(self, load: LoadModel | None):
+        """Swap the load on the rotor, which takes effect on the next step."""
+        self.load = load
+        if load is not None:
+            load.reset()
+        self.motor.load_inertia = load.reflected_inertia if load is not None else 0.0
+    
+    def get_load_torque(self) -> float:
+        """The torque the load applies at the current state in Nm."""
+        if self.load is None:
+            return 0.0
+        return self.load.get_torque(self.elapsed, self.position, self.motor.kinematic.rotor_angular_velocity)
+    
+    def _advance(self, dt: float, last_angle: float):
+        self.elapsed += dt
+        self.position += wrap_angle_delta(self.motor.kinematic.rotor_angle - last_angle)
     
     def update(self, dt: float, phase_voltages: tuple[float, float, float]):
         """Update the motor simulation with the given phase inputs."""
-        load_torque = 0 # Nm
+        last_angle = self.motor.kinematic.rotor_angle
         self.last_phase_voltages = phase_voltages
-        self.motor.step(dt, load_torque, phase_voltages)
+        self.motor.step(dt, self.get_load_torque(), phase_voltages)
+        self._advance(dt, last_angle)
+    
+    def update_duty_cycles(self, dt: float, duty_cycles: tuple[float, float, float]):
+        """Update the motor simulation through the inverter for one switching period of length dt."""
+        if self.inverter is None:
+            raise ValueError("Driving duty cycles requires an inverter")
+        last_angle = self.motor.kinematic.rotor_angle
+        self.last_phase_voltages = self.inverter.step(self.motor, dt, self.get_load_torque(), duty_cycles)
+        self._advance(dt, last_angle)
     
     def reset(self):
         """Reset the motor simulation to its initial state."""
-        self.motor = MotorSimulation(REV_NEO_PROPS)
+        self.motor.integrator.reset()
+        if self.inverter is not None:
+            self.inverter.reset()
+        self.motor = MotorSimulation(self.motor.properties, self.motor.integrator, self.motor.load_inertia)
+        if self.load is not None:
+            self.load.reset()
+        self.elapsed = 0.0
+        self.position = 0.0
         self.debug_led_state = (False, False, False)
         self.last_phase_voltages = (0, 0, 0)
     
@@ -119,9 +274,5 @@ class SimIOInterface:
         """Get the current encoder position of the motor in radians."""
         return self.motor.get_encoder_position()
     
-    def set_debug_leds(self, led1: bool, led2: bool, led3: bool):
-        # In a real implementation, this would control hardware LEDs.
-        self.debug_led_state = (led1, led2, led3)
-    
     def get_phase_currents(self) -> tuple[float, float, float]:
         return self.motor.get_simulated_phase_currents()
\ No newline at end of file
@@ -0,0 +1,292 @@
+import math
+from dataclasses import dataclass
+from typing import Sequence
+
+import numpy as np
+
+from .loads import LoadModel, wrap_angle_delta
+from .properties import MotorProperties
+
+# A batched version of the motor simulation that steps N motors in lockstep.
+# Every per-motor quantity lives in a NumPy array with the motor index as the first axis,
+# so per-phase quantities have shape (N, 3) and everything else has shape (N,).
+
+PHASE_OFFSETS = np.array([0, 2 * math.pi / 3, 4 * math.pi / 3])
+"""The electrical angle each phase lags phase U by."""
+
+@dataclass
+class BatchedMotorProperties:
+    """The properties of N motors, with each field of `MotorProperties` stored as an array."""
+
+    pole_pairs: np.ndarray
+    rotor_inertia: np.ndarray
+    phase_inductance: np.ndarray
+    phase_resistance: np.ndarray
+    bemf_constant: np.ndarray
+    normed_bemf_coeffs: np.ndarray
+    """Shape (N, 5)"""
+    bemf_lut: np.ndarray
+    """Every motor's back EMF lookup table (see `MotorProperties.get_bemf_lut`) with shape (N, 2 * resolution + 1)"""
+    bemf_lut_resolution: int
+    cogging_harmonics: np.ndarray | None
+    """
+    Every motor's cogging harmonics as rows of order, amplitude and phase with shape (N, H, 3), padded with zero
+    amplitudes, when every motor's cogging model is closed form (see `CoggingModel`).
+    """
+    cogging_torque_map: np.ndarray | None
+    """Every motor's cogging map sampled at a common resolution with shape (N, M), when any motor's model is a map."""
+    viscous_friction: np.ndarray
+    coulomb_friction: np.ndarray
+    vbus: np.ndarray
+
+    @staticmethod
+    def from_properties(properties: Sequence[MotorProperties]) -> "BatchedMotorProperties":
+        def field(name: str) -> np.ndarray:
+            return np.array([getattr(p, name) for p in properties], dtype=float)
+
+        resolutions = {p.bemf_lut_resolution for p in properties}
+        if len(resolutions) != 1:
+            raise ValueError(f"All motors in a batch must share a bemf_lut_resolution, got {sorted(resolutions)}")
+
+        models = [p.cogging for p in properties]
+        (cogging_harmonics, cogging_torque_map) = (None, None)
+        if any(model.mode == "table" for model in models):
+            resolution = max(model.resolution for model in models)
+            cogging_torque_map = np.array([model.to_map(resolution) for model in models])
+        elif any(model.mode == "harmonic" for model in models):
+            cogging_harmonics = np.zeros((len(models), max(len(model.harmonics) for model in models), 3))
+            for i, model in enumerate(models):
+                if model.harmonics:
+                    cogging_harmonics[i, :len(model.harmonics)] = model.harmonics
+
+        return BatchedMotorProperties(
+            pole_pairs=field("pole_pairs"),
+            rotor_inertia=field("rotor_inertia"),
+            phase_inductance=field("phase_inductance"),
+            phase_resistance=field("phase_resistance"),
+            bemf_constant=field("bemf_constant"),
+            normed_bemf_coeffs=field("normed_bemf_coeffs"),
+            bemf_lut=np.array([p.get_bemf_lut() for p in properties]),
+            bemf_lut_resolution=resolutions.pop(),
+            cogging_harmonics=cogging_harmonics,
+            cogging_torque_map=cogging_torque_map,
+            viscous_friction=field("viscous_friction"),
+            coulomb_friction=field("coulomb_frinction"),
+            vbus=field("vbus")
+        )
+
+    def __len__(self) -> int:
+        return len(self.pole_pairs)
+
+    def get_cogging_torque_at_rotor_angle(self, theta: np.ndarray) -> np.ndarray:
+        """Get the cogging torque of each motor at its rotor angle in radians."""
+        if self.cogging_harmonics is not None:
+            (order, amplitude, phase) = np.moveaxis(self.cogging_harmonics, 2, 0)
+            return (amplitude * np.sin(order * theta[:, None] + phase)).sum(axis=1)
+        if self.cogging_torque_map is None:
+            return np.zeros_like(theta)
+        items = self.cogging_torque_map.shape[1]
+        normalized_angle = items * np.clip(theta / (2 * math.pi), 0, 1)
+        integral_part = normalized_angle.astype(int)
+        fractional_part = normalized_angle - integral_part
+        rows = np.arange(len(self))
+        t1 = self.cogging_torque_map[rows, integral_part % items]
+        t2 = self.cogging_torque_map[rows, (integral_part + 1) % items]
+        return t1 * (1 - fractional_part) + t2 * fractional_part
+
+    def mechanical_to_electrical_angle(self, mechanical_angle: np.ndarray) -> np.ndarray:
+        return (mechanical_angle * self.pole_pairs) % (2 * math.pi)
+
+    def get_phase_normalized_backemfs(self, electrical_angle: np.ndarray) -> np.ndarray:
+        """Returns the normalized back EMF of every phase with shape (N, 3), interpolated from the lookup tables."""
+        resolution = self.bemf_lut_resolution
+        position = (electrical_angle % (2 * math.pi)) * (resolution / (2 * math.pi))
+        index = np.minimum(position.astype(int), resolution - 1)
+        fraction = (position - index)[:, None]
+
+        # See MotorProperties.get_phase_normalized_backemfs for the phase index offsets
+        third = resolution // 3
+        indices = index[:, None] + np.array([0, 2 * third, third])
+        rows = np.arange(len(self))[:, None]
+        lower = self.bemf_lut[rows, indices]
+        upper = self.bemf_lut[rows, indices + 1]
+        return lower + (upper - lower) * fraction
+
+    def get_friction_torque(self, velocity: np.ndarray) -> np.ndarray:
+        return -(self.viscous_friction * velocity + np.copysign(self.coulomb_friction, velocity))
+
+@dataclass
+class BatchedElectricalState:
+    phase_currents: np.ndarray
+    """The motor phase currents in amps with shape (N, 3)"""
+
+    bemf_voltages: np.ndarray
+    """The motor phase back EMFs in volts with shape (N, 3)"""
+
+    bemf_torques: np.ndarray
+    """The torques from the back EMFs per phase in Nm/A with shape (N, 3)"""
+
+    @staticmethod
+    def zeros(n: int) -> "BatchedElectricalState":
+        return BatchedElectricalState(np.zeros((n, 3)), np.zeros((n, 3)), np.zeros((n, 3)))
+
+@dataclass
+class BatchedKinematicState:
+    rotor_angle: np.ndarray
+    """The rotor angles in radians."""
+
+    rotor_angular_velocity: np.ndarray
+    """The rotor angular velocities in rad/s."""
+
+    rotor_angular_acceleration: np.ndarray
+    """The rotor angular accelerations in rad/s^2"""
+
+    electromagnetic_torque: np.ndarray
+    """The contribution to the rotor torques from electromagnetism."""
+
+    torque: np.ndarray
+    """The torques applied to the rotors in Nm."""
+
+    @staticmethod
+    def zeros(n: int) -> "BatchedKinematicState":
+        return BatchedKinematicState(*(np.zeros(n) for _ in range(5)))
+
+class BatchedMotorSimulation:
+    """Simulates N motors in lockstep. Mirrors `MotorSimulation` step for step."""
+
+    properties: BatchedMotorProperties
+    electrical: BatchedElectricalState
+    kinematic: BatchedKinematicState
+    load_inertia: np.ndarray | float
+    """Inertia coupled to each rotor by its load in kg*m^2 (see LoadModel.reflected_inertia)."""
+
+    def __init__(self, properties: BatchedMotorProperties, load_inertia: np.ndarray | float = 0.0):
+        self.properties = properties
+        self.electrical = BatchedElectricalState.zeros(len(properties))
+        self.kinematic = BatchedKinematicState.zeros(len(properties))
+        self.load_inertia = load_inertia
+
+    def step(self, dt: float, load_torque: np.ndarray | float, phase_voltages: np.ndarray):
+        # Clamp phase voltages driven directly; the batched engine has no inverter path (see inverter.py)
+        vbus = self.properties.vbus[:, None]
+        phase_voltages = np.clip(phase_voltages, -vbus, vbus)
+
+        electrical_angle = self.properties.mechanical_to_electrical_angle(self.kinematic.rotor_angle)
+        electrical_angular_velocity = self.properties.pole_pairs * self.kinematic.rotor_angular_velocity
+
+        self.step_electrical(dt, phase_voltages, electrical_angle, electrical_angular_velocity)
+        self.step_kinematic(dt, load_torque)
+
+    def step_electrical(
+        self,
+        dt: float,
+        phase_voltages: np.ndarray,
+        electrical_angle: np.ndarray,
+        electrical_angular_velocity: np.ndarray
+    ):
+        props = self.properties
+        electrical = self.electrical
+
+        electrical.bemf_torques = props.get_phase_normalized_backemfs(electrical_angle) * props.bemf_constant[:, None]
+        electrical.bemf_voltages = electrical.bemf_torques * electrical_angular_velocity[:, None]
+
+        # See MotorSimulation.step_electrical; the neutral voltage is shared by all three phases
+        neutral_voltage = (phase_voltages.sum(axis=1) - electrical.bemf_voltages.sum(axis=1)) / 3
+        effective_voltage = (
+            phase_voltages - neutral_voltage[:, None]
+            - electrical.bemf_voltages
+            - electrical.phase_currents * props.phase_resistance[:, None]
+        )
+        di_dt = effective_voltage / props.phase_inductance[:, None]
+
+        # Simple Euler integration for current
+        electrical.phase_currents = electrical.phase_currents + di_dt * dt
+
+    def step_kinematic(self, dt: float, load_torque: np.ndarray | float):
+        props = self.properties
+        kinematic = self.kinematic
+
+        cogging_torque = props.get_cogging_torque_at_rotor_angle(kinematic.rotor_angle)
+        friction_torque = props.get_friction_torque(kinematic.rotor_angular_velocity)
+        electromagnetic_torque = (self.electrical.phase_currents * self.electrical.bemf_torques).sum(axis=1)
+        kinematic.electromagnetic_torque = electromagnetic_torque
+        kinematic.torque = electromagnetic_torque + cogging_torque + friction_torque + load_torque
+
+        kinematic.rotor_angular_acceleration = kinematic.torque / (props.rotor_inertia + self.load_inertia)
+        # Simple Euler integration for velocity and position
+        kinematic.rotor_angular_velocity = kinematic.rotor_angular_velocity + kinematic.rotor_angular_acceleration * dt
+        kinematic.rotor_angle = (kinematic.rotor_angle + kinematic.rotor_angular_velocity * dt) % (2 * math.pi)
+
+    def get_encoder_position(self) -> np.ndarray:
+        return self.kinematic.rotor_angle
+
+    def get_simulated_phase_currents(self) -> np.ndarray:
+        """Returns the simulated phase currents with shape (N, 3)."""
+        return self.electrical.phase_currents
+
+class BatchedSimIOInterface:
+    """The batched equivalent of `SimIOInterface`, driving N simulated motors at once."""
+
+    motor: BatchedMotorSimulation
+    load_torque: np.ndarray
+    """The constant load torque applied to each motor in Nm, on top of `load`."""
+    load: LoadModel | None
+    """A load evaluated on every motor at once, whose parameters can be per-motor arrays."""
+    elapsed: float
+    position: np.ndarray
+    """The multi-turn rotor positions in radians since the last reset."""
+    last_phase_voltages: np.ndarray
+
+    def __init__(
+        self,
+        properties: Sequence[MotorProperties],
+        load_torque: np.ndarray | float = 0,
+        load: LoadModel | None = None
+    ):
+        self.properties = BatchedMotorProperties.from_properties(properties)
+        self.motor = BatchedMotorSimulation(self.properties)
+        self.load_torque = np.broadcast_to(np.asarray(load_torque, dtype=float), (len(self.properties),)).copy()
+        self.elapsed = 0.0
+        self.position = np.zeros(len(self.properties))
+        self.last_phase_voltages = np.zeros((len(self.properties), 3))
+        self.set_load(load)
+
+    def __len__(self) -> int:
+        return len(self.properties)
+
+    def set_load(self, load: LoadModel | None):
+        self.load = load
+        if load is not None:
+            load.reset()
+        self.motor.load_inertia = load.reflected_inertia if load is not None else 0.0
+
+    def get_load_torque(self) -> np.ndarray:
+        """The torque on each motor from `load_torque` and `load` at the current state in Nm."""
+        if self.load is None:
+            return self.load_torque
+        return self.load_torque + self.load.get_torque(
+            self.elapsed, self.position, self.motor.kinematic.rotor_angular_velocity
+        )
+
+    def update(self, dt: float, phase_voltages: np.ndarray):
+        """Update every motor simulation with the given phase inputs of shape (N, 3)."""
+        last_angle = self.motor.kinematic.rotor_angle
+        self.last_phase_voltages = phase_voltages
+        self.motor.step(dt, self.get_load_torque(), phase_voltages)
+        self.elapsed += dt
+        self.position = self.position + wrap_angle_delta(self.motor.kinematic.rotor_angle - last_angle)
+
+    def reset(self):
+        """Reset every motor simulation to its initial state."""
+        self.motor = BatchedMotorSimulation(self.properties, self.motor.load_inertia)
+        if self.load is not None:
+            self.load.reset()
+        self.elapsed = 0.0
+        self.position = np.zeros(len(self.properties))
+        self.last_phase_voltages = np.zeros((len(self.properties), 3))
+
+    def get_encoder_position(self) -> np.ndarray:
+        return self.motor.get_encoder_position()
+
+    def get_phase_currents(self) -> np.ndarray:
+        return self.motor.get_simulated_phase_currents()
@@ -0,0 +1,202 @@
+import csv
+import math
+from array import array
+from typing import NamedTuple, Sequence
+
+import numpy as np
+
+# Cogging torque as a function of the mechanical rotor angle. A model is either a sum of harmonics, evaluated
+# in closed form, or a uniformly sampled map that's linearly interpolated. Maps are stored as a flat array of
+# doubles with the first entry repeated at the end, so interpolation never wraps an index, and NumPy reads the
+# same memory for batch evaluation.
+#
+# A few math.sin calls are cheaper than interpolating a table in Python, so models with up to
+# MAX_CLOSED_FORM_HARMONICS harmonics are evaluated in closed form, and `simplify` turns measured maps
+# into harmonics when a few of them reproduce the map closely enough.
+
+MAX_CLOSED_FORM_HARMONICS = 6
+
+class CoggingHarmonic(NamedTuple):
+    order: int
+    """Cycles per mechanical revolution."""
+    amplitude: float
+    """Nm"""
+    phase: float = 0.0
+    """Radians"""
+
+class CoggingModel:
+    harmonics: tuple[CoggingHarmonic, ...]
+    """The harmonics of a closed form model, empty for a map or no cogging."""
+    table: array | None
+    """The samples of a map in Nm, evenly spaced over a revolution, with the first one repeated at the end."""
+
+    def __init__(self, harmonics: Sequence[CoggingHarmonic] = (), table: Sequence[float] | None = None):
+        """With neither harmonics nor a table, there's no cogging."""
+        if harmonics and table is not None:
+            raise ValueError("A cogging model has either harmonics or a table, not both")
+        self.harmonics = tuple(CoggingHarmonic(*harmonic) for harmonic in harmonics if harmonic[1] != 0)
+        self.table = None
+        if table is not None:
+            if len(table) < 2:
+                raise ValueError("A cogging map needs at least 2 samples")
+            self.table = array("d", table)
+            self.table.append(self.table[0])
+
+    @property
+    def mode(self) -> str:
+        """How `get_torque` evaluates the model: "none", "harmonic" or "table"."""
+        if self.table is not None:
+            return "table"
+        return "harmonic" if self.harmonics else "none"
+
+    @property
+    def resolution(self) -> int:
+        """The number of map samples per revolution, or 0 for closed form models."""
+        return len(self.table) - 1 if self.table is not None else 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, CoggingModel) and self.harmonics == other.harmonics and self.table == other.table
+
+    def __repr__(self) -> str:
+        if self.table is not None:
+            return f"CoggingModel(table of {self.resolution})"
+        return f"CoggingModel({list(self.harmonics)})"
+
+    @staticmethod
+    def from_slots_poles(
+        slots: int,
+        poles: int,
+        amplitude: float,
+        harmonics: int = 1,
+        decay: float = 0.3,
+        phase: float = 0.0
+    ) -> "CoggingModel":
+        """
+        Cogging of a motor with `slots` stator slots and `poles` magnet poles (twice the pole pairs).
+        The fundamental has lcm(slots, poles) cycles per revolution and amplitude `amplitude` in Nm,
+        and each of its next `harmonics` - 1 multiples is `decay` times smaller than the one before.
+        """
+        fundamental = math.lcm(slots, poles)
+        return CoggingModel([
+            CoggingHarmonic(fundamental * k, amplitude * decay ** (k - 1), phase * k)
+            for k in range(1, harmonics + 1)
+        ])
+
+    @staticmethod
+    def from_csv(path: str, degrees: bool = True, repeats: int = 1, resolution: int = 3600, simplify: bool = True) -> "CoggingModel":
+        """
+        Import a measured map from a CSV file of mechanical angle and torque in Nm, skipping a header if there is one.
+        The measurement covers 1 / `repeats` of a revolution (e.g. a single cogging period) and is resampled onto
+        `resolution` evenly spaced angles. With `simplify`, it's turned into harmonics if that's as accurate.
+        """
+        angles: list[float] = []
+        torques: list[float] = []
+        with open(path, newline="") as file:
+            for row in csv.reader(file):
+                try:
+                    (angle, torque) = (float(row[0]), float(row[1]))
+                except (ValueError, IndexError):
+                    continue
+                angles.append(math.radians(angle) if degrees else angle)
+                torques.append(torque)
+        if len(angles) < 2:
+            raise ValueError(f"{path} needs at least 2 samples of angle and torque")
+
+        period = 2 * math.pi / repeats
+        order = np.argsort(angles)
+        measured_angles = np.asarray(angles)[order] % period
+        grid = np.arange(resolution) * (2 * math.pi / resolution) % period
+        table = np.interp(grid, measured_angles, np.asarray(torques)[order], period=period)
+        model = CoggingModel(table=table.tolist())
+        return model.simplify() if simplify else model
+
+    def simplify(self, max_harmonics: int = MAX_CLOSED_FORM_HARMONICS, tolerance: float = 0.01) -> "CoggingModel":
+        """
+        The closed form model of at most `max_harmonics` of the map's largest harmonics, if it reproduces the map
+        within `tolerance` of its peak torque, or this model otherwise.
+        """
+        if self.table is None:
+            return self
+        values = self.to_map(self.resolution)
+        peak = float(np.max(np.abs(values)))
+        if peak == 0:
+            return CoggingModel()
+
+        spectrum = np.fft.rfft(values) * (2 / len(values))
+        # The mean and Nyquist terms aren't sinusoids of the form the harmonics can represent
+        spectrum[0] = 0
+        if len(values) % 2 == 0:
+            spectrum[-1] = 0
+        largest = np.argsort(np.abs(spectrum))[::-1][:max_harmonics]
+        # Use as few of the largest harmonics as reproduce the map, since each one costs a sine per evaluation
+        for count in range(1, len(largest) + 1):
+            # a * sin(k * theta + phase) has the Fourier coefficient a * exp(i * (phase - pi / 2))
+            model = CoggingModel([
+                CoggingHarmonic(int(k), float(np.abs(spectrum[k])), float(np.angle(spectrum[k]) + math.pi / 2))
+                for k in sorted(largest[:count])
+            ])
+            if np.max(np.abs(model.to_map(len(values)) - values)) <= tolerance * peak:
+                return model
+        return self
+
+    def to_map(self, resolution: int) -> np.ndarray:
+        """The model sampled at `resolution` evenly spaced angles over a revolution."""
+        if self.table is not None and resolution == self.resolution:
+            return np.frombuffer(self.table, dtype=float)[:-1].copy()
+        return self.get_torques(np.arange(resolution) * (2 * math.pi / resolution))
+
+    def get_torque(self, theta: float) -> float:
+        """The cogging torque at mechanical rotor angle `theta` in [0, 2pi) in Nm."""
+        table = self.table
+        if table is not None:
+            resolution = len(table) - 1
+            position = theta * (resolution / (2 * math.pi))
+            index = int(position)
+            fraction = position - index
+            # Floating point wrapping can land exactly on 2pi
+            index %= resolution
+            lower = table[index]
+            return lower + (table[index + 1] - lower) * fraction
+        torque = 0.0
+        for (order, amplitude, phase) in self.harmonics:
+            torque += amplitude * math.sin(order * theta + phase)
+        return torque
+
+    def get_torques(self, theta: np.ndarray) -> np.ndarray:
+        """The cogging torque at every angle of an array of mechanical rotor angles in Nm."""
+        theta = np.asarray(theta, dtype=float)
+        if self.table is not None:
+            table = np.frombuffer(self.table, dtype=float)
+            resolution = len(table) - 1
+            position = (theta % (2 * math.pi)) * (resolution / (2 * math.pi))
+            index = np.minimum(position.astype(int), resolution - 1)
+            fraction = position - index
+            lower = table[index]
+            return lower + (table[index + 1] - lower) * fraction
+        torques = np.zeros_like(theta)
+        for (order, amplitude, phase) in self.harmonics:
+            torques += amplitude * np.sin(order * theta + phase)
+        return torques
+
+def parse_cogging(spec: str) -> CoggingModel:
+    """
+    Parse a cogging model from the command line. Accepts "slots:SLOTS,POLES,AMPLITUDE[,HARMONICS,DECAY]",
+    "harmonic:ORDER,AMPLITUDE[,PHASE]" with several joined by "+", or "csv:PATH[,REPEATS]" for a map in degrees.
+    """
+    (kind, _, arguments) = spec.partition(":")
+    if kind == "csv":
+        (path, _, repeats) = arguments.partition(",")
+        return CoggingModel.from_csv(path, repeats=int(repeats) if repeats else 1)
+    if kind == "harmonic":
+        harmonics = []
+        for part in spec.split("+"):
+            values = [float(value) for value in part.removeprefix("harmonic:").split(",")]
+            harmonics.append(CoggingHarmonic(int(values[0]), *values[1:]))
+        return CoggingModel(harmonics)
+    if kind == "slots":
+        values = [float(value) for value in arguments.split(",")]
+        if len(values) < 3:
+            raise ValueError("slots needs SLOTS,POLES,AMPLITUDE")
+        harmonics = int(values[3]) if len(values) > 3 else 1
+        return CoggingModel.from_slots_poles(int(values[0]), int(values[1]), values[2], harmonics, *values[4:5])
+    raise ValueError(f"Unknown cogging model {kind!r}, expected slots, harmonic or csv")
@@ -0,0 +1,185 @@
+import math
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from . import MotorSimulation, MotorState
+
+# Numerical integrators for the motor model. Every integrator advances a MotorSimulation by dt
+# while holding the phase voltages and load torque constant over the step (a zero-order hold).
+
+def _add_scaled(state: "MotorState", *terms: tuple[float, "MotorState"]) -> "MotorState":
+    """Returns state + sum(scale * derivative for scale, derivative in terms)."""
+    result = list(state)
+    for (scale, derivative) in terms:
+        for i in range(5):
+            result[i] += scale * derivative[i]
+    return (result[0], result[1], result[2], result[3], result[4])
+
+class Integrator(ABC):
+    @abstractmethod
+    def step(self, motor: "MotorSimulation", dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
+        pass
+
+    def reset(self):
+        """Clear any state carried between steps."""
+        pass
+
+class EulerIntegrator(Integrator):
+    """
+    Explicit Euler for the phase currents and semi-implicit Euler for the rotor.
+    This is the cheapest integrator, but needs a small timestep to stay accurate.
+    """
+
+    def step(self, motor: "MotorSimulation", dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
+        electrical_angle: float = motor.properties.mechanical_to_electrical_angle(motor.kinematic.rotor_angle)
+        electrical_angular_velocity = motor.properties.pole_pairs * motor.kinematic.rotor_angular_velocity
+
+        motor.step_electrical(dt, phase_voltages, electrical_angle, electrical_angular_velocity)
+        motor.step_kinematic(dt, load_torque)
+
+class ExponentialIntegrator(Integrator):
+    """
+    Integrates the phase currents exactly as a linear RL circuit driven by the phase-to-neutral voltage minus
+    the back EMF at the start of the step, then advances the rotor with semi-implicit Euler.
+    Unlike explicit Euler this never overshoots the steady-state current, no matter how large the timestep.
+    """
+
+    def step(self, motor: "MotorSimulation", dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
+        props = motor.properties
+        electrical = motor.electrical
+
+        electrical_angle: float = props.mechanical_to_electrical_angle(motor.kinematic.rotor_angle)
+        electrical_angular_velocity = props.pole_pairs * motor.kinematic.rotor_angular_velocity
+
+        bemfs = props.get_phase_backemfs(electrical_angle, electrical_angular_velocity)
+        electrical.bemf_torques = bemfs.bemf_torques
+        electrical.bemf_voltages = bemfs.phase_bemf
+
+        # i(t + dt) = i(t) * decay + (forcing voltage / R) * (1 - decay)
+        r = props.phase_resistance
+        decay = math.exp(-r * dt / props.phase_inductance)
+        # (1 - decay) / R, which tends to dt / L as R goes to zero
+        gain = -math.expm1(-r * dt / props.phase_inductance) / r if r > 0 else dt / props.phase_inductance
+
+        neutral_voltage = (sum(phase_voltages) - sum(bemfs.phase_bemf)) / 3
+        currents = electrical.phase_currents
+        electrical.phase_currents = (
+            currents[0] * decay + (phase_voltages[0] - neutral_voltage - bemfs.phase_bemf[0]) * gain,
+            currents[1] * decay + (phase_voltages[1] - neutral_voltage - bemfs.phase_bemf[1]) * gain,
+            currents[2] * decay + (phase_voltages[2] - neutral_voltage - bemfs.phase_bemf[2]) * gain
+        )
+
+        motor.step_kinematic(dt, load_torque)
+
+class RK4Integrator(Integrator):
+    """Classic fourth-order Runge-Kutta over the full coupled electrical and mechanical state."""
+
+    def step(self, motor: "MotorSimulation", dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
+        state = motor.get_state()
+
+        k1 = motor.get_derivatives(state, phase_voltages, load_torque)
+        k2 = motor.get_derivatives(_add_scaled(state, (dt / 2, k1.derivative)), phase_voltages, load_torque)
+        k3 = motor.get_derivatives(_add_scaled(state, (dt / 2, k2.derivative)), phase_voltages, load_torque)
+        k4 = motor.get_derivatives(_add_scaled(state, (dt, k3.derivative)), phase_voltages, load_torque)
+
+        motor.set_state(_add_scaled(
+            state,
+            (dt / 6, k1.derivative),
+            (dt / 3, k2.derivative),
+            (dt / 3, k3.derivative),
+            (dt / 6, k4.derivative)
+        ))
+        motor.apply_derivatives(k1)
+
+# Dormand-Prince 5(4) tableau. The model is autonomous over a step, so the stage times aren't needed.
+_DP_A = (
+    (),
+    (1/5,),
+    (3/40, 9/40),
+    (44/45, -56/15, 32/9),
+    (19372/6561, -25360/2187, 64448/6561, -212/729),
+    (9017/3168, -355/33, 46732/5247, 49/176, -5103/18656),
+    (35/384, 0, 500/1113, 125/192, -2187/6784, 11/84)
+)
+# Fifth-order solution weights are the last row of A; the error weights are the difference to the fourth-order solution
+_DP_E = (71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40)
+
+class RK45Integrator(Integrator):
+    """
+    Adaptive-step Dormand-Prince 5(4). Each call to `step` covers the full dt with as many internal substeps
+    as needed to keep the local error within tolerance, so it can take very large steps when the inputs are
+    held constant (e.g. open-loop runs) and automatically refines around fast transients.  
+    Coulomb friction is discontinuous at standstill, so a stalled rotor drives the step size down to `min_step`.
+    """
+
+    relative_tolerance: float
+    absolute_tolerance: float
+    min_step: float
+    substep: float | None
+    """The substep size carried over from the last call, or None to start from the full dt."""
+    substeps_taken: int
+    """The total number of accepted substeps, useful for judging the tolerance settings."""
+
+    def __init__(self, relative_tolerance: float = 1e-6, absolute_tolerance: float = 1e-6, min_step: float = 1e-7):
+        self.relative_tolerance = relative_tolerance
+        self.absolute_tolerance = absolute_tolerance
+        self.min_step = min_step
+        self.reset()
+
+    def reset(self):
+        self.substep = None
+        self.substeps_taken = 0
+
+    def step(self, motor: "MotorSimulation", dt: float, load_torque: float, phase_voltages: tuple[float, float, float]):
+        state = motor.get_state()
+        remaining = dt
+        h = self.substep or dt
+
+        # Stop once the remaining time is just floating point residue
+        end_tolerance = dt * 1e-12
+
+        k_first = motor.get_derivatives(state, phase_voltages, load_torque)
+        while remaining > end_tolerance:
+            step_h = min(h, remaining)
+
+            k = [k_first.derivative]
+            for stage in range(1, 7):
+                stage_state = _add_scaled(state, *((step_h * a, k[j]) for j, a in enumerate(_DP_A[stage])))
+                k_last = motor.get_derivatives(stage_state, phase_voltages, load_torque)
+                k.append(k_last.derivative)
+
+            # The last stage was evaluated at the fifth-order solution, so it's reused as the first stage of the next substep
+            new_state = _add_scaled(state, *((step_h * a, k[j]) for j, a in enumerate(_DP_A[6])))
+
+            # Scaled RMS error norm
+            error = 0.0
+            for i in range(5):
+                component_error = step_h * sum(e * k[j][i] for j, e in enumerate(_DP_E))
+                scale = self.absolute_tolerance + self.relative_tolerance * max(abs(state[i]), abs(new_state[i]))
+                error += (component_error / scale) ** 2
+            error = math.sqrt(error / 5)
+
+            accepted = error <= 1 or step_h <= self.min_step
+            if accepted:
+                state = new_state
+                remaining -= step_h
+                self.substeps_taken += 1
+                k_first = k_last
+
+            # Standard step size controller with a safety factor
+            factor = 0.9 * error ** -0.2 if error > 0 else 5
+            new_h = max(self.min_step, step_h * min(5, max(0.2, factor)))
+            # Don't let a step that was only shortened to land on dt shrink the carried step size
+            h = max(h, new_h) if accepted and step_h < h else new_h
+
+        self.substep = h
+        motor.set_state(state)
+        motor.apply_derivatives(k_first)
+
+INTEGRATOR_TYPES: dict[str, type[Integrator]] = {
+    "euler": EulerIntegrator,
+    "exponential": ExponentialIntegrator,
+    "rk4": RK4Integrator,
+    "rk45": RK45Integrator
+}
@@ -0,0 +1,131 @@
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, cast
+
+if TYPE_CHECKING:
+    from . import MotorSimulation
+
+# Inverter models turn per-phase PWM duty cycles into the voltages the motor sees.
+# Each call to `step` covers one center-aligned switching period of length dt, so the
+# switching frequency is 1 / dt (the physics step, see MultiRateScheduler.physics_dt).
+#
+# Phase currents are positive flowing out of the inverter into the motor. While both switches of a
+# half-bridge are off during dead time, the freewheeling diodes clamp the phase to the negative rail
+# for positive current and to vbus for negative current.
+#
+# Inverters are opt-in (SimIOInterface(inverter=None) drives phase voltages directly), even though the averaged
+# model closely tracks the direct path (see headless.compare_inverter_models): the batched engine has no
+# inverter path, so a default inverter would make scalar and batched runs of the same motor differ, and
+# snapshots, the remote IO link and the identification fits all exchange phase voltages.
+
+class Inverter(ABC):
+    dead_time: float
+    """The time both switches of a half-bridge are held off after every edge in seconds."""
+
+    @abstractmethod
+    def step(
+        self,
+        motor: "MotorSimulation",
+        dt: float,
+        load_torque: float,
+        duty_cycles: tuple[float, float, float]
+    ) -> tuple[float, float, float]:
+        """Advance the motor by one switching period, returning the average phase voltages over it."""
+        pass
+
+    def reset(self):
+        """Clear any state carried between steps."""
+        pass
+
+class AveragedInverter(Inverter):
+    """
+    Applies the average phase voltage over each switching period, duty cycle times vbus, in a single
+    motor step. Dead time is modeled as its average voltage error, which depends on the current direction.
+    This ignores the current ripple within a period, which is what SwitchingInverter resolves.
+    """
+
+    def __init__(self, dead_time: float = 0.0):
+        self.dead_time = dead_time
+
+    def step(
+        self,
+        motor: "MotorSimulation",
+        dt: float,
+        load_torque: float,
+        duty_cycles: tuple[float, float, float]
+    ) -> tuple[float, float, float]:
+        vbus = motor.properties.vbus
+        if self.dead_time > 0:
+            currents = motor.electrical.phase_currents
+            loss = self.dead_time / dt
+            # Phases that don't switch this period have no dead time
+            duty_cycles = cast(tuple[float, float, float], tuple(
+                duty_cycle - (loss if current > 0 else -loss) if 0 < duty_cycle < 1 else duty_cycle
+                for duty_cycle, current in zip(duty_cycles, currents)
+            ))
+        voltages = (
+            min(max(duty_cycles[0], 0.0), 1.0) * vbus,
+            min(max(duty_cycles[1], 0.0), 1.0) * vbus,
+            min(max(duty_cycles[2], 0.0), 1.0) * vbus
+        )
+        motor.step(dt, load_torque, voltages)
+        return voltages
+
+class SwitchingInverter(Inverter):
+    """
+    Steps the motor between every switching edge of a center-aligned PWM period, so the plant sees the
+    actual rail voltages and the current ripple they cause. Each phase is high from (1 - d) / 2 to (1 + d) / 2
+    of the period, shifted by dead time according to the direction of its current at the start of the period.
+    This takes up to seven motor steps per period, so it's meant for validating AveragedInverter.
+    """
+
+    def __init__(self, dead_time: float = 0.0):
+        self.dead_time = dead_time
+
+    def step(
+        self,
+        motor: "MotorSimulation",
+        dt: float,
+        load_torque: float,
+        duty_cycles: tuple[float, float, float]
+    ) -> tuple[float, float, float]:
+        vbus = motor.properties.vbus
+        currents = motor.electrical.phase_currents
+
+        # The [rise, fall) interval each phase is high for
+        high_intervals: list[tuple[float, float]] = []
+        for duty_cycle, current in zip(duty_cycles, currents):
+            if duty_cycle >= 1:
+                high_intervals.append((0.0, dt))
+            elif duty_cycle <= 0:
+                high_intervals.append((dt, dt))
+            else:
+                rise = (1 - duty_cycle) / 2 * dt
+                fall = (1 + duty_cycle) / 2 * dt
+                # Dead time delays the rise for positive current and the fall for negative current
+                if current > 0:
+                    rise = min(rise + self.dead_time, fall)
+                else:
+                    fall = min(fall + self.dead_time, dt)
+                high_intervals.append((rise, fall))
+
+        edges = sorted({0.0, dt, *(edge for interval in high_intervals for edge in interval)})
+        totals = [0.0, 0.0, 0.0]
+        for (start, end) in zip(edges, edges[1:]):
+            if end - start <= 0:
+                continue
+            middle = (start + end) / 2
+            voltages = (
+                vbus if high_intervals[0][0] <= middle < high_intervals[0][1] else 0.0,
+                vbus if high_intervals[1][0] <= middle < high_intervals[1][1] else 0.0,
+                vbus if high_intervals[2][0] <= middle < high_intervals[2][1] else 0.0
+            )
+            motor.step(end - start, load_torque, voltages)
+            for i in range(3):
+                totals[i] += voltages[i] * (end - start)
+
+        return (totals[0] / dt, totals[1] / dt, totals[2] / dt)
+
+INVERTER_TYPES: dict[str, type[Inverter]] = {
+    "averaged": AveragedInverter,
+    "switching": SwitchingInverter
+}
@@ -0,0 +1,223 @@
+import csv
+import math
+import os
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# Mechanical loads on the rotor, evaluated by the IO interface before every physics step.
+# Loads see the time since the simulation started, the multi-turn rotor position in radians and the rotor velocity
+# in rad/s, and return the torque they apply in Nm (negative to oppose positive motion). Their formulas only use
+# arithmetic and abs, so the position and velocity can be NumPy arrays with one entry per motor, and the
+# parameters can be arrays too.
+
+Value = float | np.ndarray
+
+class LoadModel(ABC):
+    reflected_inertia: Value = 0.0
+    """Inertia the load adds to the rotor in kg*m^2, as seen from the motor shaft."""
+
+    @abstractmethod
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        pass
+
+    def reset(self):
+        """Clear any state carried between steps."""
+        pass
+
+class ConstantLoad(LoadModel):
+    """A constant torque, like a weight hanging from a spool."""
+
+    torque: Value
+
+    def __init__(self, torque: Value):
+        self.torque = torque
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        return self.torque
+
+class GearboxLoad(LoadModel):
+    """
+    An inertia and a constant output torque behind a gearbox with ratio `gear_ratio` (output turns slower).
+    Both are reflected to the motor shaft: the inertia by 1 / ratio^2 and the torque by 1 / (ratio * efficiency).
+    """
+
+    load_inertia: Value
+    gear_ratio: Value
+    output_torque: Value
+    efficiency: Value
+
+    def __init__(self, load_inertia: Value, gear_ratio: Value, output_torque: Value = 0.0, efficiency: Value = 1.0):
+        self.load_inertia = load_inertia
+        self.gear_ratio = gear_ratio
+        self.output_torque = output_torque
+        self.efficiency = efficiency
+        self.reflected_inertia = load_inertia / (gear_ratio * gear_ratio)
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        return self.output_torque / (self.gear_ratio * self.efficiency)
+
+class FanLoad(LoadModel):
+    """Aerodynamic drag that grows with the square of the velocity, like a fan or propeller."""
+
+    coefficient: Value
+    """Nm/(rad/s)^2"""
+
+    def __init__(self, coefficient: Value):
+        self.coefficient = coefficient
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        return -self.coefficient * velocity * abs(velocity)
+
+class SpringLoad(LoadModel):
+    """A torsion spring pulling the rotor back to `rest_position`, with optional viscous damping."""
+
+    stiffness: Value
+    """Nm/rad"""
+    rest_position: Value
+    damping: Value
+    """Nm/(rad/s)"""
+
+    def __init__(self, stiffness: Value, rest_position: Value = 0.0, damping: Value = 0.0):
+        self.stiffness = stiffness
+        self.rest_position = rest_position
+        self.damping = damping
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        return -self.stiffness * (position - self.rest_position) - self.damping * velocity
+
+class TraceLoad(LoadModel):
+    """
+    Replays a recorded torque trace over time, linearly interpolated and held at its last value after it ends.
+    The trace is never loaded into memory: a telemetry recording directory (see telemetry.py) is memory-mapped and
+    indexed directly, and a CSV file of time and torque columns is streamed forward two rows at a time.
+    Playing a CSV trace backwards, which only happens after a reset, reopens the file.
+    """
+
+    path: str
+    channel: str | None
+    """The channel of a telemetry recording to replay."""
+
+    def __init__(self, path: str, channel: str | None = None):
+        self.path = path
+        self.channel = channel
+        self._file = None
+        if os.path.isdir(path):
+            # Imported here since telemetry depends on the controllers, which depend on this package
+            from ..telemetry import TelemetryReader
+            reader = TelemetryReader(path)
+            if channel is None:
+                raise ValueError("Replaying a telemetry recording requires a channel name")
+            self._samples = reader.get(channel)
+            self._start_time = reader.start_time
+            self._sample_interval = reader.sample_interval
+            if len(self._samples) == 0:
+                raise ValueError(f"{path} has no samples")
+        else:
+            self._samples = None
+            self.reset()
+
+    def __getstate__(self) -> dict:
+        # Open files and memory maps can't be copied or pickled, so copies reopen the trace from the start
+        return {"path": self.path, "channel": self.channel}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state["path"], state["channel"])
+
+    def reset(self):
+        if self._samples is not None:
+            return
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.path, newline="")
+        self._rows = csv.reader(self._file)
+        self._previous = self._read_row()
+        if self._previous is None:
+            raise ValueError(f"{self.path} has no torque samples")
+        self._next = self._read_row()
+
+    def _read_row(self) -> tuple[float, float] | None:
+        for row in self._rows:
+            try:
+                return (float(row[0]), float(row[1]))
+            except (ValueError, IndexError):
+                # Skip headers and blank lines
+                continue
+        return None
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        if self._samples is not None:
+            samples = self._samples
+            index = (t - self._start_time) / self._sample_interval
+            if index <= 0:
+                return float(samples[0])
+            lower = int(index)
+            if lower + 1 >= len(samples):
+                return float(samples[-1])
+            fraction = index - lower
+            return float(samples[lower] + (samples[lower + 1] - samples[lower]) * fraction)
+
+        if t < self._previous[0]:
+            self.reset()
+        while self._next is not None and self._next[0] <= t:
+            self._previous = self._next
+            self._next = self._read_row()
+        (t0, v0) = self._previous
+        if self._next is None or t <= t0:
+            return v0
+        (t1, v1) = self._next
+        return v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+
+class CombinedLoad(LoadModel):
+    """The sum of several loads, e.g. a gearbox driving a fan."""
+
+    loads: list[LoadModel]
+
+    def __init__(self, loads: list[LoadModel]):
+        self.loads = loads
+        self.reflected_inertia = sum((load.reflected_inertia for load in loads), 0.0)
+
+    def get_torque(self, t: float, position: Value, velocity: Value) -> Value:
+        return sum((load.get_torque(t, position, velocity) for load in self.loads), 0.0)
+
+    def reset(self):
+        for load in self.loads:
+            load.reset()
+
+# The form of every load spec with its required and total number of values
+LOAD_FORMS: dict[str, tuple[str, int, int]] = {
+    "constant": ("constant:TORQUE", 1, 1),
+    "gearbox": ("gearbox:INERTIA,RATIO[,OUTPUT_TORQUE,EFFICIENCY]", 2, 4),
+    "fan": ("fan:COEFFICIENT", 1, 1),
+    "spring": ("spring:STIFFNESS[,REST_POSITION,DAMPING]", 1, 3)
+}
+
+def parse_load(spec: str) -> LoadModel:
+    """
+    Parse a load from the command line. Accepts "constant:TORQUE", "gearbox:INERTIA,RATIO[,OUTPUT_TORQUE,EFFICIENCY]",
+    "fan:COEFFICIENT", "spring:STIFFNESS[,REST_POSITION,DAMPING]" or "trace:PATH[,CHANNEL]", and sums several joined by "+".
+    """
+    if "+" in spec:
+        return CombinedLoad([parse_load(part) for part in spec.split("+")])
+    (kind, _, arguments) = spec.partition(":")
+    if kind == "trace":
+        (path, _, channel) = arguments.partition(",")
+        return TraceLoad(path, channel or None)
+    if kind not in LOAD_FORMS:
+        raise ValueError(f"Unknown load {kind!r}, expected {', '.join(LOAD_FORMS)} or trace")
+    (form, required, total) = LOAD_FORMS[kind]
+    values = [float(value) for value in arguments.split(",")] if arguments else []
+    if not required <= len(values) <= total:
+        raise ValueError(f"{kind} load needs {form.partition(':')[2]}, got {arguments!r}")
+    match kind:
+        case "constant":
+            return ConstantLoad(*values)
+        case "gearbox":
+            return GearboxLoad(*values)
+        case "fan":
+            return FanLoad(*values)
+    return SpringLoad(*values)
+
+def wrap_angle_delta(delta: Value) -> Value:
+    """Wrap a rotor angle change to [-pi, pi), for tracking the multi-turn position of a wrapped angle."""
+    return (delta + math.pi) % (2 * math.pi) - math.pi
@@ -1,12 +1,53 @@
 
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, fields, replace
 import math
-from typing import NamedTuple, cast
+from typing import NamedTuple
 
 from ..util import clamp
+from .cogging import CoggingModel
 
 BackEMFCoeffs = tuple[float, float, float, float, float]
 
+def get_odd_sine_series(electrical_angle: float, coeffs: BackEMFCoeffs) -> float:
+    """
+    Evaluate the odd sine series sum(coeffs[i] * sin((2i + 1) * angle)) analytically.
+    """
+    sine_series: list[float] = [0, 0, 0, 0, 0]
+    terms = 5
+    
+    # This is a cheaper way to compute the odd sine series at multiples of the given angle
+    # https://trans4mind.com/personal_development/mathematics/trigonometry/multipleAnglesRecursiveFormula.htm#Recursive_Formula
+    sin_angle: float = math.sin(electrical_angle)
+    cos_angle: float = math.cos(electrical_angle)
+
+    sa = 0
+    sb = sin_angle
+
+    for i in range(terms - 1):
+        sine_series[i] = sb
+        
+        sa = 2 * cos_angle * sb - sa
+        (sb, sa) = (sa, sb)
+        # Advance twice to get odd multiples
+        sa = 2 * cos_angle * sb - sa
+        (sb, sa) = (sa, sb)
+    
+    sine_series[terms - 1] = sb
+    
+    # Compute the dot product between the sine series and backemf coefficients
+    return sum(sine_series[i] * coeffs[i] for i in range(len(coeffs)))
+
+def make_bemf_lut(coeffs: BackEMFCoeffs, resolution: int) -> list[float]:
+    """
+    Tabulate the normalized back EMF waveform at `resolution` evenly spaced electrical angles.
+    The table covers two full electrical cycles plus one entry so the three phases, which are
+    a third of a cycle apart, can all be interpolated without wrapping indices.
+    """
+    return [
+        get_odd_sine_series(2 * math.pi * (i % resolution) / resolution, coeffs)
+        for i in range(2 * resolution + 1)
+    ]
+
 class PhaseBackEMFs(NamedTuple):
     bemf_torques: tuple[float, float, float]
     """The torques from the back EMFs per phase in Nm/A"""
@@ -41,13 +82,21 @@ class MotorProperties:
     bEMF waveform. I've instead adapted it to be unitless and have a separate K_e constant.
     """
     
-    cogging_torque_map: list[float] = field(default_factory=lambda: [0] * 3600)
+    bemf_lut_resolution: int = 3072
+    """
+    The number of entries per electrical cycle in the back EMF lookup table, which is
+    linearly interpolated instead of evaluating the sine series every step.
+    This must be a multiple of 3 so every phase lands on the same fractional table position.
+    """
+    
+    cogging: CoggingModel = field(default_factory=CoggingModel)
     """
     Cogging torque of the motor across its rotational range. Cogging torque is a
     (typically undesireable) torque from the interaction of the stator's permanent magnets
     with the rotor.  
     Cogging torque is typically only 1-5% of the motor's stall torque, so it's not
-    extremely significant.
+    extremely significant. None by default; see cogging.py for generating one from the
+    slot and pole counts or importing a measured map.
     """
     
     viscous_friction: float = 0.0001
@@ -69,61 +118,85 @@ class MotorProperties:
     we just assume the bus voltage is constant and equal to this value.
     """
     
+    _bemf_lut: list[float] | None = field(default=None, init=False, repr=False, compare=False)
+    """Lazily built by `get_bemf_lut`; cleared whenever the coefficients or resolution change."""
+    
+    def __setattr__(self, name: str, value):
+        super().__setattr__(name, value)
+        if name == "normed_bemf_coeffs" or name == "bemf_lut_resolution":
+            super().__setattr__("_bemf_lut", None)
+    
+    def get_bemf_lut(self) -> list[float]:
+        """Get the back EMF lookup table, building it if the coefficients changed since it was last used."""
+        if self._bemf_lut is None:
+            if self.bemf_lut_resolution <= 0 or self.bemf_lut_resolution % 3 != 0:
+                raise ValueError(f"bemf_lut_resolution must be a positive multiple of 3, got {self.bemf_lut_resolution}")
+            self._bemf_lut = make_bemf_lut(self.normed_bemf_coeffs, self.bemf_lut_resolution)
+        return self._bemf_lut
+    
+    def get_bemf_lut_error(self, samples: int = 100000) -> float:
+        """
+        Get the maximum absolute error of the back EMF lookup table against the analytic sine series,
+        sampled at `samples` evenly spaced electrical angles.
+        """
+        error = 0.0
+        for i in range(samples):
+            angle = 2 * math.pi * i / samples
+            expected = (
+                self.get_normalized_backemf(angle),
+                self.get_normalized_backemf(angle - 2 * math.pi / 3),
+                self.get_normalized_backemf(angle - 4 * math.pi / 3)
+            )
+            actual = self.get_phase_normalized_backemfs(angle)
+            error = max(error, *(abs(a - e) for a, e in zip(actual, expected)))
+        return error
+    
     def get_cogging_torque_at_rotor_angle(self, theta: float) -> float:
         """Get the cogging torque at a specific rotor angle in radians."""
-        items = len(self.cogging_torque_map)
-        normalized_angle = items * clamp(theta / (2 * math.pi), 0, 1)
-        integral_part = int(normalized_angle)
-        fractional_part = normalized_angle - integral_part
-        t1 = self.cogging_torque_map[integral_part]
-        t2 = self.cogging_torque_map[(integral_part + 1) % items]
-        return t1 * (1 - fractional_part) + t2 * fractional_part
+        return self.cogging.get_torque(clamp(theta, 0, 2 * math.pi))
 
     def mechanical_to_electrical_angle(self, mechanical_angle: float) -> float:
         return (mechanical_angle * self.pole_pairs) % (2 * math.pi)
     
     def get_normalized_backemf(self, electrical_angle: float) -> float:
-        sine_series: list[float] = [0, 0, 0, 0, 0]
-        terms = 5
+        """Evaluate the normalized back EMF at the given electrical angle from the analytic sine series."""
+        return get_odd_sine_series(electrical_angle, self.normed_bemf_coeffs)
+    
+    def get_phase_normalized_backemfs(self, electrical_angle: float) -> tuple[float, float, float]:
+        """Get the normalized back EMF of all three phases from the interpolated lookup table."""
+        lut = self._bemf_lut
+        if lut is None:
+            lut = self.get_bemf_lut()
+        resolution = self.bemf_lut_resolution
         
-        # This is a cheaper way to compute the odd sine series at multiples of the given angle
-        # https://trans4mind.com/personal_development/mathematics/trigonometry/multipleAnglesRecursiveFormula.htm#Recursive_Formula
-        sin_angle: float = math.sin(electrical_angle)
-        cos_angle: float = math.cos(electrical_angle)
-
-        sa = 0
-        sb = sin_angle
-
-        for i in range(terms - 1):
-            sine_series[i] = sb
-            
-            sa = 2 * cos_angle * sb - sa
-            (sb, sa) = (sa, sb)
-            # Advance twice to get odd multiples
-            sa = 2 * cos_angle * sb - sa
-            (sb, sa) = (sa, sb)
+        position = (electrical_angle % (2 * math.pi)) * (resolution / (2 * math.pi))
+        index = int(position)
+        fraction = position - index
+        if index >= resolution:
+            # Floating point rounding can land exactly on the end of the cycle
+            index -= resolution
         
-        sine_series[terms - 1] = sb
+        # Phases V and W lag by a third and two thirds of a cycle, which is the same as leading
+        # by two thirds and one third respectively
+        third = resolution // 3
+        v_index = index + 2 * third
+        w_index = index + third
         
-        # Compute the dot product between the sine series and backemf coefficients
-        return sum(sine_series[i] * self.normed_bemf_coeffs[i] for i in range(len(self.normed_bemf_coeffs)))
-    
-    def get_phase_normalized_backemfs(self, electrical_angle: float) -> tuple[float, float, float]:
         return (
-            self.get_normalized_backemf(electrical_angle),
-            self.get_normalized_backemf(electrical_angle - 2 * math.pi / 3),
-            self.get_normalized_backemf(electrical_angle - 4 * math.pi / 3)
+            lut[index] + (lut[index + 1] - lut[index]) * fraction,
+            lut[v_index] + (lut[v_index + 1] - lut[v_index]) * fraction,
+            lut[w_index] + (lut[w_index + 1] - lut[w_index]) * fraction
         )
     
     def get_phase_backemfs(self, electrical_angle: float, electrical_angular_vel: float) -> PhaseBackEMFs:
-        normalized_bemfs = self.get_phase_normalized_backemfs(electrical_angle)
+        (u, v, w) = self.get_phase_normalized_backemfs(electrical_angle)
         
-        bemf_torques = cast(tuple[float, float, float],
-            tuple(bemf * self.bemf_constant for bemf in normalized_bemfs)
-        )
-        
-        phase_bemfs = cast(tuple[float, float, float],
-            tuple(bemf  * electrical_angular_vel for bemf in bemf_torques)
+        ke = self.bemf_constant
+        bemf_torques = (u * ke, v * ke, w * ke)
+        phase_bemfs = (
+            bemf_torques[0] * electrical_angular_vel,
+            bemf_torques[1] * electrical_angular_vel,
+            bemf_torques[2] * electrical_angular_vel
         )
     
         return PhaseBackEMFs(
@@ -134,6 +207,11 @@ class MotorProperties:
     def get_friction_torque(self, velocity: float) -> float:
         return -(self.viscous_friction * velocity + math.copysign(self.coulomb_frinction, velocity))
 
+def replace_properties(base: MotorProperties, overrides: dict[str, float]) -> MotorProperties:
+    """`base` with numeric field overrides, e.g. from the command line, rounding those declared as integers like `pole_pairs`."""
+    integer_fields = {entry.name for entry in fields(MotorProperties) if entry.type is int}
+    return replace(base, **{name: round(value) if name in integer_fields else value for name, value in overrides.items()})
+
 REV_NEO_PROPS = MotorProperties(
     pole_pairs=7,
     
@@ -1,72 +1,130 @@
+import math
+
 import dearpygui.dearpygui as dpg
+import numpy as np
+
+from .decimation import minmax_decimate
+from .ring_buffer import RingBuffer
+from .snapshot import PlotHistory
 
 class TimeSeriesPlot:
     """Manages a time series plot with fixed buffer size."""
-    
+
     history_length: float
+    sample_interval: float
     show_latest: bool
-    times: list[float]
-    series_data: dict[str, list[float]]
+    width: int
+    """The plot width in pixels, which bounds the number of points drawn per series."""
+    buffer: RingBuffer
+    """Channel 0 holds the sample times, and every series has its own channel after that."""
+    series_channels: dict[str, int]
     series_handles: dict[str, str | int]
     plot: int | str
     x_axis: int | str
     y_axis: int | str
-    
-    def __init__(self, label, y_label, history_length=0.5, show_latest=True, height=400, width=1000, default_visible=True):
+
+    def __init__(self, label, y_label, history_length=0.5, sample_interval=0.0002, show_latest=True, height=400, width=1000, default_visible=True):
         self.history_length = history_length
+        self.sample_interval = sample_interval
         self.show_latest = show_latest
-        self.times = []
-        self.series_data = {}
+        self.width = width
+        self.buffer = RingBuffer(1, self.get_capacity())
+        self.series_channels = {}
         self.series_handles = {}
-        
+
         with dpg.collapsing_header(label=label, default_open=default_visible):
             self.plot = dpg.add_plot(label=label, height=height, width=width)
-            
-            dpg.add_plot_legend(parent=self.plot)    
-            
+
+            dpg.add_plot_legend(parent=self.plot)
+
             self.x_axis = dpg.add_plot_axis(dpg.mvXAxis, label="Time (s)", parent=self.plot)
             self.y_axis = dpg.add_plot_axis(dpg.mvYAxis, label=y_label, parent=self.plot)
-            
+
             if self.show_latest:
                 dpg.set_axis_limits(self.x_axis, 0, history_length)
-    
+
+    def get_capacity(self) -> int:
+        """The number of samples needed to cover the history length at the current sample interval."""
+        return math.ceil(self.history_length / self.sample_interval) + 1
+
+    def set_history(self, history_length: float, sample_interval: float):
+        """Change the history length or sample interval, keeping as much existing history as fits."""
+        self.history_length = history_length
+        self.sample_interval = sample_interval
+        self.buffer.resize(self.get_capacity())
+
     def set_y_range(self, min: float, max: float):
         dpg.set_axis_limits(self.y_axis, min, max)
-    
+
     def add_series(self, name, color=None):
         """Add a new data series to the plot."""
-        self.series_data[name] = []
-        
+        self.series_channels[name] = self.buffer.add_channel()
+
         series_id = dpg.add_line_series([], [], label=name, parent=self.y_axis)
         self.series_handles[name] = series_id
         return series_id
-    
+
     def add_data_point(self, time_point, data_dict):
         """Add a data point to the plot, where data_dict maps series names to values."""
-        
-        # Add time point if needed
-        if not self.times or self.times[-1] != time_point:
-            self.times.append(time_point)
-        
-        # Add data points for each series
+        for name in data_dict:
+            if name not in self.series_channels:
+                self.add_series(name)
+
+        # Series missing from this sample are recorded as NaN so every channel stays aligned with the times
+        sample = [time_point] + [math.nan] * len(self.series_channels)
         for name, value in data_dict.items():
-            if name not in self.series_data:
+            sample[self.series_channels[name]] = value
+        self.buffer.append(sample)
+
+    def add_data_points(self, samples: list[tuple[float, dict[str, float]]]):
+        """Add several (time, data_dict) samples at once; see `add_data_point`."""
+        if not samples:
+            return
+        for (_, data_dict) in samples:
+            for name in data_dict:
+                if name not in self.series_channels:
+                    self.add_series(name)
+
+        block = np.full((self.buffer.channels, len(samples)), np.nan)
+        for i, (time_point, data_dict) in enumerate(samples):
+            block[0, i] = time_point
+            for name, value in data_dict.items():
+                block[self.series_channels[name], i] = value
+        self.buffer.extend(block)
+
+    def clear(self):
+        self.buffer.clear()
+
+    def export_history(self) -> PlotHistory:
+        """A copy of the samples the plot holds, for saving with a simulation state."""
+        return PlotHistory(
+            self.buffer.view(0).copy(),
+            {name: self.buffer.view(channel).copy() for name, channel in self.series_channels.items()}
+        )
+
+    def import_history(self, history: PlotHistory):
+        """Replace the plot's samples with a saved history, keeping the most recent ones that fit."""
+        self.clear()
+        for name in history.series:
+            if name not in self.series_channels:
                 self.add_series(name)
-            self.series_data[name].append(value)
-        
-        # Keep the series length within the history length
-        while len(self.times) > 0 and (self.times[-1] - self.times[0]) > self.history_length:
-            self.times.pop(0)
-            for series in self.series_data.values():
-                series.pop(0)
-    
+        block = np.full((self.buffer.channels, len(history.times)), np.nan)
+        block[0] = history.times
+        for name, values in history.series.items():
+            block[self.series_channels[name]] = values
+        self.buffer.extend(block)
+
     def update_plot(self):
         """Update all series in the plot with current data."""
-        if not self.times:
+        if len(self.buffer) == 0:
             return
-            
+
+        times = self.buffer.view(0)
         for name, series_id in self.series_handles.items():
-            dpg.set_value(series_id, [self.times, self.series_data[name]])
-            
+            # One min/max pair per horizontal pixel keeps peaks visible at any history length
+            series_times, values = minmax_decimate(times, self.buffer.view(self.series_channels[name]), self.width)
+            dpg.set_value(series_id, [series_times, values])
+
         if self.show_latest:
-            dpg.set_axis_limits(self.x_axis, self.times[0], self.times[0] + self.history_length)
\ No newline at end of file
+            start = self.buffer.oldest(0)
+            dpg.set_axis_limits(self.x_axis, start, start + self.history_length)
@@ -0,0 +1,71 @@
+import time
+from typing import NamedTuple
+
+# Opt-in timing of the individual stages of a control and simulation step.
+# Instrumented code checks `PROFILER.enabled` once and only reads the clock when it's set,
+# so leaving the hooks in costs one attribute lookup per call while profiling is off:
+#
+#     profiling = PROFILER.enabled
+#     lap = 0.0
+#     if profiling:
+#         lap = time.perf_counter()
+#     ...stage one...
+#     if profiling:
+#         lap = PROFILER.lap("Stage one", lap)
+#     ...stage two...
+#     if profiling:
+#         PROFILER.lap("Stage two", lap)
+#
+# Stages are timed back to back, so they must not nest for the breakdown to add up.
+
+class StageStats(NamedTuple):
+    total_time: float
+    """Wall-clock time spent in the stage in seconds."""
+    calls: int
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.calls if self.calls > 0 else 0
+
+class StageProfiler:
+    enabled: bool
+    totals: dict[str, float]
+    calls: dict[str, int]
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.totals = {}
+        self.calls = {}
+
+    def lap(self, stage: str, start: float) -> float:
+        """Charge the time since `start` to `stage` and return the current time, to start the next lap from."""
+        now = time.perf_counter()
+        self.totals[stage] = self.totals.get(stage, 0.0) + (now - start)
+        self.calls[stage] = self.calls.get(stage, 0) + 1
+        return now
+
+    def reset(self):
+        self.totals = {}
+        self.calls = {}
+
+    def get_stats(self) -> dict[str, StageStats]:
+        # Copy first since another thread may be adding stages
+        totals = dict(self.totals)
+        calls = dict(self.calls)
+        return {stage: StageStats(total, calls.get(stage, 0)) for stage, total in totals.items()}
+
+    def format_report(self) -> str:
+        """A table of the mean time per call of every stage and its share of the total profiled time."""
+        stats = self.get_stats()
+        if not stats:
+            return "No stages profiled"
+        total = sum(stage.total_time for stage in stats.values())
+        width = max(len(name) for name in stats)
+        lines = [f"{'Stage'.ljust(width)}  {'us/call':>8}  {'share':>6}  {'calls':>9}"]
+        for name, stage in sorted(stats.items(), key=lambda item: -item[1].total_time):
+            share = stage.total_time / total * 100 if total > 0 else 0
+            lines.append(f"{name.ljust(width)}  {stage.mean_time * 1e6:8.3f}  {share:5.1f}%  {stage.calls:9d}")
+        return "\n".join(lines)
+
+PROFILER = StageProfiler()
+"""The profiler every instrumented stage reports to."""
@@ -0,0 +1,497 @@
+import argparse
+import binascii
+import multiprocessing
+import socket
+import struct
+import time
+from abc import ABC, abstractmethod
+from enum import IntEnum
+from typing import NamedTuple
+
+import numpy as np
+
+from .control.foc import FOCController
+from .io_interface import IOInterface
+from .main import TIMESTEP
+from .motor_sim import SimIOInterface
+from .motor_sim.properties import MotorProperties, REV_NEO_PROPS
+
+# An IO interface for a board (or a stand-in for one) on the other end of a serial port or socket, speaking a
+# compact binary framed protocol. Every frame is
+#
+#   2 bytes   sync b"\xa5\x5a"
+#   1 byte    frame type (FrameType)
+#   1 byte    sequence number, which replies echo
+#   2 bytes   payload length (uint16)
+#   payload
+#   2 bytes   CRC-16/CCITT of the type, sequence, length and payload (uint16)
+#
+# with every number little-endian and every sample float32, so a receiver can resynchronize on a corrupted serial
+# stream by scanning for the next sync whose CRC checks out. Payloads:
+#
+#   VOLTAGES  dt (float32), then N samples of phase voltages U, V and W. The board applies each for dt and replies
+#             with a SENSORS frame of N readings, one after each sample, so a frame can batch many samples.
+#   SENSORS   N samples of encoder angle and phase currents U, V and W
+#   READ      empty, answered with SENSORS holding the current reading
+#   RESET     empty, answered with SENSORS after resetting
+#   LEDS      1 byte bitmask of the debug LEDs, not answered
+#   PING      8 bytes, answered with PONG echoing them
+#
+# A closed control loop needs a round trip every tick, so `RemoteIOInterface.update` sends one sample per frame.
+# Open-loop excitation and telemetry can use `stream` instead, which batches samples and keeps several frames
+# in flight to measure the link's sustained sample rate.
+
+SYNC = b"\xa5\x5a"
+_HEADER = struct.Struct("<BBH")
+_CRC = struct.Struct("<H")
+_DT = struct.Struct("<f")
+_PING = struct.Struct("<d")
+VOLTAGE_SAMPLE = np.dtype(("<f4", 3))
+SENSOR_SAMPLE = np.dtype(("<f4", 4))
+MAX_SAMPLES_PER_FRAME = (0xFFFF - _DT.size) // VOLTAGE_SAMPLE.itemsize
+
+class FrameType(IntEnum):
+    VOLTAGES = 1
+    SENSORS = 2
+    READ = 3
+    RESET = 4
+    LEDS = 5
+    PING = 6
+    PONG = 7
+
+class Frame(NamedTuple):
+    type: FrameType
+    sequence: int
+    payload: bytes
+
+def is_valid_length(frame_type: int, length: int) -> bool:
+    """Whether a payload length fits the frame type, which catches most corrupted headers before their CRC arrives."""
+    match frame_type:
+        case FrameType.VOLTAGES:
+            return length >= _DT.size and (length - _DT.size) % VOLTAGE_SAMPLE.itemsize == 0
+        case FrameType.SENSORS:
+            return length % SENSOR_SAMPLE.itemsize == 0
+        case FrameType.READ | FrameType.RESET:
+            return length == 0
+        case FrameType.LEDS:
+            return length == 1
+        case FrameType.PING | FrameType.PONG:
+            return length == _PING.size
+    return False
+
+def encode_frame(frame_type: FrameType, sequence: int, payload: bytes = b"") -> bytes:
+    body = _HEADER.pack(frame_type, sequence & 0xFF, len(payload)) + payload
+    return SYNC + body + _CRC.pack(binascii.crc_hqx(body, 0xFFFF))
+
+class FrameDecoder:
+    """
+    Splits a byte stream into frames, skipping anything that isn't a frame with a valid length and CRC.
+    A corrupted length that still fits its frame type holds up decoding until that many bytes have arrived.
+    """
+
+    crc_errors: int
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data: bytes) -> list[Frame]:
+        buffer = self._buffer
+        buffer += data
+        frames: list[Frame] = []
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                # Keep a trailing first sync byte in case the second one is still on its way
+                del buffer[:max(len(buffer) - 1, 0)]
+                return frames
+            del buffer[:start]
+            if len(buffer) < len(SYNC) + _HEADER.size:
+                return frames
+            (frame_type, sequence, length) = _HEADER.unpack_from(buffer, len(SYNC))
+            end = len(SYNC) + _HEADER.size + length
+            valid = is_valid_length(frame_type, length)
+            if valid:
+                if len(buffer) < end + _CRC.size:
+                    return frames
+                (crc,) = _CRC.unpack_from(buffer, end)
+                valid = crc == binascii.crc_hqx(bytes(buffer[len(SYNC):end]), 0xFFFF)
+            if not valid:
+                # Not a real frame start, so look for the next sync after it
+                self.crc_errors += 1
+                del buffer[:1]
+                continue
+            frames.append(Frame(FrameType(frame_type), sequence, bytes(buffer[len(SYNC) + _HEADER.size:end])))
+            del buffer[:end + _CRC.size]
+
+class Transport(ABC):
+    @abstractmethod
+    def send(self, data: bytes):
+        pass
+
+    @abstractmethod
+    def receive(self) -> bytes:
+        """Block until some bytes arrive, returning b"" once the other end closes. Raises TimeoutError on timeout."""
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+class SocketTransport(Transport):
+    sock: socket.socket
+
+    def __init__(self, sock: socket.socket, timeout: float | None = 5.0):
+        self.sock = sock
+        sock.settimeout(timeout)
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Frames are small and latency matters more than packet count
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data: bytes):
+        self.sock.sendall(data)
+
+    def receive(self) -> bytes:
+        try:
+            return self.sock.recv(1 << 16)
+        except socket.timeout as e:
+            raise TimeoutError("Timed out waiting for the other end of the link") from e
+
+    def close(self):
+        self.sock.close()
+
+class SerialTransport(Transport):
+    """A serial port, which needs the optional pyserial package."""
+
+    def __init__(self, path: str, baudrate: int = 921600, timeout: float | None = 5.0):
+        try:
+            import serial
+        except ImportError as e:
+            raise ImportError("Serial links need pyserial (pip install pyserial)") from e
+        self.port = serial.Serial(path, baudrate, timeout=timeout)
+
+    def send(self, data: bytes):
+        self.port.write(data)
+
+    def receive(self) -> bytes:
+        data = self.port.read(self.port.in_waiting or 1)
+        if not data:
+            raise TimeoutError("Timed out waiting for the other end of the link")
+        return data
+
+    def close(self):
+        self.port.close()
+
+def parse_address(spec: str) -> tuple[str, str, int]:
+    """Split "tcp:HOST:PORT" or "serial:PATH[,BAUD]" into the kind, the host or path, and the port or baud rate."""
+    (kind, _, arguments) = spec.partition(":")
+    if kind == "tcp":
+        (host, _, port) = arguments.rpartition(":")
+        return (kind, host or "127.0.0.1", int(port))
+    if kind == "serial":
+        (path, _, baudrate) = arguments.partition(",")
+        return (kind, path, int(baudrate) if baudrate else 921600)
+    raise ValueError(f"Unknown link {kind!r}, expected tcp:HOST:PORT or serial:PATH[,BAUD]")
+
+def connect(spec: str, timeout: float | None = 5.0) -> Transport:
+    """Open the host end of a link (see `parse_address`)."""
+    (kind, location, number) = parse_address(spec)
+    if kind == "serial":
+        return SerialTransport(location, number, timeout)
+    return SocketTransport(socket.create_connection((location, number), timeout), timeout)
+
+class FrameLink:
+    """Sends and receives frames over a transport, counting the bytes that cross it."""
+
+    transport: Transport
+    bytes_sent: int
+    bytes_received: int
+
+    def __init__(self, transport: Transport):
+        self.transport = transport
+        self.decoder = FrameDecoder()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._sequence = 0
+        self._received: list[Frame] = []
+
+    def send(self, frame_type: FrameType, payload: bytes = b"", sequence: int | None = None) -> int:
+        """Send a frame, returning its sequence number. Replies pass the sequence of the frame they answer."""
+        if sequence is None:
+            sequence = self._sequence
+            self._sequence = (self._sequence + 1) & 0xFF
+        data = encode_frame(frame_type, sequence, payload)
+        self.transport.send(data)
+        self.bytes_sent += len(data)
+        return sequence
+
+    def receive(self) -> Frame | None:
+        """The next frame, or None once the other end closes."""
+        while not self._received:
+            data = self.transport.receive()
+            if not data:
+                return None
+            self.bytes_received += len(data)
+            self._received = self.decoder.feed(data)
+        return self._received.pop(0)
+
+    def expect(self, frame_type: FrameType, sequence: int) -> Frame:
+        frame = self.receive()
+        if frame is None:
+            raise ConnectionError("The other end of the link closed")
+        if frame.type != frame_type or frame.sequence != sequence:
+            raise ConnectionError(f"Expected {frame_type.name} #{sequence}, got {frame.type.name} #{frame.sequence}")
+        return frame
+
+    def close(self):
+        self.transport.close()
+
+class RemoteIOInterface(IOInterface):
+    """Drives a motor on the other end of a link, like a board running the firmware or `serve`."""
+
+    properties: MotorProperties
+    link: FrameLink
+
+    def __init__(self, transport: Transport, properties: MotorProperties = REV_NEO_PROPS):
+        self.properties = properties
+        self.link = FrameLink(transport)
+        self._reading = (0.0, 0.0, 0.0, 0.0)
+        self.read()
+
+    def _store(self, frame: Frame) -> np.ndarray:
+        readings = np.frombuffer(frame.payload, dtype=SENSOR_SAMPLE)
+        if len(readings):
+            self._reading = tuple(readings[-1].tolist())
+        return readings
+
+    def get_encoder_position(self) -> float:
+        return self._reading[0]
+
+    def get_phase_currents(self) -> tuple[float, float, float]:
+        return (self._reading[1], self._reading[2], self._reading[3])
+
+    def read(self):
+        """Refresh the readings without applying any voltages."""
+        self._store(self.link.expect(FrameType.SENSORS, self.link.send(FrameType.READ)))
+
+    def update(self, dt: float, phase_voltages: tuple[float, float, float]):
+        self.last_phase_voltages = phase_voltages
+        payload = _DT.pack(dt) + np.array(phase_voltages, dtype=VOLTAGE_SAMPLE.base).tobytes()
+        self._store(self.link.expect(FrameType.SENSORS, self.link.send(FrameType.VOLTAGES, payload)))
+
+    def stream(self, dt: float, phase_voltages: np.ndarray, batch_size: int = 256, in_flight: int = 4) -> np.ndarray:
+        """
+        Apply phase voltages with shape (samples, 3) for `dt` seconds each, sending `batch_size` samples per frame
+        with up to `in_flight` frames awaiting replies. Returns the readings after every sample with shape
+        (samples, 4), as encoder angle and phase currents U, V and W.
+        """
+        if not 1 <= batch_size <= MAX_SAMPLES_PER_FRAME:
+            raise ValueError(f"batch_size must be between 1 and {MAX_SAMPLES_PER_FRAME}, got {batch_size}")
+        voltages = np.ascontiguousarray(phase_voltages, dtype=VOLTAGE_SAMPLE.base)
+        readings = np.empty((len(voltages), 4), dtype=np.float32)
+        pending: list[tuple[int, int]] = []
+        (sent, received) = (0, 0)
+        while received < len(voltages):
+            while sent < len(voltages) and len(pending) < in_flight:
+                batch = voltages[sent:sent + batch_size]
+                pending.append((self.link.send(FrameType.VOLTAGES, _DT.pack(dt) + batch.tobytes()), len(batch)))
+                sent += len(batch)
+            (sequence, count) = pending.pop(0)
+            batch_readings = self._store(self.link.expect(FrameType.SENSORS, sequence))
+            if len(batch_readings) != count:
+                raise ConnectionError(f"Expected {count} readings, got {len(batch_readings)}")
+            readings[received:received + count] = batch_readings
+            received += count
+        if len(voltages):
+            self.last_phase_voltages = tuple(voltages[-1].tolist())
+        return readings
+
+    def set_debug_leds(self, led1: bool, led2: bool, led3: bool):
+        super().set_debug_leds(led1, led2, led3)
+        self.link.send(FrameType.LEDS, bytes([led1 | led2 << 1 | led3 << 2]))
+
+    def reset(self):
+        self.last_phase_voltages = (0, 0, 0)
+        self._store(self.link.expect(FrameType.SENSORS, self.link.send(FrameType.RESET)))
+
+    def ping(self) -> float:
+        """Time a round trip that does no work on the other end, in seconds."""
+        start = time.perf_counter()
+        self.link.expect(FrameType.PONG, self.link.send(FrameType.PING, _PING.pack(start)))
+        return time.perf_counter() - start
+
+    def close(self):
+        self.link.close()
+
+def _get_reading(io: SimIOInterface) -> tuple[float, float, float, float]:
+    return (io.get_encoder_position(), *io.get_phase_currents())
+
+def serve(transport: Transport, properties: MotorProperties = REV_NEO_PROPS, realtime: bool = False):
+    """
+    Play the board's role over a link until the other end closes, simulating the motor with a `SimIOInterface`.
+    With `realtime`, voltage samples are applied no faster than their dt, like the board would.
+    """
+    io = SimIOInterface(properties)
+    link = FrameLink(transport)
+    next_time = time.perf_counter()
+    while (frame := link.receive()) is not None:
+        match frame.type:
+            case FrameType.VOLTAGES:
+                (dt,) = _DT.unpack_from(frame.payload)
+                voltages = np.frombuffer(frame.payload, dtype=VOLTAGE_SAMPLE, offset=_DT.size).tolist()
+                readings = []
+                for phase_voltages in voltages:
+                    if realtime:
+                        # Don't try to catch up after falling behind, just like a PWM timer wouldn't
+                        next_time = max(next_time + dt, time.perf_counter())
+                        while time.perf_counter() < next_time:
+                            pass
+                    io.update(dt, tuple(phase_voltages))
+                    readings.append(_get_reading(io))
+                link.send(FrameType.SENSORS, np.array(readings, dtype=np.float32).tobytes(), frame.sequence)
+            case FrameType.READ | FrameType.RESET:
+                if frame.type == FrameType.RESET:
+                    io.reset()
+                link.send(FrameType.SENSORS, np.array(_get_reading(io), dtype=np.float32).tobytes(), frame.sequence)
+            case FrameType.LEDS:
+                bits = frame.payload[0] if frame.payload else 0
+                io.set_debug_leds(bool(bits & 1), bool(bits & 2), bool(bits & 4))
+            case FrameType.PING:
+                link.send(FrameType.PONG, frame.payload, frame.sequence)
+
+def listen(spec: str, properties: MotorProperties = REV_NEO_PROPS, realtime: bool = False):
+    """Serve one host at a time on "tcp:HOST:PORT", or the host on the other end of "serial:PATH[,BAUD]", forever."""
+    (kind, location, number) = parse_address(spec)
+    if kind == "serial":
+        serve(SerialTransport(location, number, timeout=None), properties, realtime)
+        return
+    with socket.create_server((location, number)) as server:
+        _serve_forever(server, properties, realtime)
+
+def _serve_forever(server: socket.socket, properties: MotorProperties, realtime: bool):
+    while True:
+        (sock, _) = server.accept()
+        transport = SocketTransport(sock, timeout=None)
+        try:
+            serve(transport, properties, realtime)
+        except ConnectionError:
+            pass
+        finally:
+            transport.close()
+
+def _run_loopback(server: socket.socket, properties: MotorProperties, realtime: bool):
+    with server:
+        _serve_forever(server, properties, realtime)
+
+class LoopbackServer:
+    """A local process standing in for the board, serving a simulated motor over TCP."""
+
+    address: str
+    """The link address to `connect` to."""
+
+    def __init__(self, properties: MotorProperties = REV_NEO_PROPS, realtime: bool = False):
+        # Bind before starting the process, so the port is known and connecting can't race the server
+        server = socket.create_server(("127.0.0.1", 0))
+        self.address = f"tcp:127.0.0.1:{server.getsockname()[1]}"
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=_run_loopback, args=(server, properties, realtime), daemon=True
+        )
+        self.process.start()
+        server.close()
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+
+    def __enter__(self) -> "LoopbackServer":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class LinkReport(NamedTuple):
+    round_trips: np.ndarray
+    """Seconds per empty round trip."""
+    lockstep_rate: float
+    """Closed-loop FOC ticks per second with one round trip per tick."""
+    stream_rate: float
+    """Samples per second streamed in batches."""
+    stream_bytes_per_sample: float
+    """Bytes crossing the link per streamed sample in both directions."""
+    batch_size: int
+
+    def format(self, control_rate: float = 1 / TIMESTEP) -> str:
+        (p50, p99) = np.percentile(self.round_trips, (50, 99)) * 1e6
+        return "\n".join([
+            f"Round trip: {p50:.1f} us median, {p99:.1f} us p99, {self.round_trips.max() * 1e6:.1f} us max",
+            f"Closed loop: {self.lockstep_rate:,.0f} ticks/s ({self.lockstep_rate / control_rate * 100:.1f}% of the {control_rate:,.0f} Hz control rate)",
+            f"Streaming: {self.stream_rate:,.0f} samples/s in batches of {self.batch_size} "
+            f"({self.stream_rate / control_rate * 100:.1f}% of the control rate, {self.stream_bytes_per_sample:.1f} bytes/sample)"
+        ])
+
+def measure_link(
+    io: RemoteIOInterface,
+    pings: int = 1000,
+    ticks: int = 2000,
+    samples: int = 200000,
+    batch_size: int = 256,
+    in_flight: int = 4,
+    dt: float = TIMESTEP
+) -> LinkReport:
+    """Measure the round trip latency, closed-loop control rate and batched streaming rate of a link."""
+    round_trips = np.array([io.ping() for _ in range(pings)])
+
+    io.reset()
+    ctrl = FOCController(io)
+    start = time.perf_counter()
+    for _ in range(ticks):
+        io.update(dt, ctrl.get_phase_voltages(dt))
+    lockstep_rate = ticks / (time.perf_counter() - start)
+
+    io.reset()
+    # A slow rotating voltage vector, so the streamed readings are realistic
+    angles = np.arange(samples) * (dt * 2 * np.pi * 5) - np.array([[0], [2 * np.pi / 3], [4 * np.pi / 3]])
+    voltages = (np.sin(angles) * 2).T
+    (sent, received) = (io.link.bytes_sent, io.link.bytes_received)
+    start = time.perf_counter()
+    io.stream(dt, voltages, batch_size, in_flight)
+    stream_rate = samples / (time.perf_counter() - start)
+    stream_bytes = io.link.bytes_sent - sent + io.link.bytes_received - received
+    return LinkReport(round_trips, lockstep_rate, stream_rate, stream_bytes / samples, batch_size)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a simulated motor over a link, or measure a link's latency and rate.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Play the board's role over a link")
+    serve_parser.add_argument("--listen", default="tcp:127.0.0.1:5555", help="tcp:HOST:PORT or serial:PATH[,BAUD]")
+    serve_parser.add_argument("--realtime", action="store_true", help="Apply samples no faster than their timestep")
+    measure_parser = subparsers.add_parser("measure", help="Measure round trip latency and sustained sample rate")
+    measure_parser.add_argument("--connect", help="tcp:HOST:PORT or serial:PATH[,BAUD]; a local loopback server by default")
+    measure_parser.add_argument("--realtime", action="store_true", help="Make the local loopback server run in real time")
+    measure_parser.add_argument("--pings", type=int, default=1000)
+    measure_parser.add_argument("--ticks", type=int, default=2000, help="Closed-loop control ticks to time")
+    measure_parser.add_argument("--samples", type=int, default=200000, help="Samples to stream")
+    measure_parser.add_argument("--batch-size", type=int, default=256, help="Samples per streamed frame")
+    measure_parser.add_argument("--in-flight", type=int, default=4, help="Streamed frames awaiting replies at once")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        print(f"Serving a simulated motor on {args.listen}")
+        listen(args.listen, realtime=args.realtime)
+        return
+
+    print("--- FOC motor controller link measurement ---")
+    loopback = LoopbackServer(realtime=args.realtime) if args.connect is None else None
+    try:
+        address = args.connect or loopback.address
+        io = RemoteIOInterface(connect(address))
+        print(f"Connected to {address}")
+        report = measure_link(io, args.pings, args.ticks, args.samples, args.batch_size, args.in_flight)
+        io.close()
+        print(report.format())
+    finally:
+        if loopback is not None:
+            loopback.close()
+
+if __name__ == "__main__":
+    main()
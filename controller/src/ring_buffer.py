@@ -0,0 +1,94 @@
+import numpy as np
+
+class RingBuffer:
+    """
+    A fixed-capacity circular buffer of samples across several channels, backed by a preallocated NumPy array.
+    Every sample is written twice, `capacity` apart, so the retained history of each channel is always
+    available as one contiguous view without copying or unwrapping.
+    """
+
+    capacity: int
+    channels: int
+    length: int
+    """The number of samples currently held."""
+    _data: np.ndarray
+    """Shape (channels, 2 * capacity)"""
+    _head: int
+    """The index the next sample is written to, in [0, capacity)."""
+
+    def __init__(self, channels: int, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.channels = channels
+        self.length = 0
+        self._data = np.full((channels, 2 * capacity), np.nan)
+        self._head = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def append(self, sample):
+        """Append one sample, which must have one value per channel. Overwrites the oldest sample when full."""
+        head = self._head
+        self._data[:, head] = sample
+        self._data[:, head + self.capacity] = sample
+        self._head = head + 1 if head + 1 < self.capacity else 0
+        if self.length < self.capacity:
+            self.length += 1
+
+    def extend(self, block: np.ndarray):
+        """Append several samples at once, given as an array of shape (channels, samples)."""
+        count = block.shape[1]
+        if count > self.capacity:
+            block = block[:, -self.capacity:]
+            count = self.capacity
+        indices = (self._head + np.arange(count)) % self.capacity
+        self._data[:, indices] = block
+        self._data[:, indices + self.capacity] = block
+        self._head = (self._head + count) % self.capacity
+        self.length = min(self.length + count, self.capacity)
+
+    def view(self, channel: int) -> np.ndarray:
+        """A contiguous read-only view of a channel's samples from oldest to newest."""
+        end = self._head + self.capacity
+        view = self._data[channel, end - self.length:end]
+        view.flags.writeable = False
+        return view
+
+    def latest(self, channel: int) -> float:
+        return float(self._data[channel, self._head + self.capacity - 1])
+
+    def oldest(self, channel: int) -> float:
+        return float(self._data[channel, self._head + self.capacity - self.length])
+
+    def add_channel(self) -> int:
+        """Add a channel, filled with NaN for samples that were appended before it existed. Returns its index."""
+        self._data = np.vstack((self._data, np.full((1, 2 * self.capacity), np.nan)))
+        self.channels += 1
+        return self.channels - 1
+
+    def resize(self, capacity: int):
+        """Change the capacity, keeping as many of the most recent samples as fit."""
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, got {capacity}")
+        if capacity == self.capacity:
+            return
+
+        kept = min(self.length, capacity)
+        end = self._head + self.capacity
+        recent = self._data[:, end - kept:end]
+
+        data = np.full((self.channels, 2 * capacity), np.nan)
+        data[:, :kept] = recent
+        data[:, capacity:capacity + kept] = recent
+
+        self._data = data
+        self.capacity = capacity
+        self.length = kept
+        self._head = kept % capacity
+
+    def clear(self):
+        self._data.fill(np.nan)
+        self.length = 0
+        self._head = 0
@@ -0,0 +1,85 @@
+import time
+from typing import NamedTuple
+
+from .control import MotorController
+from .motor_sim import SimIOInterface
+
+class CostSplit(NamedTuple):
+    control_time: float
+    """Wall-clock time spent in the controller in seconds."""
+    physics_time: float
+    """Wall-clock time spent stepping the simulated plant in seconds."""
+    ticks: int
+    """The number of control ticks the times cover."""
+
+    @property
+    def control_fraction(self) -> float:
+        total = self.control_time + self.physics_time
+        return self.control_time / total if total > 0 else 0
+
+    def __str__(self) -> str:
+        per_tick = 1e6 / max(self.ticks, 1)
+        return (
+            f"Control: {self.control_time * per_tick:.2f} us/tick ({self.control_fraction * 100:.1f}%)\n"
+            f"Physics: {self.physics_time * per_tick:.2f} us/tick ({(1 - self.control_fraction) * 100:.1f}%)"
+        )
+
+class MultiRateScheduler:
+    """
+    Runs the controller at a fixed control rate, like the PWM-synchronous FOC loop on real hardware,
+    while the simulated plant takes `substeps` smaller physics steps per control tick.
+    The phase voltages are held constant between control ticks (a zero-order hold).
+    If the IO has an inverter, the controller emits duty cycles instead, and every physics step is one switching period.
+    """
+
+    io: SimIOInterface
+    ctrl: MotorController
+    control_period: float
+    """The time between controller updates in seconds."""
+    substeps: int
+    """The number of physics steps per control tick."""
+
+    control_time: float
+    physics_time: float
+    ticks: int
+
+    def __init__(self, io: SimIOInterface, ctrl: MotorController, control_period: float, substeps: int = 1):
+        if substeps < 1:
+            raise ValueError(f"substeps must be at least 1, got {substeps}")
+        self.io = io
+        self.ctrl = ctrl
+        self.control_period = control_period
+        self.substeps = substeps
+        self.reset_timing()
+
+    @property
+    def physics_dt(self) -> float:
+        return self.control_period / self.substeps
+
+    def tick(self):
+        """Run one controller update followed by `substeps` physics steps."""
+        dt = self.physics_dt
+        start = time.perf_counter()
+        if self.io.inverter is None:
+            phase_voltages = self.ctrl.get_phase_voltages(self.control_period)
+            control_end = time.perf_counter()
+            for _ in range(self.substeps):
+                self.io.update(dt, phase_voltages)
+        else:
+            duty_cycles = self.ctrl.get_duty_cycles(self.control_period)
+            control_end = time.perf_counter()
+            for _ in range(self.substeps):
+                self.io.update_duty_cycles(dt, duty_cycles)
+        physics_end = time.perf_counter()
+
+        self.control_time += control_end - start
+        self.physics_time += physics_end - control_end
+        self.ticks += 1
+
+    def get_cost_split(self) -> CostSplit:
+        return CostSplit(self.control_time, self.physics_time, self.ticks)
+
+    def reset_timing(self):
+        self.control_time = 0
+        self.physics_time = 0
+        self.ticks = 0
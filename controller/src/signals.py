@@ -0,0 +1,98 @@
+import math
+
+import numpy as np
+
+from .control import MotorController
+from .control.batched import BatchedMotorController, BatchedFOCController
+from .control.cascade import CascadedFOCController
+from .control.foc import FOCController
+from .motor_sim import SimIOInterface
+from .motor_sim.batched import BatchedSimIOInterface
+
+SignalSample = dict[str, dict[str, float]]
+"""Maps a signal group (one plot in the GUI) to the values of each of its series."""
+
+def sample_signals(io: SimIOInterface, ctrl: MotorController) -> SignalSample:
+    """
+    Sample every signal we plot from the current simulation and controller state.
+    This is shared by the GUI and the headless runner so both record the same data.
+    """
+    phase_currents = io.get_phase_currents()
+
+    sample: SignalSample = {
+        "Rotor Angle": {"Angle": io.get_encoder_position()},
+        "Rotor Velocity": {
+            "Velocity": io.motor.kinematic.rotor_angular_velocity * 60 / (2 * math.pi)
+        },
+        "Phase Voltages": {
+            "Phase U": io.last_phase_voltages[0],
+            "Phase V": io.last_phase_voltages[1],
+            "Phase W": io.last_phase_voltages[2]
+        },
+        "Phase Currents": {
+            "Phase U": phase_currents[0],
+            "Phase V": phase_currents[1],
+            "Phase W": phase_currents[2]
+        }
+    }
+
+    if isinstance(ctrl, FOCController):
+        sample["DQ Currents"] = {
+            "D-axis": ctrl.current_dq[0],
+            "Q-axis": ctrl.current_dq[1]
+        }
+        sample["DQ Voltage Output"] = {
+            "D-axis": ctrl.output_dq[0],
+            "Q-axis": ctrl.output_dq[1]
+        }
+        sample["DQ Integral Terms"] = {
+            "D-axis": ctrl.dq_integral_terms[0],
+            "Q-axis": ctrl.dq_integral_terms[1]
+        }
+
+    if isinstance(ctrl, CascadedFOCController):
+        sample["Outer Loop"] = {
+            "Setpoint": ctrl.setpoint,
+            "Position": ctrl.position,
+            "Velocity setpoint": ctrl.velocity_setpoint,
+            "Velocity": ctrl.get_mechanical_velocity(),
+            "Torque current": ctrl.torque_current
+        }
+
+    sample["Torque"] = {
+        "Total torque": io.motor.kinematic.torque,
+        "Electromagnetic torque": io.motor.kinematic.electromagnetic_torque,
+        "bEMF U torque": io.motor.electrical.bemf_torques[0] * phase_currents[0],
+        "bEMF V torque": io.motor.electrical.bemf_torques[1] * phase_currents[1],
+        "bEMF W torque": io.motor.electrical.bemf_torques[2] * phase_currents[2],
+        "Load torque": io.get_load_torque()
+    }
+
+    return sample
+
+def sample_batched_signals(io: BatchedSimIOInterface, ctrl: BatchedMotorController) -> dict[str, np.ndarray]:
+    """
+    The batched equivalent of `sample_signals`. Every signal has the motor index as its first axis,
+    and multi-series groups are stacked along the second axis in the same order `sample_signals` uses.
+    """
+    motor = io.motor
+    sample = {
+        "Rotor Angle": io.get_encoder_position(),
+        "Rotor Velocity": motor.kinematic.rotor_angular_velocity * 60 / (2 * math.pi),
+        "Phase Voltages": io.last_phase_voltages,
+        "Phase Currents": io.get_phase_currents()
+    }
+
+    if isinstance(ctrl, BatchedFOCController):
+        sample["DQ Currents"] = ctrl.current_dq
+        sample["DQ Voltage Output"] = ctrl.output_dq
+        sample["DQ Integral Terms"] = ctrl.dq_integral_terms
+
+    sample["Torque"] = np.column_stack((
+        motor.kinematic.torque,
+        motor.kinematic.electromagnetic_torque,
+        motor.electrical.bemf_torques * motor.electrical.phase_currents,
+        io.get_load_torque()
+    ))
+
+    return sample
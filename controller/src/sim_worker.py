@@ -0,0 +1,344 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+
+from .control import MotorController
+from .control.cascade import CascadedFOCController
+from .control.trajectory import make_transition
+from .headless import CONTROLLER_TYPES
+from .motor_sim import SimIOInterface
+from .motor_sim.loads import LoadModel
+from .profiler import PROFILER
+from .scheduler import CostSplit, MultiRateScheduler
+from .signals import SignalSample, sample_signals
+from .snapshot import PlotHistory, SimulationState
+from .telemetry import TelemetryRecorder
+
+# Runs the simulation on its own thread so the GUI frame rate and the simulation rate don't limit each other.
+# The GUI sends commands through a queue and receives batches of samples through a double buffer.
+
+@dataclass(frozen=True)
+class SetPaused:
+    paused: bool
+
+@dataclass(frozen=True)
+class Restart:
+    pass
+
+@dataclass(frozen=True)
+class SwitchController:
+    name: str
+    """A key of CONTROLLER_TYPES"""
+
+@dataclass(frozen=True)
+class SetSubsteps:
+    substeps: int
+
+@dataclass(frozen=True)
+class SetSampleSeparation:
+    sample_separation: int
+
+@dataclass(frozen=True)
+class SetSpeed:
+    speed: float | None
+    """The target simulated time per wall-clock time, or None to run as fast as possible."""
+
+@dataclass(frozen=True)
+class SetSetpoint:
+    """Move the setpoint of a CascadedFOCController, ignored by other controllers."""
+    mode: str
+    """One of CONTROL_MODES"""
+    target: float
+    profile: str
+    """How to get to the target, see `make_transition`"""
+    rate: float
+
+@dataclass(frozen=True)
+class SetLoad:
+    load: LoadModel | None
+
+@dataclass(frozen=True)
+class SaveState:
+    """Snapshot the simulation as the branch point, and also save it to `path` if given."""
+    path: str | None = None
+    plot_history: dict[str, PlotHistory] = field(default_factory=dict)
+    """The GUI's plots, which live on its thread, to restore along with the simulation."""
+
+@dataclass(frozen=True)
+class RestoreState:
+    """Continue from the state saved at `path`, or from the last branch point if None."""
+    path: str | None = None
+
+@dataclass(frozen=True)
+class StartRecording:
+    path: str
+    """The directory to stream a telemetry recording to"""
+
+@dataclass(frozen=True)
+class StopRecording:
+    pass
+
+WorkerCommand = (
+    SetPaused | Restart | SwitchController | SetSubsteps | SetSampleSeparation | SetSpeed | SetSetpoint
+    | SetLoad | SaveState | RestoreState | StartRecording | StopRecording
+)
+
+@dataclass
+class SimulationSnapshot:
+    """Everything the GUI needs from the simulation, published by the worker every few milliseconds."""
+
+    samples: list[tuple[float, SignalSample]] = field(default_factory=list)
+    """Every sample taken since the last snapshot the GUI consumed, oldest first."""
+    elapsed: float = 0
+    velocity: float = 0
+    angle: float = 0
+    torque: float = 0
+    update_rate: float = 0
+    """Control ticks per wall-clock second over the last publish interval."""
+    cost_split: CostSplit = CostSplit(0, 0, 0)
+    restored_history: dict[str, PlotHistory] | None = None
+    """Set when the simulation jumped to a saved state, whose plot contents replace the GUI's before `samples` are added."""
+    message: str | None = None
+    """The outcome of the last state command, for the GUI to show."""
+
+class SimulationWorker(threading.Thread):
+    # Ticks run between checks for commands, pacing and publishing
+    CHUNK_TICKS = 50
+    # Wall-clock time between published snapshots in seconds
+    PUBLISH_INTERVAL = 1 / 120
+    # Give up catching up to the target speed once we're this far behind in wall-clock seconds
+    MAX_LAG = 0.1
+
+    io: SimIOInterface
+    ctrl: MotorController
+    scheduler: MultiRateScheduler
+    timestep: float
+    paused: bool
+    speed: float | None
+    sample_separation: int
+    elapsed: float
+    recording_path: str | None
+    """Where samples are streamed to while recording. The recorder is created at the first sample."""
+    recorder: TelemetryRecorder | None
+    branch_point: SimulationState | None
+    """The state saved by the last SaveState, which RestoreState returns to."""
+
+    def __init__(self, io: SimIOInterface, ctrl: MotorController, timestep: float, sample_separation: int = 1, paused: bool = True):
+        super().__init__(name="Simulation", daemon=True)
+        self.io = io
+        self.ctrl = ctrl
+        self.scheduler = MultiRateScheduler(io, ctrl, timestep)
+        self.timestep = timestep
+        self.paused = paused
+        self.speed = 1.0
+        self.sample_separation = sample_separation
+        self.elapsed = 0
+        self.recording_path = None
+        self.recorder = None
+        self.branch_point = None
+
+        self._commands: queue.SimpleQueue[WorkerCommand] = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        # The back buffer is only touched by the worker; the front buffer is swapped in under the lock
+        self._lock = threading.Lock()
+        self._back = SimulationSnapshot()
+        self._front: SimulationSnapshot | None = None
+
+    def send(self, command: WorkerCommand):
+        """Queue a command for the worker to apply before its next batch of ticks. Safe to call from any thread."""
+        self._commands.put(command)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self._stop_recording()
+
+    def take_snapshot(self) -> SimulationSnapshot | None:
+        """Take the latest snapshot, or None if nothing was published since the last call."""
+        with self._lock:
+            snapshot = self._front
+            self._front = None
+        return snapshot
+
+    def run(self):
+        self._reset_pacing()
+        last_publish = time.perf_counter()
+        ticks_since_publish = 0
+        updates_since_sample = 0
+
+        while not self._stopped.is_set():
+            self._apply_commands()
+            if self.paused:
+                continue
+
+            # Stay at the target speed by sleeping while the simulation is ahead of the wall clock
+            if self.speed is not None:
+                wall_elapsed = time.perf_counter() - self._pacing_wall_start
+                target_elapsed = self._pacing_sim_start + wall_elapsed * self.speed
+                if self.elapsed >= target_elapsed:
+                    time.sleep(0.0005)
+                    continue
+                if target_elapsed - self.elapsed > self.MAX_LAG * self.speed:
+                    self._reset_pacing()
+
+            for _ in range(self.CHUNK_TICKS):
+                self.scheduler.tick()
+                self.elapsed += self.timestep
+
+                updates_since_sample += 1
+                if updates_since_sample >= self.sample_separation:
+                    updates_since_sample = 0
+                    profiling = PROFILER.enabled
+                    lap = 0.0
+                    if profiling:
+                        lap = time.perf_counter()
+                    sample = sample_signals(self.io, self.ctrl)
+                    self._back.samples.append((self.elapsed, sample))
+                    if profiling:
+                        lap = PROFILER.lap("Signal sampling", lap)
+                    if self.recording_path is not None:
+                        self._record(sample)
+                        if profiling:
+                            PROFILER.lap("Telemetry recording", lap)
+            ticks_since_publish += self.CHUNK_TICKS
+
+            now = time.perf_counter()
+            if now - last_publish >= self.PUBLISH_INTERVAL:
+                self._publish(ticks_since_publish / (now - last_publish))
+                last_publish = now
+                ticks_since_publish = 0
+
+    def _record(self, sample: SignalSample):
+        if self.recorder is None:
+            self.recorder = TelemetryRecorder.for_sample(
+                self.recording_path, sample, self.timestep * self.sample_separation, self.elapsed
+            )
+        self.recorder.record(sample)
+
+    def _stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+        self.recorder = None
+        self.recording_path = None
+
+    def _publish(self, update_rate: float):
+        kinematic = self.io.motor.kinematic
+        back = self._back
+        back.elapsed = self.elapsed
+        back.velocity = kinematic.rotor_angular_velocity
+        back.angle = kinematic.rotor_angle
+        back.torque = kinematic.torque
+        back.update_rate = update_rate
+        back.cost_split = self.scheduler.get_cost_split()
+
+        with self._lock:
+            front = self._front
+            if front is not None:
+                # The GUI hasn't caught up, so keep what it hasn't seen yet, unless a restore made it obsolete
+                if back.restored_history is None:
+                    back.samples = front.samples + back.samples
+                    back.restored_history = front.restored_history
+                back.message = back.message or front.message
+            self._front = back
+        self._back = SimulationSnapshot()
+
+    def _save(self, path: str | None, plot_history: dict[str, PlotHistory]):
+        self.branch_point = SimulationState.capture(self.io, self.ctrl, self.elapsed, plot_history)
+        try:
+            if path is not None:
+                self.branch_point.save(path)
+            self._back.message = f"Saved state at {self.elapsed:.4f} s" + (f" to {path}" if path else "")
+        except (OSError, ValueError) as e:
+            # The branch point is still kept in memory
+            self._back.message = f"Couldn't save {path}: {e}"
+        if self.paused:
+            self._publish(0)
+
+    def _restore(self, path: str | None):
+        try:
+            state = SimulationState.load(path) if path is not None else self.branch_point
+        except (OSError, ValueError) as e:
+            self._back.message = f"Couldn't load {path}: {e}"
+            if self.paused:
+                self._publish(0)
+            return
+        if state is None:
+            self._back.message = "No branch point saved yet"
+            if self.paused:
+                self._publish(0)
+            return
+
+        (self.io, self.ctrl) = state.branch()
+        self.scheduler.io = self.io
+        self.scheduler.ctrl = self.ctrl
+        self.scheduler.reset_timing()
+        self.elapsed = state.elapsed
+        self._reset_pacing()
+        # Time jumps, so a recording continues in a new one
+        if self.recording_path is not None:
+            path = self.recording_path
+            self._stop_recording()
+            self.recording_path = f"{path}-branch"
+
+        self._back.samples = []
+        self._back.restored_history = state.plot_history
+        self._back.message = f"Restored state at {state.elapsed:.4f} s"
+        # Publish right away so the GUI updates even while paused
+        if self.paused:
+            self._publish(0)
+
+    def _reset_pacing(self):
+        self._pacing_wall_start = time.perf_counter()
+        self._pacing_sim_start = self.elapsed
+
+    def _apply_commands(self):
+        # Block while paused so an idle worker doesn't spin
+        block = self.paused
+        while True:
+            try:
+                command = self._commands.get(block=block, timeout=0.05 if block else None)
+            except queue.Empty:
+                return
+            block = False
+
+            match command:
+                case SetPaused(paused):
+                    self.paused = paused
+                    self._reset_pacing()
+                case Restart():
+                    self.io.reset()
+                    self.ctrl.reset()
+                    self.scheduler.reset_timing()
+                case SwitchController(name):
+                    self.ctrl = CONTROLLER_TYPES[name](self.io)
+                    self.scheduler.ctrl = self.ctrl
+                    self.scheduler.reset_timing()
+                case SetSubsteps(substeps):
+                    self.scheduler.substeps = substeps
+                    self.scheduler.reset_timing()
+                case SetSampleSeparation(sample_separation):
+                    self.sample_separation = sample_separation
+                    # A recording has a fixed sample interval, so continue in a new one
+                    if self.recording_path is not None:
+                        path = self.recording_path
+                        self._stop_recording()
+                        self.recording_path = f"{path}-{sample_separation}"
+                case SetSpeed(speed):
+                    self.speed = speed
+                    self._reset_pacing()
+                case SetSetpoint(mode, target, profile, rate):
+                    if isinstance(self.ctrl, CascadedFOCController):
+                        self.ctrl.set_mode(mode)
+                        self.ctrl.trajectory = make_transition(profile, self.ctrl.setpoint, target, self.ctrl.elapsed, rate)
+                case SetLoad(load):
+                    self.io.set_load(load)
+                case SaveState(path, plot_history):
+                    self._save(path, plot_history)
+                case RestoreState(path):
+                    self._restore(path)
+                case StartRecording(path):
+                    self._stop_recording()
+                    self.recording_path = path
+                case StopRecording():
+                    self._stop_recording()
@@ -0,0 +1,94 @@
+import copy
+import os
+import pickle
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
+
+import numpy as np
+
+from .control import MotorController
+from .motor_sim import SimIOInterface
+from .motor_sim.electrical_state import MotorElectricalState
+from .motor_sim.kinematic_state import MotorKinematicState
+from .motor_sim.properties import MotorProperties
+
+# Snapshots of a running simulation to branch new runs from, so experiments can start at an operating point
+# instead of re-simulating the spin-up every time. A state holds its own copies of the IO interface (the motor's
+# electrical and kinematic state, integrator, inverter and load) and the controller, and hands out fresh copies
+# every time it's branched, so one state can seed any number of runs.
+
+STATE_FORMAT_VERSION = 1
+
+class PlotHistory(NamedTuple):
+    """The samples held by one plot, oldest first."""
+
+    times: np.ndarray
+    series: dict[str, np.ndarray]
+
+@dataclass
+class SimulationState:
+    elapsed: float
+    """The simulated time of the snapshot in seconds."""
+    io: SimIOInterface
+    ctrl: MotorController
+    plot_history: dict[str, PlotHistory] = field(default_factory=dict)
+    """The GUI's plot contents at the time of the snapshot, by plot label."""
+
+    @staticmethod
+    def capture(
+        io: SimIOInterface,
+        ctrl: MotorController,
+        elapsed: float,
+        plot_history: dict[str, PlotHistory] | None = None
+    ) -> "SimulationState":
+        # Copy both at once so the copied controller keeps reading from the copied IO
+        (io, ctrl) = copy.deepcopy((io, ctrl))
+        return SimulationState(elapsed, io, ctrl, plot_history or {})
+
+    @property
+    def electrical(self) -> MotorElectricalState:
+        return self.io.motor.electrical
+
+    @property
+    def kinematic(self) -> MotorKinematicState:
+        return self.io.motor.kinematic
+
+    def branch(self) -> tuple[SimIOInterface, MotorController]:
+        """Copies of the IO interface and controller to continue exactly where the snapshot left off."""
+        return copy.deepcopy((self.io, self.ctrl))
+
+    def branch_with(
+        self,
+        controller_type: type[MotorController] | None = None,
+        properties: MotorProperties | None = None,
+        controller_args: dict[str, Any] | None = None
+    ) -> tuple[SimIOInterface, MotorController]:
+        """
+        Continue the plant from the snapshot under a newly built controller, e.g. with different gains for a sweep.
+        The new controller inherits the dynamic state of the snapshot's controller (see `MotorController.get_state`),
+        so with the same type and arguments this continues exactly like `branch`.
+        `properties` replaces the motor properties, keeping the motor's state.
+        """
+        (io, ctrl) = self.branch()
+        if properties is not None:
+            io.motor.properties = properties
+        new_ctrl = (controller_type or type(ctrl))(io, **(controller_args or {}))
+        if type(new_ctrl) is type(ctrl):
+            new_ctrl.set_state(ctrl.get_state())
+        return (io, new_ctrl)
+
+    def save(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb") as file:
+            pickle.dump({"version": STATE_FORMAT_VERSION, "state": self}, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str) -> "SimulationState":
+        # Only load states you saved yourself: like any pickle, a state file can run arbitrary code
+        with open(path, "rb") as file:
+            contents = pickle.load(file)
+        if not isinstance(contents, dict) or contents.get("version") != STATE_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a simulation state of format version {STATE_FORMAT_VERSION}")
+        return contents["state"]
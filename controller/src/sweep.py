@@ -0,0 +1,214 @@
+import argparse
+import csv
+import functools
+import itertools
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from .detectors import DivergenceDetector, SteadyStateDetector
+from .headless import CONTROLLER_TYPES, run_headless
+from .main import TIMESTEP
+from .metrics import compute_metrics
+from .motor_sim.properties import MotorProperties, REV_NEO_PROPS, replace_properties
+from .snapshot import SimulationState
+
+# Parameters are named "controller.<argument>" for controller constructor arguments
+# (e.g. controller.bandwidth, controller.phase_advance) and "motor.<field>" for MotorProperties fields
+# (e.g. motor.rotor_inertia).
+
+CONTROLLER_PREFIX = "controller."
+MOTOR_PREFIX = "motor."
+
+SweepPoint = dict[str, float]
+
+def make_grid(axes: dict[str, Sequence[float]]) -> list[SweepPoint]:
+    """Every combination of the given parameter values."""
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))]
+
+def make_random_samples(ranges: dict[str, tuple[float, float]], count: int, seed: int | None = None) -> list[SweepPoint]:
+    """`count` points sampled uniformly from the given (low, high) parameter ranges."""
+    rng = random.Random(seed)
+    return [{name: rng.uniform(low, high) for name, (low, high) in ranges.items()} for _ in range(count)]
+
+def split_parameters(point: SweepPoint) -> tuple[dict[str, float], dict[str, float]]:
+    """Split a sweep point into controller arguments and motor property overrides."""
+    controller_args: dict[str, float] = {}
+    motor_args: dict[str, float] = {}
+    for name, value in point.items():
+        if name.startswith(CONTROLLER_PREFIX):
+            controller_args[name.removeprefix(CONTROLLER_PREFIX)] = value
+        elif name.startswith(MOTOR_PREFIX):
+            motor_args[name.removeprefix(MOTOR_PREFIX)] = value
+        else:
+            raise ValueError(f"Sweep parameter {name!r} must start with {CONTROLLER_PREFIX!r} or {MOTOR_PREFIX!r}")
+    return (controller_args, motor_args)
+
+@dataclass
+class SweepConfig:
+    controller: str = "FOC"
+    """A key of CONTROLLER_TYPES"""
+    base_properties: MotorProperties = field(default_factory=lambda: REV_NEO_PROPS)
+    duration: float = 0.5
+    timestep: float = TIMESTEP
+    sample_separation: int = 1
+    initial_state: str | None = None
+    """A saved simulation state (see snapshot.py) to start every run from instead of standstill.
+    Motor property overrides then apply to the state's properties instead of `base_properties`."""
+    early_stop: bool = False
+    """Stop each run once it settles or diverges instead of always simulating `duration`."""
+
+@functools.cache
+def load_initial_state(path: str) -> SimulationState:
+    """Load a state once per worker process, since every run branches from a fresh copy anyway."""
+    return SimulationState.load(path)
+
+def run_sweep_point(config: SweepConfig, point: SweepPoint) -> dict[str, float]:
+    """Simulate one sweep point and return its parameters merged with its metrics. Runs in a worker process."""
+    (controller_args, motor_args) = split_parameters(point)
+    initial_state = load_initial_state(config.initial_state) if config.initial_state is not None else None
+    base = initial_state.io.motor.properties if initial_state is not None else config.base_properties
+    # Integer properties like pole_pairs are swept as floats
+    properties = replace_properties(base, motor_args)
+
+    start = time.perf_counter()
+    recording = run_headless(
+        CONTROLLER_TYPES[config.controller],
+        properties,
+        duration=config.duration,
+        timestep=config.timestep,
+        sample_separation=config.sample_separation,
+        controller_args=controller_args,
+        initial_state=initial_state,
+        detectors=[DivergenceDetector(), SteadyStateDetector()] if config.early_stop else ()
+    )
+    row = dict(point)
+    # Report the motor properties that were simulated, e.g. rounded pole counts, rather than the sampled values
+    row.update({MOTOR_PREFIX + name: getattr(properties, name) for name in motor_args})
+    row.update(compute_metrics(recording).as_dict())
+    if config.early_stop:
+        stop_reason = recording.stop_reason
+        row["stop_reason"] = stop_reason.kind if stop_reason is not None else "duration"
+        row["simulated_time"] = recording.steps * config.timestep
+        settle_time = stop_reason.settle_time if stop_reason is not None else None
+        row["detected_settle_time"] = settle_time - recording.start_time if settle_time is not None else math.nan
+    row["wall_time"] = time.perf_counter() - start
+    return row
+
+@dataclass
+class SweepResults:
+    rows: list[dict[str, float]] = field(default_factory=list)
+    wall_time: float = 0
+
+    def get_columns(self) -> list[str]:
+        columns: dict[str, None] = {}
+        for row in self.rows:
+            columns.update(dict.fromkeys(row))
+        return list(columns)
+
+    def write_csv(self, path: str):
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=self.get_columns())
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def format_table(self) -> str:
+        columns = self.get_columns()
+        def format_value(value) -> str:
+            return f"{value:.5g}" if isinstance(value, float) else str(value)
+        cells = [columns] + [[format_value(row.get(column, "")) for column in columns] for row in self.rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+        return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells)
+
+def run_sweep(config: SweepConfig, points: list[SweepPoint], workers: int | None = None) -> SweepResults:
+    """
+    Simulate every sweep point, fanned out across a process pool with one worker per core by default.
+    Rows come back in the same order as `points`.
+    """
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1:
+        rows = [run_sweep_point(config, point) for point in points]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(points) // (workers * 4))
+            rows = list(executor.map(run_sweep_point, itertools.repeat(config), points, chunksize=chunksize))
+    return SweepResults(rows, time.perf_counter() - start)
+
+def parse_parameter(spec: str) -> tuple[str, list[float] | tuple[float, float]]:
+    """Parse "name=a,b,c" into grid values or "name=low:high" into a random sample range."""
+    (name, values) = spec.split("=", 1)
+    if ":" in values:
+        (low, high) = values.split(":", 1)
+        return (name, (float(low), float(high)))
+    return (name, [float(value) for value in values.split(",")])
+
+def parse_setting(spec: str, prefix: str) -> tuple[str, float]:
+    """
+    Parse a single "name=value", also accepting `prefix` (CONTROLLER_PREFIX or MOTOR_PREFIX) as sweeps and the
+    autotuner print names.
+    """
+    (name, separator, value) = spec.partition("=")
+    if not separator:
+        raise ValueError(f"Expected NAME=VALUE, got {spec!r}")
+    return (name.removeprefix(prefix), float(value))
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep controller and motor parameters across a process pool.")
+    parser.add_argument("--controller", choices=list(CONTROLLER_TYPES), default="FOC")
+    parser.add_argument(
+        "--param", action="append", default=[], metavar="NAME=VALUES",
+        help="e.g. controller.bandwidth=2000,5000,10000 for a grid or motor.rotor_inertia=1e-4:3e-4 for random sampling"
+    )
+    parser.add_argument("--samples", type=int, default=16, help="Number of random samples when ranges are given")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=0.5, help="Simulated duration of each run in seconds")
+    parser.add_argument("--timestep", type=float, default=TIMESTEP)
+    parser.add_argument("--initial-state", help="Start every run from a state saved with controller-headless --save-state")
+    parser.add_argument("--early-stop", action="store_true", help="Stop each run once it settles or diverges")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the number of cores")
+    parser.add_argument("--output", help="Optional CSV file to write the results table to")
+    args = parser.parse_args()
+
+    grid_axes: dict[str, list[float]] = {}
+    ranges: dict[str, tuple[float, float]] = {}
+    for spec in args.param:
+        (name, values) = parse_parameter(spec)
+        if isinstance(values, tuple):
+            ranges[name] = values
+        else:
+            grid_axes[name] = values
+
+    # Random ranges are sampled independently for every grid point, each from its own seed so runs stay reproducible
+    points = make_grid(grid_axes)
+    if ranges:
+        points = [
+            grid_point | sample
+            for (index, grid_point) in enumerate(points)
+            for sample in make_random_samples(ranges, args.samples, args.seed + index if args.seed is not None else None)
+        ]
+
+    config = SweepConfig(
+        controller=args.controller,
+        duration=args.duration,
+        timestep=args.timestep,
+        initial_state=args.initial_state,
+        early_stop=args.early_stop
+    )
+    print(f"--- Sweeping {len(points)} runs of {args.controller} ---")
+    results = run_sweep(config, points, args.workers)
+
+    print(results.format_table())
+    simulated = sum(row.get("simulated_time", args.duration) for row in results.rows)
+    print(f"Simulated {simulated:.2f} s across {len(points)} runs in {results.wall_time:.2f} s ({simulated / results.wall_time * 100:.1f}% realtime)")
+    if args.output:
+        results.write_csv(args.output)
+        print(f"Wrote results to {args.output}")
+
+if __name__ == "__main__":
+    main()
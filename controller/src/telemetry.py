@@ -0,0 +1,184 @@
+import os
+import struct
+from typing import Iterable
+
+import numpy as np
+
+from .signals import SignalSample
+
+# A recording is a directory holding a small binary header plus one column file per channel.
+# Columns are raw little-endian arrays appended a chunk at a time, so a reader can memory-map
+# each channel as a single contiguous NumPy array without loading or copying it.
+#
+# Header layout (little-endian):
+#   8 bytes   magic b"FOCTLM\x00\x01"
+#   1 byte    dtype character ("f" for float32, "d" for float64)
+#   8 bytes   sample interval in seconds (float64)
+#   8 bytes   time of the first sample in seconds (float64)
+#   8 bytes   number of complete samples (uint64), rewritten on every flush
+#   4 bytes   number of channels (uint32)
+#   then per channel: 2 byte name length (uint16) and the UTF-8 name
+
+HEADER_NAME = "header.bin"
+MAGIC = b"FOCTLM\x00\x01"
+_FIXED_HEADER = struct.Struct("<8scddQI")
+_SAMPLE_COUNT_OFFSET = 8 + 1 + 8 + 8
+
+def get_column_name(index: int) -> str:
+    return f"{index:03d}.col"
+
+def get_channel_names(sample: SignalSample) -> list[str]:
+    """The channel names for a signal sample, as "group/series"."""
+    return [f"{group}/{series}" for group, values in sample.items() for series in values]
+
+class TelemetryRecorder:
+    """
+    Streams signal samples to a recording directory in chunks, holding at most one chunk in memory.
+    Samples missing a channel store NaN for it, and channels that weren't declared up front are ignored.
+    """
+
+    path: str
+    channels: list[str]
+    sample_interval: float
+    chunk_size: int
+    samples_written: int
+
+    def __init__(
+        self,
+        path: str,
+        channels: list[str],
+        sample_interval: float,
+        start_time: float = 0,
+        chunk_size: int = 8192,
+        dtype: str = "f"
+    ):
+        if dtype not in ("f", "d"):
+            raise ValueError(f"dtype must be 'f' (float32) or 'd' (float64), got {dtype!r}")
+        self.path = path
+        self.channels = channels
+        self.sample_interval = sample_interval
+        self.chunk_size = chunk_size
+        self.samples_written = 0
+
+        # Maps group -> series -> channel index so recording a sample doesn't build any strings
+        self._channel_indices: dict[str, dict[str, int]] = {}
+        for i, name in enumerate(channels):
+            (group, series) = name.split("/", 1)
+            self._channel_indices.setdefault(group, {})[series] = i
+        self._chunk = np.full((len(channels), chunk_size), np.nan, dtype=np.dtype(dtype).newbyteorder("<"))
+        self._chunk_length = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._header = open(os.path.join(path, HEADER_NAME), "wb")
+        self._header.write(_FIXED_HEADER.pack(MAGIC, dtype.encode(), sample_interval, start_time, 0, len(channels)))
+        for name in channels:
+            encoded = name.encode()
+            self._header.write(struct.pack("<H", len(encoded)) + encoded)
+        self._header.flush()
+
+        self._columns = [open(os.path.join(path, get_column_name(i)), "wb") for i in range(len(channels))]
+
+    @staticmethod
+    def for_sample(path: str, sample: SignalSample, sample_interval: float, start_time: float = 0, **kwargs) -> "TelemetryRecorder":
+        """Create a recorder with one channel per series of the given sample."""
+        return TelemetryRecorder(path, get_channel_names(sample), sample_interval, start_time, **kwargs)
+
+    def record(self, sample: SignalSample):
+        """Record one sample, as returned by `sample_signals`."""
+        column = self._chunk_length
+        chunk = self._chunk
+        indices = self._channel_indices
+        for group, values in sample.items():
+            group_indices = indices.get(group)
+            if group_indices is None:
+                continue
+            for series, value in values.items():
+                index = group_indices.get(series)
+                if index is not None:
+                    chunk[index, column] = value
+
+        self._chunk_length += 1
+        if self._chunk_length == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered partial chunk to disk and update the sample count in the header."""
+        if self._chunk_length == 0:
+            return
+        for column, data in zip(self._columns, self._chunk[:, :self._chunk_length]):
+            column.write(data.tobytes())
+            column.flush()
+        self.samples_written += self._chunk_length
+        self._chunk.fill(np.nan)
+        self._chunk_length = 0
+
+        # Only update the count once the data it covers is on disk
+        self._header.seek(_SAMPLE_COUNT_OFFSET)
+        self._header.write(struct.pack("<Q", self.samples_written))
+        self._header.flush()
+
+    def close(self):
+        self.flush()
+        self._header.close()
+        for column in self._columns:
+            column.close()
+
+    def __enter__(self) -> "TelemetryRecorder":
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class TelemetryReader:
+    """Reads a recording directory, memory-mapping every channel instead of loading it."""
+
+    path: str
+    channels: list[str]
+    sample_interval: float
+    start_time: float
+    sample_count: int
+    dtype: np.dtype
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, HEADER_NAME), "rb") as header:
+            (magic, dtype, self.sample_interval, self.start_time, self.sample_count, channel_count) = \
+                _FIXED_HEADER.unpack(header.read(_FIXED_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a telemetry recording")
+            self.channels = []
+            for _ in range(channel_count):
+                (length,) = struct.unpack("<H", header.read(2))
+                self.channels.append(header.read(length).decode())
+        self.dtype = np.dtype(dtype.decode()).newbyteorder("<")
+        self._maps: dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.sample_count
+
+    def __getitem__(self, channel: str) -> np.ndarray:
+        return self.get(channel)
+
+    def get(self, channel: str) -> np.ndarray:
+        """A read-only memory-mapped view of every sample of a channel."""
+        if channel not in self._maps:
+            if self.sample_count == 0:
+                return np.empty(0, dtype=self.dtype)
+            index = self.channels.index(channel)
+            self._maps[channel] = np.memmap(
+                os.path.join(self.path, get_column_name(index)),
+                dtype=self.dtype,
+                mode="r",
+                shape=(self.sample_count,)
+            )
+        return self._maps[channel]
+
+    def get_times(self) -> np.ndarray:
+        return self.start_time + np.arange(self.sample_count) * self.sample_interval
+
+    def iter_chunks(self, channels: Iterable[str], chunk_size: int = 1 << 20) -> Iterable[tuple[slice, dict[str, np.ndarray]]]:
+        """Yield (sample slice, channel -> view) pairs covering the recording in chunks of `chunk_size` samples."""
+        views = {name: self.get(name) for name in channels}
+        for start in range(0, self.sample_count, chunk_size):
+            span = slice(start, min(start + chunk_size, self.sample_count))
+            yield span, {name: view[span] for name, view in views.items()}
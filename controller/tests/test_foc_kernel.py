@@ -0,0 +1,64 @@
+import math
+
+import numpy as np
+import pytest
+
+from src.control.foc_kernel import BatchedFOCKernel, FOCKernel
+from src.control.id import IDController
+from src.control.transforms import VBUS_TO_DQ_LIMIT
+
+# The fused kernels must match the step-by-step reference loop, including when the output is clamped to the bus voltage
+
+KP = 0.4
+KI = 900.0
+VBUS = 12.0
+DT = 1e-4
+STEPS = 5000
+
+def make_kernel() -> FOCKernel:
+    return FOCKernel(IDController(KP, KI), IDController(KP, KI), VBUS)
+
+def random_inputs(rng: np.random.Generator, motors: int, scale: float) -> tuple[np.ndarray, np.ndarray]:
+    """Phase currents with shape (motors, 3) and electrical angles with shape (motors,)."""
+    return (rng.uniform(-scale, scale, (motors, 3)), rng.uniform(-10, 10, motors))
+
+def is_clamped(kernel: FOCKernel) -> bool:
+    return math.hypot(kernel.u_d, kernel.u_q) > VBUS_TO_DQ_LIMIT * VBUS
+
+@pytest.mark.parametrize("scale", [0.1, 1.0, 100.0])
+def test_fused_kernel_matches_reference(scale: float):
+    rng = np.random.default_rng(0)
+    reference = make_kernel()
+    fused = make_kernel()
+
+    clamped = 0
+    for _ in range(STEPS):
+        (currents, angles) = random_inputs(rng, 1, scale)
+        expected = reference.step_reference(*currents[0], angles[0], 0.0, -1.0, DT)
+        actual = fused.step(*currents[0], angles[0], 0.0, -1.0, DT)
+        assert max(abs(a - b) for a, b in zip(expected, actual)) < 1e-12
+        clamped += is_clamped(reference)
+
+    if scale == 100.0:
+        assert clamped > 0
+
+@pytest.mark.parametrize("scale", [0.1, 1.0, 100.0])
+def test_batched_kernel_matches_reference(scale: float):
+    motors = 16
+    rng = np.random.default_rng(1)
+    references = [make_kernel() for _ in range(motors)]
+    batched = BatchedFOCKernel(np.full(motors, KP), np.full(motors, KI), VBUS)
+    target_id = np.zeros(motors)
+    target_iq = np.full(motors, -1.0)
+
+    clamped = 0
+    for _ in range(STEPS // 5):
+        (currents, angles) = random_inputs(rng, motors, scale)
+        voltages = batched.step(currents, angles, target_id, target_iq, DT)
+        for motor, kernel in enumerate(references):
+            expected = kernel.step_reference(*currents[motor], angles[motor], 0.0, -1.0, DT)
+            assert np.max(np.abs(np.array(expected) - voltages[motor])) < 1e-10
+            clamped += is_clamped(kernel)
+
+    if scale == 100.0:
+        assert clamped > 0